@@ -1,4 +1,4 @@
-''' Run GrADS scripts to create 0.01 deg forcing data
+''' Run GrADS scripts (or the python downscaling, see downscale.py) to create 0.01 deg forcing data
 
 Usage:
     python create_conus_forcing.py [yyyymmddhh1] [yyyymmddhh2] [product_type]
@@ -17,6 +17,7 @@ from datetime import datetime, timedelta
 from mpi4py import MPI
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time
+import downscale
 
 
 ## some setups
@@ -92,6 +93,14 @@ def main(argv):
             arg4 = 'hrrr'     if tt2>last_nld2 else 'nldas2'
 
             cmd = f'opengrads -lbc "{gs} {tg1} {tg2} {arg3} {arg4}"'
+            if config['forcing'].get('downscale', {}).get('conus', 'grads')=='python' and not flag_lstm:
+                if not os.path.isfile(downscale.fmask):
+                    print(f'{downscale.fmask} not found (save it once with "downscale.py mask [GrADS output]"), GrADS used')
+                elif arg3=='realtime' and arg4=='hrrr':
+                    downscale.nrt(tt1.replace(tzinfo=None), tt2.replace(tzinfo=None))
+                    cmd = None
+                else:
+                    print(f'Python downscaling covers HRRR + real time Stage IV only, GrADS used for {arg4} + {arg3} Stage IV')
             
         else:
             
@@ -112,7 +121,8 @@ def main(argv):
                 
             cmd = f'opengrads -lbc "{gs} {tg1} {tg2} {arg3}"'
             
-        print(cmd); os.system(cmd)
+        if cmd is not None:
+            print(cmd); os.system(cmd)
 
     comm.Barrier()
 
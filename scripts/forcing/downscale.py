@@ -0,0 +1,423 @@
+''' Elevation (lapse-rate) downscaling of forcing fields with numpy, in place of the GrADS downscaling scripts
+
+Implements the downscaling equations of downscale_gfs_0.01deg.gs and comb_nwm_0.01deg_nrt.gs: temperature and
+pressure are brought to sea level with the low resolution terrain, interpolated together with relative humidity
+and the longwave emission ratio, and brought back with the high resolution terrain. The terrain, mask and
+interpolation operators are built once per process and kept resident, and all hours of a block are processed
+in one pass. Which engine (grads/python) a domain uses is set by forcing: downscale: in config.yaml.
+Interpolation clamps at the grid edges (see linear_weights), so outputs may differ from GrADS in the outermost
+strip of half a low resolution cell.
+
+Usage:
+    mpirun -np [# of procs] python downscale.py gfs [yyyymmddhh (GFS init)] [domain]
+    mpirun -np [# of procs] python downscale.py nrt [yyyymmddhh1] [yyyymmddhh2]   # HRRR + real time Stage IV over CONUS
+    python downscale.py mask [GrADS 0.01 deg CONUS output file]   # save the land mask of the GrADS outputs once
+    python downscale.py compare [output dir] [reference dir] [yyyymmdd] [rtol] [edge]   # e.g. python vs. GrADS, exits 1 if off
+Default values:
+    [rtol]: 1e-3, relative to the largest magnitude of each reference field
+    [edge]: 13, cells left out on each side of the grid
+'''
+
+__author__ = 'Ming Pan'
+__email__  = 'm3pan@ucsd.edu'
+__status__ = 'Development'
+
+import sys, os, time, math
+import numpy as np
+import netCDF4 as nc
+from glob import glob
+from datetime import datetime, timedelta
+from scipy import sparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
+from utilities import config
+
+## some setups
+nwmdir  = f'{config["base_dir"]}/forcing/nwm'
+fdem    = f'{nwmdir}/domain/gtopo30_nldas.ctl'
+fmask   = f'{nwmdir}/domain/msks_0.01deg_conus.nc'
+
+# some constants, as in the GrADS scripts
+lapse = -6.5/1000
+g     = 9.81
+ra    = 286.9
+sb    = 5.67e-8
+buff  = 4
+undef = np.float32(-9.99e8)
+
+# output variables: name, long name, standard name, units
+outvars = {'T2D':      ('tmp', 'Air Temperature', 'air_temperature', 'K'),
+           'Q2D':      ('sfh', 'Specific Humidity', 'specific_humidity', '1'),
+           'PSFC':     ('prs', 'Pressure', 'air_pressure', 'Pa'),
+           'U2D':      ('wsu', 'U Wind', 'eastward_wind', 'm/s'),
+           'V2D':      ('wsv', 'V Wind', 'northward_wind', 'm/s'),
+           'SWDOWN':   ('dsw', 'Downward Shortwave Radiation', 'surface_downwelling_shortwave_flux_in_air', 'W/m^2'),
+           'LWDOWN':   ('dlw', 'Downward Longwave Radiation', 'surface_downwelling_longwave_flux_in_air', 'W/m^2'),
+           'RAINRATE': ('pcp', 'Precipitation', 'precipitation_flux', 'kg/m^2/s')}
+
+## regular lat/lon grid of cell centers, as mkre() of the GrADS scripts
+class Grid:
+
+    def __init__(self, lat1, lat2, lon1, lon2, res):
+        self.res = res
+        self.lat = lat1 + res/2 + np.arange(round((lat2-lat1)/res))*res
+        self.lon = lon1 + res/2 + np.arange(round((lon2-lon1)/res))*res
+
+    @classmethod
+    def from_centers(cls, lat, lon):
+        grid = cls.__new__(cls)
+        grid.lat = np.asarray(lat, dtype=np.float64); grid.lon = np.asarray(lon, dtype=np.float64)
+        grid.res = abs(grid.lon[1]-grid.lon[0])
+        return grid
+
+    @property
+    def shape(self):
+        return (len(self.lat), len(self.lon))
+
+## 1-D box averaging operator [dst, src] (GrADS re(..., ba)), overlap-length weighted
+def box_weights(src, dst):
+
+    sres = abs(src[1]-src[0]); dres = abs(dst[1]-dst[0])
+    rows = []; cols = []; vals = []
+    for i, c in enumerate(dst):
+        lo, hi = c-dres/2, c+dres/2
+        j1 = max(int(np.floor((lo-src[0])/sres+0.5))-1, 0)
+        j2 = min(int(np.ceil((hi-src[0])/sres+0.5))+1, len(src))
+        for j in range(j1, j2):
+            ov = min(hi, src[j]+sres/2) - max(lo, src[j]-sres/2)
+            if ov>0:
+                rows.append(i); cols.append(j); vals.append(ov)
+    w = sparse.csr_matrix((vals, (rows, cols)), shape=(len(dst), len(src)))
+    return sparse.diags(1/np.maximum(np.asarray(w.sum(axis=1)).ravel(), 1e-30)) @ w
+
+## 1-D linear interpolation operator [dst, src] (GrADS re(..., bl)), clamped at the edges
+def linear_weights(src, dst):
+
+    '''dst centers beyond the outermost src centers take the edge value (constant, not linear, extrapolation);
+       with the grids used here that is the outer half low resolution cell of the high resolution grid
+       (0.125 deg for GFS, 0.015625 deg for HRRR) and the edges of the Stage IV domain, so differences
+       from GrADS there are expected and limited to those strips'''
+
+    pos = np.clip((np.asarray(dst)-src[0])/(src[1]-src[0]), 0, len(src)-1)
+    i0 = np.minimum(np.floor(pos).astype(np.int64), len(src)-2)
+    f  = pos - i0
+    rows = np.arange(len(dst))
+    w = sparse.csr_matrix((np.concatenate([1-f, f]), (np.concatenate([rows, rows]), np.concatenate([i0, i0+1]))), shape=(len(dst), len(src)))
+    w.eliminate_zeros()
+    return w
+
+## apply separable operators to [..., y, x] fields, NaN (missing) propagates from the cells used
+def apply2d(wy, wx, x):
+
+    lead = x.shape[:-2]; ny, nx = x.shape[-2:]
+    x = x.reshape(-1, ny, nx)
+    nt = x.shape[0]
+    y = (wx @ x.reshape(-1, nx).T).T                                       # [t*y, x']
+    y = y.reshape(nt, ny, -1).transpose(1, 0, 2).reshape(ny, -1)            # [y, t*x']
+    y = (wy @ y).reshape(wy.shape[0], nt, wx.shape[0]).transpose(1, 0, 2)   # [t, y', x']
+    return y.reshape(lead+y.shape[-2:])
+
+## fill missing cells from their valid neighbors, n passes (GrADS nfill(..., lat, n))
+def nfill(x, n=buff):
+
+    x = x.copy()
+    for _ in range(n):
+        miss = np.isnan(x)
+        if not miss.any():
+            break
+        pad = np.pad(x, [(0, 0)]*(x.ndim-2)+[(1, 1), (1, 1)], constant_values=np.nan)
+        ny, nx = x.shape[-2:]
+        nbrs = np.stack([pad[..., 1+dy:1+dy+ny, 1+dx:1+dx+nx] for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dy!=0 or dx!=0])
+        cnt = np.sum(~np.isnan(nbrs), axis=0)
+        fill = np.nansum(nbrs, axis=0)/np.maximum(cnt, 1)
+        x = np.where(miss & (cnt>0), fill, x)
+    return x
+
+## single-variable GrADS binary (ctl) or netCDF terrain: values (missing as 0), Grid
+def read_dem(fname):
+
+    if fname.endswith('.ctl'):
+        opts = {}; fmt = '>f4'
+        with open(fname, 'r') as f:
+            for line in f:
+                w = line.split()
+                if len(w)==0:
+                    continue
+                key = w[0].lower()
+                if key=='dset':
+                    opts['dset'] = w[1].replace('^', os.path.dirname(fname)+'/')
+                elif key=='undef':
+                    opts['undef'] = float(w[1])
+                elif key in ['xdef', 'ydef']:
+                    opts[key] = (int(w[1]), float(w[3]), float(w[4]))
+                elif key=='options':
+                    opts['yrev'] = 'yrev' in line.lower()
+                    fmt = '<f4' if 'little_endian' in line.lower() else '>f4'
+        nx, lon0, dlon = opts['xdef']; ny, lat0, dlat = opts['ydef']
+        dem = np.fromfile(opts['dset'], dtype=fmt, count=nx*ny).reshape(ny, nx).astype(np.float64)
+        if opts.get('yrev', False):
+            dem = dem[::-1, :]
+        dem[dem==opts.get('undef', -9.99e8)] = 0
+        grid = Grid.from_centers(lat0+np.arange(ny)*dlat, lon0+np.arange(nx)*dlon)
+    else:
+        with nc.Dataset(fname, 'r') as f:
+            name = [v for v in f.variables if f[v].ndim>=2][0]
+            dem  = np.ma.filled(np.ma.asarray(f[name][:]).reshape(f[name].shape[-2:]).astype(np.float64), 0)
+            grid = Grid.from_centers(f['lat'][:], f['lon'][:])
+    dem[~np.isfinite(dem)] = 0
+    return dem, grid
+
+## subset of a field on a (finer or equal) aligned grid by matching coordinates
+def subset(x, grid, sub):
+
+    j = np.rint((sub.lat-grid.lat[0])/(grid.lat[1]-grid.lat[0])).astype(np.int64)
+    i = np.rint((sub.lon-grid.lon[0])/(grid.lon[1]-grid.lon[0])).astype(np.int64)
+    if j[0]<0 or i[0]<0 or j[-1]>=len(grid.lat) or i[-1]>=len(grid.lon) or \
+       j[-1]-j[0]+1!=len(sub.lat) or i[-1]-i[0]+1!=len(sub.lon) or not np.allclose(grid.lat[j[0]:j[-1]+1], sub.lat, atol=sub.res/100) or not np.allclose(grid.lon[i[0]:i[-1]+1], sub.lon, atol=sub.res/100):
+        raise ValueError(f'grid lat {grid.lat[0]}..{grid.lat[-1]}, lon {grid.lon[0]}..{grid.lon[-1]} does not cover or align with '
+                         f'lat {sub.lat[0]}..{sub.lat[-1]}, lon {sub.lon[0]}..{sub.lon[-1]} at {sub.res} deg')
+    return x[..., j[0]:j[-1]+1, i[0]:i[-1]+1]
+
+## 2-D fields of a lat/lon netCDF file oriented south to north, west to east in -180..180, and their Grid,
+## whatever the order the file was written in
+def read_latlon(f, names):
+
+    grid = Grid.from_centers(f['lat'][:], f['lon'][:])
+    grid.lon = np.where(grid.lon>180, grid.lon-360, grid.lon)
+    jj = np.argsort(grid.lat, kind='stable'); ii = np.argsort(grid.lon, kind='stable')
+    grid.lat = grid.lat[jj]; grid.lon = grid.lon[ii]
+    xs = {name: np.ma.filled(np.ma.asarray(f[name][:]).reshape(f[name].shape[-2:]).astype(np.float64), np.nan)[jj][:, ii] for name in names}
+    return xs, grid
+
+## resident terrain, mask and operators of one downscaling configuration
+class Downscaler:
+
+    def __init__(self, lo, hi, nwm):
+        t0 = time.time()
+        self.lo, self.hi, self.nwm = lo, hi, nwm
+        dem, dgrid = read_dem(fdem)
+        self.demlo = apply2d(box_weights(dgrid.lat, lo.lat), box_weights(dgrid.lon, lo.lon), dem)
+        self.demhi = apply2d(box_weights(dgrid.lat, hi.lat), box_weights(dgrid.lon, hi.lon), dem)
+        self.lo2hi = (linear_weights(lo.lat, hi.lat), linear_weights(lo.lon, hi.lon))
+        self.hi2nwm = None
+        if not (len(hi.lat)==len(nwm.lat) and np.allclose(hi.lat, nwm.lat) and len(hi.lon)==len(nwm.lon) and np.allclose(hi.lon, nwm.lon)):
+            self.hi2nwm = (linear_weights(hi.lat, nwm.lat), linear_weights(hi.lon, nwm.lon))
+        with nc.Dataset(fmask, 'r') as f:
+            self.mask = subset(np.ma.filled(np.ma.asarray(f['msks'][:]).astype(np.float64), np.nan), Grid.from_centers(f['lat'][:], f['lon'][:]), nwm)
+        print(f'Terrain and operators ready in {time.time()-t0:.1f}s: lo {lo.shape}, hi {hi.shape}, nwm {nwm.shape}')
+
+    def to_hi(self, x, fill=True):
+        return apply2d(*self.lo2hi, nfill(x) if fill else x)
+
+    ## low resolution fields {tmp, prs, sfh, wsu, wsv, dsw, dlw, pcp}: [time, lo y, lo x] -> high resolution
+    def downscale(self, lo, pcphi=None):
+
+        tmplo = lo['tmp']; prslo = lo['prs']; sfhlo = lo['sfh']
+        tmpls = tmplo - self.demlo*lapse
+        prsls = prslo*np.exp(g/ra*self.demlo/((tmplo+tmpls)/2))
+        pvalo = sfhlo*prslo/(0.622+0.378*sfhlo)
+        pvslo = 6.112*100*np.exp(17.67*(tmplo-273.15)/(tmplo-273.15+243.5))
+        rlhlo = pvalo/pvslo
+        emvlo = 1.08*(1-np.exp(-np.power(pvalo/100, tmplo/2016)))
+        emilo = emvlo*sb*np.power(tmplo, 4)
+        remlo = lo['dlw']/emilo
+
+        tmphs = self.to_hi(tmpls)
+        prshs = self.to_hi(prsls)
+        hi = {}
+        hi['tmp'] = tmphs + self.demhi*lapse
+        hi['prs'] = prshs/np.exp(g/ra*self.demhi/((hi['tmp']+tmphs)/2))
+        del tmphs, prshs
+        pvahi = 6.112*100*np.exp(17.67*(hi['tmp']-273.15)/(hi['tmp']-273.15+243.5))*self.to_hi(rlhlo)
+        hi['sfh'] = 0.622*pvahi/(hi['prs']-0.378*pvahi)
+        emvhi = 1.08*(1-np.exp(-np.power(pvahi/100, hi['tmp']/2016)))
+        hi['dlw'] = emvhi*sb*np.power(hi['tmp'], 4)*self.to_hi(remlo)
+        del pvahi, emvhi
+        for v in ['dsw', 'wsu', 'wsv']:
+            hi[v] = self.to_hi(lo[v])
+        hi['pcp'] = self.to_hi(lo['pcp'], fill=False) if pcphi is None else pcphi
+        return hi
+
+    ## high resolution fields to the NWM 0.01 deg grid, masked
+    def to_nwm(self, hi):
+
+        if self.hi2nwm is None:
+            return {v: x*self.mask for v, x in hi.items()}
+        return {v: apply2d(*self.hi2nwm, x)*self.mask for v, x in hi.items()}
+
+## write one hour of NWM 0.01 deg forcing in the layout of the GrADS outputs
+def write_ldasin(fout, t, fields, grid):
+
+    os.makedirs(os.path.dirname(fout), exist_ok=True)
+    with nc.Dataset(fout+'.tmp', 'w', format='NETCDF4') as f:
+        f.createDimension('time', None); f.createDimension('lat', len(grid.lat)); f.createDimension('lon', len(grid.lon))
+        v = f.createVariable('time', 'f8', ('time',)); v.units = f'minutes since {t:%Y-%m-%d %H:00}'; v.calendar = 'standard'; v[:] = [0]
+        v = f.createVariable('lat', 'f8', ('lat',)); v.units = 'degrees_north'; v[:] = grid.lat
+        v = f.createVariable('lon', 'f8', ('lon',)); v.units = 'degrees_east'; v[:] = grid.lon
+        for name, (short, long_name, std_name, units) in outvars.items():
+            v = f.createVariable(name, 'f4', ('time', 'lat', 'lon'), zlib=True, complevel=1, fill_value=undef)
+            v.setncatts({'units': units, 'long_name': long_name, 'standard_name': std_name})
+            v[0] = np.ma.masked_invalid(fields[short]).astype(np.float32)
+    os.replace(fout+'.tmp', fout)
+
+## contiguous block of a list for this MPI rank
+def my_chunk(items, rank, size):
+
+    chunk = math.ceil(len(items)/size)
+    return items[chunk*rank:chunk*(rank+1)]
+
+## GFS 0.25 deg forecast to 0.01 deg NWM grid of a domain (downscale_gfs_0.01deg.gs)
+def gfs(t0, domain, rank=0, size=1, block=24):
+
+    lon1, lon2, lat1, lat2 = config['nwm_v3'][domain]['lonlatbox']
+    lo  = Grid(math.floor(lat1*4+0.5)/4-0.125, math.floor(lat2*4-0.0000001+0.5)/4+0.125, math.floor(lon1*4+0.5)/4-0.125, math.floor(lon2*4-0.0000001+0.5)/4+0.125, 0.25)
+    hi  = Grid(lo.lat[0]-0.125, lo.lat[-1]+0.125, lo.lon[0]-0.125, lo.lon[-1]+0.125, 0.0125)
+    nwm = Grid(math.floor(lat1*100-0.5+0.5)/100, math.floor(lat2*100+0.49999999+0.5)/100, math.floor(lon1*100-0.5+0.5)/100, math.floor(lon2*100+0.49999999+0.5)/100, 0.01)
+    ds = Downscaler(lo, hi, nwm)
+    gfsdir = f'{config["base_dir"]}/forcing/gfs/0.25deg/{t0:%Y%m%d%H}'
+    outdir = f'{config["base_dir"]}/forcing/gfs/0.01deg/{domain}'
+    nflx = {'tmp': 'tmp2m', 'prs': 'pressfc', 'sfh': 'spfh2m', 'wsu': 'ugrd10m', 'wsv': 'vgrd10m'}
+    flux = {'pcp': 'pratesfc', 'dlw': 'dlwrfsfc', 'dsw': 'dswrfsfc'}
+    cache = {}
+
+    def read(lead):
+        if lead not in cache:
+            with nc.Dataset(f'{gfsdir}/gfs_{t0+timedelta(hours=lead):%Y%m%d%H}.nc', 'r') as f:
+                rec, grid = read_latlon(f, list(nflx.values())+list(flux.values()))
+                cache[lead] = {name: subset(x, grid, lo) for name, x in rec.items()}
+        return cache[lead]
+
+    # fields at lead t (hours), with the time interpolation and flux de-averaging of the GrADS script
+    def fields(t):
+        hh = (t-1)%6
+        tlast = t//3*3; tnext = min(tlast+3, 384)
+        tlastflx = (t-1)//3*3; tnextflx = min(tlastflx+3, 384)
+        rec = {}
+        for v, name in nflx.items():
+            if t<=120:
+                rec[v] = read(t)[name]
+            else:
+                w1, w2 = ((tnext-t)/3, (t-tlast)/3) if tnext!=tlast else (0.5, 0.5)
+                rec[v] = read(tlast)[name]*w1 + read(tnext)[name]*w2
+        for v, name in flux.items():
+            if t<=120:
+                rec[v] = read(t)[name] if hh==0 else read(t)[name]*(hh+1) - read(t-1)[name]*hh
+            else:
+                rec[v] = read(tnextflx)[name] if hh<3 else read(tnextflx)[name]*2 - read(tlastflx)[name]
+        return rec
+
+    leads = my_chunk(list(range(1, 385)), rank, size)
+    for k in range(0, len(leads), block):
+        t1 = time.time()
+        tt = leads[k:k+block]
+        recs = [fields(t) for t in tt]
+        lof = {v: np.stack([rec[v] for rec in recs]) for v in recs[0].keys()}
+        out = ds.to_nwm(ds.downscale(lof))
+        for j, t in enumerate(tt):
+            tstamp = t0 + timedelta(hours=t)
+            write_ldasin(f'{outdir}/{tstamp:%Y/%Y%m/%Y%m%d%H}.LDASIN_DOMAIN1', tstamp, {v: x[j] for v, x in out.items()}, nwm)
+        for lead in [lead for lead in cache if lead<tt[-1]-6]:
+            del cache[lead]
+        print(f'GFS {domain} leads {tt[0]}-{tt[-1]}: {time.time()-t1:.1f}s ({(time.time()-t1)/len(tt)*24:.1f}s per forcing day)')
+
+## HRRR analysis + real time Stage IV to 0.01 deg CONUS (comb_nwm_0.01deg_nrt.gs with realtime hrrr)
+def nrt(t1, t2, rank=0, size=1):
+
+    hi = Grid(25, 53, -125, -67, 0.01)
+    lgrid = Grid(25, 53, -125, -67, 0.03125)
+    ds = Downscaler(lgrid, hi, hi)
+    hrrrdir = f'{config["base_dir"]}/forcing/hrrr/analysis'
+    stg4dir = f'{config["base_dir"]}/forcing/stage4/realtime'
+    names = {'tmp': 'tmp2m', 'prs': 'pressfc', 'sfh': 'spfh2m', 'wsu': 'ugrd10m', 'wsv': 'vgrd10m', 'dsw': 'dswrfsfc', 'dlw': 'dlwrfsfc', 'pcp': 'pratesfc'}
+    st42hi = None
+
+    hours = [t1+timedelta(hours=h) for h in range(int((t2-t1).total_seconds()//3600)+1)]
+    ttot = time.time()
+    for t in my_chunk(hours, rank, size):
+        tt = time.time()
+        # the HRRR analysis is read on its own lat/lon and checked against the 0.03125 deg grid, not assumed on it
+        with nc.Dataset(f'{hrrrdir}/{t:%Y%m%d}/hrrr_anal_{t:%Y%m%d%H}.nc', 'r') as f:
+            rec, grid = read_latlon(f, names.values())
+        lo = {v: subset(rec[name], grid, lgrid)[None] for v, name in names.items()}
+        # precipitation: Stage IV, gap-filled with HRRR
+        nl2hi = ds.to_hi(np.nan_to_num(lo['pcp']*3600, nan=0))
+        fst4 = f'{stg4dir}/pcpanl.{t:%Y%m%d}/st4_conus.{t:%Y%m%d%H}.01h.nc'
+        if os.path.isfile(fst4):
+            with nc.Dataset(fst4, 'r') as f:
+                rec, sgrid = read_latlon(f, ['apcpsfc'])
+            st42hi = apply2d(linear_weights(sgrid.lat, hi.lat), linear_weights(sgrid.lon, hi.lon), rec['apcpsfc'][None])
+            pcphi = np.where(np.isnan(st42hi), nl2hi, st42hi)/3600
+        else:
+            pcphi = nl2hi/3600
+        out = ds.to_nwm(ds.downscale(lo, pcphi))
+        write_ldasin(f'{nwmdir}/0.01deg/{t:%Y/%Y%m/%Y%m%d%H}.LDASIN_DOMAIN1', t, {v: x[0] for v, x in out.items()}, hi)
+        print(f'{t:%Y-%m-%d %H}: {time.time()-tt:.1f}s')
+    nh = len(my_chunk(hours, rank, size))
+    if nh>0:
+        print(f'{nh} hours in {time.time()-ttot:.1f}s ({(time.time()-ttot)/nh*24:.1f}s per forcing day)')
+
+## land mask (1 or missing) of a GrADS output, in place of the wrfinput/PF-CONUS2 mask built in the GrADS scripts
+def save_mask(fgrads):
+
+    with nc.Dataset(fgrads, 'r') as f:
+        msks = np.where(np.ma.getmaskarray(f['T2D'][0]), np.nan, 1).astype(np.float32)
+        lat = f['lat'][:]; lon = f['lon'][:]
+    with nc.Dataset(fmask, 'w') as f:
+        f.createDimension('lat', len(lat)); f.createDimension('lon', len(lon))
+        f.createVariable('lat', 'f8', ('lat',))[:] = lat
+        f.createVariable('lon', 'f8', ('lon',))[:] = lon
+        f.createVariable('msks', 'f4', ('lat', 'lon'), zlib=True, fill_value=undef)[:] = np.ma.masked_invalid(msks)
+    print(f'{fmask} saved from {fgrads}')
+
+## field by field comparison of the hourly outputs of a day in two directories, fails if any field is off
+def compare(dir1, dir2, day, rtol=1e-3, edge=13):
+
+    '''a field passes if all its cells differ by at most rtol times the largest magnitude of the field in dir2
+       (the reference, e.g. GrADS), and the same cells are missing in both; the outermost edge cells on each side
+       (13 = half a 0.25 deg GFS cell, see linear_weights) are left out, every file in dir1 must exist in dir2'''
+
+    rtol = float(rtol); edge = int(edge)
+    fn1s = sorted(glob(f'{dir1}/{day[:4]}/{day[:6]}/{day}??.LDASIN_DOMAIN1'))
+    assert len(fn1s)>0, f'no {day} outputs in {dir1}'
+    bad = []
+    for fn1 in fn1s:
+        fn2 = f'{dir2}/{day[:4]}/{day[:6]}/{os.path.basename(fn1)}'
+        if not os.path.isfile(fn2):
+            print(f'{fn2} not found')
+            bad.append(os.path.basename(fn1))
+            continue
+        with nc.Dataset(fn1, 'r') as f1, nc.Dataset(fn2, 'r') as f2:
+            for name in outvars.keys():
+                x = np.ma.asarray(f1[name][0]).astype(np.float64); y = np.ma.asarray(f2[name][:]).reshape(x.shape).astype(np.float64)
+                inner = (slice(edge, x.shape[0]-edge), slice(edge, x.shape[1]-edge))
+                x = x[inner]; y = y[inner]
+                both = ~np.ma.getmaskarray(x) & ~np.ma.getmaskarray(y)
+                d = np.abs(np.ma.getdata(x)[both]-np.ma.getdata(y)[both])
+                tol = rtol*np.abs(np.ma.getdata(y)[both]).max() if d.size>0 else 0
+                nmiss = np.sum(np.ma.getmaskarray(x)!=np.ma.getmaskarray(y))
+                nbad = np.sum(d>tol)
+                print(f'{os.path.basename(fn1)} {name:8s}: max abs diff {d.max() if d.size>0 else 0:.4g}, mean abs diff {d.mean() if d.size>0 else 0:.4g}, '
+                      f'tolerance {tol:.4g}, {nbad} cells beyond, {nmiss} cells differ in missing')
+                if nbad>0 or nmiss>0:
+                    bad.append(f'{os.path.basename(fn1)} {name}')
+    assert len(bad)==0, f'{dir1} does not match {dir2} within tolerance: {", ".join(bad)}'
+    return 0
+
+if __name__ == '__main__':
+    if len(sys.argv)>1 and sys.argv[1] in ['gfs', 'nrt']:
+        from mpi4py import MPI
+        comm = MPI.COMM_WORLD
+        if sys.argv[1]=='gfs':
+            gfs(datetime.strptime(sys.argv[2], '%Y%m%d%H'), sys.argv[3], comm.Get_rank(), comm.Get_size())
+        else:
+            nrt(datetime.strptime(sys.argv[2], '%Y%m%d%H'), datetime.strptime(sys.argv[3], '%Y%m%d%H'), comm.Get_rank(), comm.Get_size())
+        comm.Barrier()
+    elif len(sys.argv)>1 and sys.argv[1]=='mask':
+        save_mask(sys.argv[2])
+    elif len(sys.argv)>1 and sys.argv[1]=='compare':
+        try:
+            compare(*sys.argv[2:7])
+        except AssertionError as e:
+            print(e)
+            sys.exit(1)
+    else:
+        print(__doc__)
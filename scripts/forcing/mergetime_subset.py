@@ -1,5 +1,8 @@
 ''' Merge per-hour lat/lon forcing data into per-day, reproject to NWM grid, and subset it for domains of interest
 
+Each regridded CONUS field (one time step of one variable) is written to the CONUS file and subset to all domains
+before the next one is read, so memory per rank stays at a few CONUS fields.
+
 Usage:
     python mergetime_subset.py [yyyymmdd1] [yyyymmdd2] [retro|nrt]
 Default values:
@@ -15,6 +18,7 @@ from datetime import datetime, timedelta
 from mpi4py import MPI
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time
+import regrid
 
 ## some setups
 workdir   = f'{config["base_dir"]}/forcing/nwm'
@@ -24,6 +28,39 @@ comm = MPI.COMM_WORLD
 rank = comm.Get_rank()
 size = comm.Get_size()
 
+# domains whose index box is relative to another domain's grid
+parents = {'basins24': 'cnrfc', 'yampa': 'cbrfc'}
+
+## index box [x1, x2, y1, y2] of a domain as in its cdo selindexbox file, relative to the parent's grid for parents' children
+def indexbox(domain):
+
+    with open(f'domain/cdo_indexbox_{domain}.txt', 'r') as f:
+        return [int(i) for i in f.read().strip().split(',')]
+
+## index box [x1, x2, y1, y2] of a domain in the CONUS grid
+def conus_indexbox(domain):
+
+    x1, x2, y1, y2 = indexbox(domain)
+    if domain in parents:
+        px1, _, py1, _ = conus_indexbox(parents[domain])
+        x1, x2, y1, y2 = x1+px1-1, x2+px1-1, y1+py1-1, y2+py1-1
+    return [x1, x2, y1, y2]
+
+## mask added to a domain's subset, for a child domain also the parent's mask over its box, as when the child
+## was cut from the parent's masked output
+def domain_mask(domain):
+
+    mask = regrid.load_mask(f'domain/xmask0_{domain}.nc')
+    if domain in parents:
+        x1, x2, y1, y2 = indexbox(domain)
+        mask = mask + domain_mask(parents[domain])[y1-1:y2, x1-1:x2]
+    return mask
+
+## netCDF compression level of a domain's output
+def complevel(domain):
+
+    return config['forcing'].get('complevel', {}).get(domain, 1)
+
 ## main function
 def main(argv):
     
@@ -60,6 +97,19 @@ def main(argv):
         print(cmd); os.system(cmd)
 
         fsrc = fout
+        if config['forcing'].get('regrid', 'cdo')=='python':
+            # remap to the NWM 1km grid (weights loaded once per rank) and subset all domains, one field at a time
+            rg = regrid.load_regridder('domain/cdo_weights_conus.nc')
+            outs = [(f'1km/conus/{prodtype}/{t:%Y/%Y%m%d}.LDASIN_DOMAIN1', rg, None, complevel('conus'))]
+            for domain in config['forcing']['domains']:
+                outs.append((f'1km/{domain}/{prodtype}/{t:%Y/%Y%m%d}.LDASIN_DOMAIN1', regrid.SubGrid(rg, conus_indexbox(domain)),
+                             domain_mask(domain), complevel(domain)))
+            print(f'Regridding {fsrc} to {", ".join([out[0] for out in outs])}')
+            regrid.remap_stream(rg, [fsrc], outs, history='cdo_weights_conus.nc')
+            if prodtype != 'nrt':
+                os.system(f'/bin/rm -f {fsrc}')
+            continue
+
         cdocmd = 'cdo -f nc4 -z zip remap,domain/scrip_conus_bilinear.nc,domain/cdo_weights_conus.nc'
         fout = f'1km/conus/{prodtype}/{t:%Y/%Y%m%d}.LDASIN_DOMAIN1'
         dout = os.path.dirname(fout)
@@ -69,22 +119,16 @@ def main(argv):
             cmd = f'{cdocmd} {fsrc} {fout}' 
         else:
             cmd = f'{cdocmd} {fsrc} {fout}; /bin/rm -f {fsrc}'
-            #cmd = f'{cdocmd} {fsrc} {fout}' 
         print(cmd); os.system(cmd)
 
         fconus = fout
         for domain in config['forcing']['domains']:
 
-            if domain=='basins24':
-                fsrc = f'1km/cnrfc/{prodtype}/{t:%Y/%Y%m%d}.LDASIN_DOMAIN1'
-            elif domain=='yampa':
-                fsrc = f'1km/cbrfc/{prodtype}/{t:%Y/%Y%m%d}.LDASIN_DOMAIN1'
+            if domain in parents:
+                fsrc = f'1km/{parents[domain]}/{prodtype}/{t:%Y/%Y%m%d}.LDASIN_DOMAIN1'
             else:
                 fsrc = fconus
-            
-            with open(f'domain/cdo_indexbox_{domain}.txt', 'r') as f:
-                indexbox = f.read().rstrip()
-            cdocmd = f'cdo -f nc4 -z zip add -selindexbox,{indexbox}'
+            cdocmd = f'cdo -f nc4 -z zip add -selindexbox,{",".join([str(i) for i in indexbox(domain)])}'
             
             fout = f'1km/{domain}/{prodtype}/{t:%Y/%Y%m%d}.LDASIN_DOMAIN1'
             dout = os.path.dirname(fout)
@@ -21,6 +21,7 @@ import requests, re
 from bs4 import BeautifulSoup
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time, replace_brackets
+import grib_download
 
     
 ## some setups
@@ -30,7 +31,9 @@ lockfile = 'gfs.lock'
 gfs_ncep_url = 'https://nomads.ncep.noaa.gov/pub/data/nccf/com/gfs/prod'
 gfs_aws_url  = 'https://noaa-gfs-bdp-pds.s3.amazonaws.com'
 
-grep_cmd = 'grep -e DLWRF -e DSWRF -e "PRES:surface" -e ":TMP:2 m above ground" -e "UGRD:10 m above ground" -e "VGRD:10 m above ground" -e "SPFH:2 m above ground" -e "PRATE:surface:.-" -e "PRATE:surface:..-" -e "PRATE:surface:...-"'
+grib_patterns = ['DLWRF', 'DSWRF', 'PRES:surface', ':TMP:2 m above ground', 'UGRD:10 m above ground', 'VGRD:10 m above ground',
+                 'SPFH:2 m above ground', 'PRATE:surface:.-', 'PRATE:surface:..-', 'PRATE:surface:...-']
+nworkers = 8   # concurrent downloads
 cdocmd = 'cdo -f nc4 -z zip chname,sp,pressfc,\\2t,tmp2m,\\2sh,spfh2m,\\10u,ugrd10m,\\10v,vgrd10m,sdswrf,dswrfsfc,sdlwrf,dlwrfsfc,prate,pratesfc -sellonlatbox,-125,-67,25,53 -sellonlatbox,-180,180,-90,90'
 ncocmd = 'ncwa -a height,height_2'
 
@@ -62,8 +65,6 @@ def main(argv):
     last_fcst = find_last_gfs_fcst()
     print(f'Last GFS forecast initialized at: {last_fcst:%Y-%m-%dT%H}')
 
-    timeout = 'timeout 10m'
-
     if len(argv)==1:
         t0 = datetime.strptime(argv[0], '%Y%m%d%H')
         t0 = t0.replace(tzinfo=pytz.utc)
@@ -75,41 +76,48 @@ def main(argv):
 
     print(f'Retrieving GFS forecast initialized at: {t0:%Y-%m-%dT%H}')
 
-    i = 1
-    while i <= 384:
-
+    # all forecast hours: hourly to 120 h, 3-hourly to 384 h
+    hours = list(range(1, 120)) + list(range(120, 385, 3))
+    tasks = []
+    for i in hours:
         t = t0 + timedelta(hours=i)
-
         fullurl = f'{gfs_ncep_url}/gfs.{t0:%Y%m%d}/{t0:%H}/atmos/gfs.t{t0:%H}z.pgrb2.0p25.f{i:03d}'
         fout = f'{dout}/gfs_{t:%Y%m%d%H}.grb2'
-        cmd = f'get_inv.pl {fullurl}.idx | {grep_cmd} | get_grib.pl {fullurl} {fout}'
-        print(cmd); os.system(f'{timeout} {cmd}')
+        if not os.path.isfile(fout.replace('grb2', 'nc')):
+            tasks.append((fullurl, fout, grib_patterns))
 
-        # check data integrity
-        cmd = f'wgrib2 {fout} | wc -l'
-        ret = subprocess.check_output([cmd], shell=True)
-        nrecs = ret.decode().split(' ')[-1].rstrip()
+    # download concurrently, retrying the hours not yet on the server
+    while len(tasks)>0:
+
+        res = grib_download.download(tasks, f'{dout}/download.json', nworkers=nworkers, nrec=8)
+
+        for fullurl, fout, patterns in tasks:
+            if not res[fout]:
+                continue
+            # check data integrity
+            cmd = f'wgrib2 {fout} | wc -l'
+            ret = subprocess.check_output([cmd], shell=True)
+            nrecs = ret.decode().split(' ')[-1].rstrip()
         
-        if nrecs=='8':
-            print(f'{fout} is successfully retrieved.')
-            fnc = fout.replace('grb2', 'nc')
-            cmd = f'{cdocmd} {fout} {fnc}'
-            print(cmd); os.system(cmd)
-            cmd = f'{ncocmd} {fnc} {fnc}4'
-            print(cmd); os.system(cmd)
-            cmd = f'/bin/mv {fnc}4 {fnc}'
-            print(cmd); os.system(cmd)
-            cmd = f'/bin/rm -f {fout}'
-            print(cmd); os.system(cmd)
-
-            if i<120:
-                i += 1
+            if nrecs=='8':
+                print(f'{fout} is successfully retrieved.')
+                fnc = fout.replace('grb2', 'nc')
+                cmd = f'{cdocmd} {fout} {fnc}'
+                print(cmd); os.system(cmd)
+                cmd = f'{ncocmd} {fnc} {fnc}4'
+                print(cmd); os.system(cmd)
+                cmd = f'/bin/mv {fnc}4 {fnc}'
+                print(cmd); os.system(cmd)
+                cmd = f'/bin/rm -f {fout}'
+                print(cmd); os.system(cmd)
             else:
-                i += 3
-        else:
-            print(f'{fout} will be retried shortly.')
+                print(f'{fout} will be retried shortly.')
+                os.system(f'/bin/rm -f {fout}')
 
-        time.sleep(2)
+        tasks = [task for task in tasks if not os.path.isfile(task[1].replace('grb2', 'nc'))]
+        if len(tasks)>0:
+            print(f'{len(tasks)} forecast hours will be retried in 1 minute.')
+            time.sleep(60)
 
     # create GrADS control file
     os.system(f'/bin/cp {dout}/../gfs_fcst.ctl.tpl {dout}/gfs_fcst.ctl')
@@ -123,11 +131,18 @@ def main(argv):
     # downscale to 0.01 deg
     os.chdir(f'{config["base_dir"]}/forcing/nwm/')
     np = 12
-    python_script = '../../scripts/utils/run_grads_in_time_mpi.py'
-    grads_script  = '../../scripts/forcing/downscale_gfs_0.01deg.gs'
-    [lon1, lon2, lat1, lat2] = config[modelid][domain]['lonlatbox']
-    grads_args    = f'../gfs/0.25deg/{t0:%Y%m%d%H}/gfs_fcst.ctl {lon1} {lon2} {lat1} {lat2} ../gfs/0.01deg/{domain}'
-    cmd1 = f'unset SLURM_MEM_PER_NODE; mpirun -np {np} python {python_script} hourly {t1:%Y%m%d%H} {t2:%Y%m%d%H} {grads_script} "{grads_args}"'
+    fmask = f'{config["base_dir"]}/forcing/nwm/domain/msks_0.01deg_conus.nc'
+    if config['forcing'].get('downscale', {}).get(domain, 'grads')=='python' and not os.path.isfile(fmask):
+        print(f'{fmask} not found (save it once with "downscale.py mask [GrADS output]"), GrADS used')
+    if config['forcing'].get('downscale', {}).get(domain, 'grads')=='python' and os.path.isfile(fmask):
+        python_script = '../../scripts/forcing/downscale.py'
+        cmd1 = f'unset SLURM_MEM_PER_NODE; mpirun -np {np} python {python_script} gfs {t0:%Y%m%d%H} {domain}'
+    else:
+        python_script = '../../scripts/utils/run_grads_in_time_mpi.py'
+        grads_script  = '../../scripts/forcing/downscale_gfs_0.01deg.gs'
+        [lon1, lon2, lat1, lat2] = config[modelid][domain]['lonlatbox']
+        grads_args    = f'../gfs/0.25deg/{t0:%Y%m%d%H}/gfs_fcst.ctl {lon1} {lon2} {lat1} {lat2} ../gfs/0.01deg/{domain}'
+        cmd1 = f'unset SLURM_MEM_PER_NODE; mpirun -np {np} python {python_script} hourly {t1:%Y%m%d%H} {t2:%Y%m%d%H} {grads_script} "{grads_args}"'
     flog = f'../log/dnsc_gfs_{domain}_{t0:%Y%m%d%H}.txt'
     cmd = f'sbatch -t 00:20:00 --nodes=1 -p {config["part_shared"]} --ntasks-per-node={np} -J dnscgfs --wrap=\'{cmd1}\' -o {flog}'
     print(cmd)
@@ -140,10 +155,15 @@ def main(argv):
     os.makedirs(f'1km/{domain}/{t1:%Y}', exist_ok=True)
     os.makedirs(f'1km/{domain}/{t2:%Y}', exist_ok=True)
     np = 17
-    python_script = '../../scripts/utils/run_cmd_in_time_mpi.py'
     #cdo -f nc4 -z zip remap,domain/scrip_cnrfc_bilinear.nc,domain/cdo_weights_cnrfc.nc [ -mergetime 0.01deg/cnrfc/2025/202509/20250901??.LDASIN_DOMAIN1 ] 1km/cnrfc/2025/20250901.LDASIN_DOMAIN1.nc; cdo -f nc4 -z zip add 1km/cnrfc/2025/20250901.LDASIN_DOMAIN1.nc domain/xmask0_cnrfc.nc 1km/cnrfc/2025/20250901.LDASIN_DOMAIN1; /bin/rm -f 1km/cnrfc/2025/20250901.LDASIN_DOMAIN1.nc
-    cmd0 = f'cdo -f nc4 -z zip remap,domain/scrip_{domain}_bilinear.nc,domain/cdo_weights_{domain}.nc [ -mergetime 0.01deg/{domain}/%Y/%Y%m/%Y%m%d??.LDASIN_DOMAIN1 ] 1km/{domain}/%Y/%Y%m%d.LDASIN_DOMAIN1.nc; cdo -f nc4 -z zip add 1km/{domain}/%Y/%Y%m%d.LDASIN_DOMAIN1.nc domain/xmask0_{domain}.nc 1km/{domain}/%Y/%Y%m%d.LDASIN_DOMAIN1; /bin/rm -f 1km/{domain}/%Y/%Y%m%d.LDASIN_DOMAIN1.nc'
-    cmd1 = f'unset SLURM_MEM_PER_NODE; mpirun -np {np} python {python_script} daily {t1:%Y%m%d} {t2:%Y%m%d} "{cmd0}"'
+    if config['forcing'].get('regrid', 'cdo')=='python':
+        python_script = '../../scripts/utils/regrid.py'
+        regrid_args = f'domain/cdo_weights_{domain}.nc domain/xmask0_{domain}.nc {t1:%Y%m%d} {t2:%Y%m%d} "0.01deg/{domain}/%Y/%Y%m/%Y%m%d??.LDASIN_DOMAIN1" "1km/{domain}/%Y/%Y%m%d.LDASIN_DOMAIN1"'
+        cmd1 = f'unset SLURM_MEM_PER_NODE; mpirun -np {np} python {python_script} daily {regrid_args}'
+    else:
+        python_script = '../../scripts/utils/run_cmd_in_time_mpi.py'
+        cmd0 = f'cdo -f nc4 -z zip remap,domain/scrip_{domain}_bilinear.nc,domain/cdo_weights_{domain}.nc [ -mergetime 0.01deg/{domain}/%Y/%Y%m/%Y%m%d??.LDASIN_DOMAIN1 ] 1km/{domain}/%Y/%Y%m%d.LDASIN_DOMAIN1.nc; cdo -f nc4 -z zip add 1km/{domain}/%Y/%Y%m%d.LDASIN_DOMAIN1.nc domain/xmask0_{domain}.nc 1km/{domain}/%Y/%Y%m%d.LDASIN_DOMAIN1; /bin/rm -f 1km/{domain}/%Y/%Y%m%d.LDASIN_DOMAIN1.nc'
+        cmd1 = f'unset SLURM_MEM_PER_NODE; mpirun -np {np} python {python_script} daily {t1:%Y%m%d} {t2:%Y%m%d} "{cmd0}"'
     flog = f'../log/remap_gfs_{domain}_{t0:%Y%m%d%H}.txt'
     cmd = f'sbatch -d afterok:{jid1} -t 00:20:00 --nodes=1 -p {config["part_shared"]} --ntasks-per-node={np} -J remapgfs --wrap=\'{cmd1}\' -o {flog}'
     print(cmd)
@@ -20,6 +20,7 @@ import requests, re
 from bs4 import BeautifulSoup
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time
+import grib_download
 
     
 ## some setups
@@ -33,6 +34,10 @@ hrrr_aws_url  = 'https://noaa-hrrr-bdp-pds.s3.amazonaws.com'
 cdocmd = 'cdo -f nc4 -z zip chname,sp,pressfc,\\2t,tmp2m,\\2sh,spfh2m,\\10u,ugrd10m,\\10v,vgrd10m,sdswrf,dswrfsfc,sdlwrf,dlwrfsfc,prate,pratesfc -remap,latlon_conus_0.03125deg.txt,hrrr_to_0.03125deg_weight.nc'
 ncocmd = 'ncwa -a height,height_2'
 
+anal_patterns  = ['DLWRF', 'DSWRF', 'PRES:surface', 'TMP:2 m', 'UGRD:10 m', 'VGRD:10 m', 'SPFH']
+prate_patterns = ['PRATE']
+nworkers = 8   # concurrent downloads
+
 ## main function
 def main(argv):
     
@@ -67,8 +72,6 @@ def main(argv):
     last_anal = find_last_hrrr_anal()
     print(f'Last HRRR analysis time: {last_anal:%Y-%m-%dT%H}')
 
-    timeout = 'timeout 10m'
-
     if last_nc + timedelta(hours=1) < back_day:
         t1 = back_day
     else:
@@ -80,61 +83,64 @@ def main(argv):
         t1 = datetime.strptime(argv[0], '%Y%m%d%H')
         t2 = datetime.strptime(argv[1], '%Y%m%d%H')
 
+    # download the f00 analysis fields and the f01 precipitation of all hours concurrently
+    hours = []
     t = t1
     while t <= t2:
-
-        fullurl = f'{hrrr_aws_url}/hrrr.{t:%Y%m%d}/conus/hrrr.t{t:%H}z.wrfsfcf00.grib2'
-        cmd = f'get_inv.pl {fullurl}.idx | grep -e DLWRF -e DSWRF | get_grib.pl {fullurl} tmp15.grb2'
-        print(cmd); os.system(f'{timeout} {cmd}')
-        cmd = f'get_inv.pl {fullurl}.idx | grep -e "PRES:surface" | get_grib.pl {fullurl} tmp11.grb2'
-        print(cmd); os.system(f'{timeout} {cmd}')
-        cmd = f'get_inv.pl {fullurl}.idx | grep -e "TMP:2 m"      | get_grib.pl {fullurl} tmp12.grb2'
-        print(cmd); os.system(f'{timeout} {cmd}')
-        cmd = f'get_inv.pl {fullurl}.idx | grep -e "UGRD:10 m" -e "VGRD:10 m" | get_grib.pl {fullurl} tmp14.grb2'
-        print(cmd); os.system(f'{timeout} {cmd}')
-        cmd = f'get_inv.pl {fullurl}.idx | grep -e SPFH           | get_grib.pl {fullurl} tmp13.grb2'
-        print(cmd); os.system(f'{timeout} {cmd}')
-        cmd = 'cat tmp1?.grb2 > tmp1.grb2; rm -f tmp1?.grb2'
-        print(cmd); os.system(cmd)
-
-        t0 = t - timedelta(hours=1)
-        fullurl = f'{hrrr_aws_url}/hrrr.{t0:%Y%m%d}/conus/hrrr.t{t0:%H}z.wrfsfcf01.grib2'
-        cmd = f'get_inv.pl {fullurl}.idx | grep PRATE | get_grib.pl {fullurl} tmp0.grb2'
-        print(cmd); os.system(f'{timeout} {cmd}')
-        cmd = 'cat tmp1.grb2 tmp0.grb2 > tmp2.grb2'
-        print(cmd); os.system(cmd)
-
-        fout = f'analysis/{t:%Y%m%d}/hrrr_anal_{t:%Y%m%d%H}.grb2'
-        dout = os.path.dirname(fout)
-        if not os.path.isdir(dout):
-            os.system(f'mkdir -p {dout}')
-        cmd = f'wgrib2 tmp2.grb2 | grep -v "TMP:surface" | wgrib2 -i tmp2.grb2 -grib {fout}'
-        print(cmd); os.system(cmd)
-        cmd = 'rm -f tmp?.grb2 wget-log*'
-        print(cmd); os.system(cmd)
-        
-        # check data integrity
-        cmd = f'wgrib2 {fout} | wc -l'
-        ret = subprocess.check_output([cmd], shell=True)
-        nrecs = ret.decode().split(' ')[-1].rstrip()
-        
-        if nrecs=='8':
-            print(f'{fout} is successfully retrieved.')
-            fnc = fout.replace('grb2', 'nc')
-            cmd = f'{cdocmd} {fout} {fnc}'
+        hours.append(t)
+        t = t + timedelta(hours=1)
+
+    while len(hours)>0:
+
+        tasks = []
+        for t in hours:
+            t0 = t - timedelta(hours=1)
+            dout = f'analysis/{t:%Y%m%d}'
+            tasks.append((f'{hrrr_aws_url}/hrrr.{t:%Y%m%d}/conus/hrrr.t{t:%H}z.wrfsfcf00.grib2', f'{dout}/hrrr_anal_{t:%Y%m%d%H}.f00.grb2', anal_patterns))
+            tasks.append((f'{hrrr_aws_url}/hrrr.{t0:%Y%m%d}/conus/hrrr.t{t0:%H}z.wrfsfcf01.grib2', f'{dout}/hrrr_anal_{t:%Y%m%d%H}.f01.grb2', prate_patterns))
+        res = grib_download.download(tasks, 'analysis/download.json', nworkers=nworkers)
+
+        for t in hours:
+
+            fout = f'analysis/{t:%Y%m%d}/hrrr_anal_{t:%Y%m%d%H}.grb2'
+            f00 = fout.replace('grb2', 'f00.grb2')
+            f01 = fout.replace('grb2', 'f01.grb2')
+            if not (res[f00] and res[f01]):
+                print(f'{fout} will be retried in 1 minute.')
+                continue
+            cmd = f'cat {f00} {f01} > {fout}.tmp'
             print(cmd); os.system(cmd)
-            cmd = f'{ncocmd} {fnc} {fnc}4'
+            cmd = f'wgrib2 {fout}.tmp | grep -v "TMP:surface" | wgrib2 -i {fout}.tmp -grib {fout}'
             print(cmd); os.system(cmd)
-            cmd = f'/bin/mv {fnc}4 {fnc}'
+            cmd = f'rm -f {fout}.tmp {f00} {f01}'
             print(cmd); os.system(cmd)
-            cmd = f'/bin/rm -f {fout}'
-            print(cmd); os.system(cmd)
-
-            t = t + timedelta(hours=1)
-        else:
-            print(f'{fout} will be retried in 1 minute.')
-
-        time.sleep(6)
+        
+            # check data integrity
+            cmd = f'wgrib2 {fout} | wc -l'
+            ret = subprocess.check_output([cmd], shell=True)
+            nrecs = ret.decode().split(' ')[-1].rstrip()
+        
+            if nrecs=='8':
+                print(f'{fout} is successfully retrieved.')
+                fnc = fout.replace('grb2', 'nc')
+                cmd = f'{cdocmd} {fout} {fnc}'
+                print(cmd); os.system(cmd)
+                cmd = f'{ncocmd} {fnc} {fnc}4'
+                print(cmd); os.system(cmd)
+                cmd = f'/bin/mv {fnc}4 {fnc}'
+                print(cmd); os.system(cmd)
+                cmd = f'/bin/rm -f {fout}'
+                print(cmd); os.system(cmd)
+            else:
+                print(f'{fout} will be retried in 1 minute.')
+                os.system(f'/bin/rm -f {fout}')
+
+        # the f00/f01 files are deleted once combined, keep only pending downloads in the manifest
+        grib_download.forget('analysis/download.json', [task[1] for task in tasks])
+
+        hours = [t for t in hours if not os.path.isfile(f'analysis/{t:%Y%m%d}/hrrr_anal_{t:%Y%m%d%H}.nc')]
+        if len(hours)>0:
+            time.sleep(60)
 
     time_finish = time.time()
     print(f'Total download/process time {time_finish-time_start:.1f} seconds')
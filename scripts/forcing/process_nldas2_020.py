@@ -19,6 +19,7 @@ import netCDF4 as nc
 from datetime import datetime, timedelta, UTC
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time
+import grib_download
 
     
 ## some setups
@@ -29,6 +30,7 @@ httpshost  = 'hydro1.gesdisc.eosdis.nasa.gov'
 httpspath  = 'data/NLDAS/NLDAS_FORA0125_H.2.0'
 
 nld2_path  = 'NLDAS_FORA0125_H.2.0' # path to NLDAS-2 archive folder
+nworkers   = 8                      # concurrent downloads
 
 ## main function
 def main(argv):
@@ -77,22 +79,18 @@ def main(argv):
         lastnc_day = t1 - timedelta(hours=1)
         back_day   = t2
    
+    # download archive, all hours concurrently
+    tasks = []
     t = lastnc_day + timedelta(hours=1)
     while t <= back_day:
 
-        print(f'Downloading {t:%Y-%m-%d %H:00}')
-
-        # download archive
         fnc = f'NLDAS_FORA0125_H.A{t:%Y%m%d.%H}00.020.nc'
         premo = f'https://{httpshost}/{httpspath}/{t:%Y/%j}'
         parch = f'{nld2_path}/{t:%Y/%j}'
-        if not os.path.isdir(parch):
-            os.system(f'mkdir -p {parch}')
-            
-        cmd = f'wget --user=fallspinach --password=TsingHua1911 -q {premo}/{fnc} -O {parch}/{fnc}'
-        print(cmd); os.system(cmd)
+        tasks.append((f'{premo}/{fnc}', f'{parch}/{fnc}', None))
         
         t = t + timedelta(hours=1)
+    grib_download.download(tasks, f'{nld2_path}/download.json', nworkers=nworkers, auth=('fallspinach', 'TsingHua1911'))
     
     lastnc_day = find_last_time(nld2_path+'/20??/???/*.nc', 'NLDAS_FORA0125_H.A%Y%m%d.%H00.020.nc')
     
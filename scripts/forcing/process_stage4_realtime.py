@@ -16,6 +16,7 @@ import numpy.ma as ma
 from datetime import datetime, timedelta, UTC
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time
+import grib_download, regrid
 
 
 ## some setups
@@ -32,9 +33,11 @@ stg4_old = '/cw3e/mead/projects/cwp101/wrf_hydro/forcing/stage4/realtime'
 
 cdocmd1 = 'cdo -f nc4 -z zip chname,tp,apcpsfc -remap,latlon_conus_0.04deg.txt' #',stage4_to_0.04deg_weight.nc'
 cdocmd3 = 'cdo -f nc4 -z zip chname,tp,apcpsfc -remapcon,latlon_conus_0.04deg.txt' #',stage4_to_0.04deg_weight.nc'
+cdocmd4 = 'cdo -f nc4 chname,tp,apcpsfc'
 wgetcmd = 'wget -q -r -np -N -nH --cut-dir=5 -R "st4_pr*" -R "st4_ak*" -R "*.gif"'
 wgribcmd = 'wgrib2 -undefine out-box -118.1:-118 37:37.1 -csv west_test.tmp'
 cdocmd2 = 'cdo -s outputtab,value -fldsum -gtc,-20'
+nworkers = 8   # concurrent downloads
 
 ## main function
 def main(argv):
@@ -71,6 +74,7 @@ def main(argv):
     
     print(f'Latest existing data file time {lastnc_day:%Y-%m-%dT%H}, update up to {back_day:%Y-%m-%dT%H}.')
     
+    fgrbs = []
     t = lastnc_day - timedelta(hours=36)
     while t<back_day-timedelta(hours=1):
         
@@ -79,38 +83,55 @@ def main(argv):
             steps.append('06')
         if t.hour==12:
             steps.append('24')
-            
         for step in steps:
-            fgrb = f'realtime/pcpanl.{t:%Y%m%d}/st4_conus.{t:%Y%m%d%H}.{step}h.grb2'
-            fnc  = fgrb.replace('grb2', 'nc')
+            fgrbs.append(f'realtime/pcpanl.{t:%Y%m%d}/st4_conus.{t:%Y%m%d%H}.{step}h.grb2')
         
+        t += timedelta(hours=1)
+
+    if not copyold_flag:
+        # download all files concurrently
+        tasks = [(f'{stg4_url}/{fgrb.replace("realtime", "prod")}', fgrb, None) for fgrb in fgrbs]
+        res = grib_download.download(tasks, 'realtime/download.json', nworkers=nworkers)
+    else:
+        # copy from old path
+        res = {}
+        for fgrb in fgrbs:
             dgrb = os.path.dirname(fgrb)
             if not os.path.isdir(dgrb):
                 os.system(f'mkdir -p {dgrb}')
+            cmd = f'/bin/cp -a {stg4_old}/{fgrb.replace("realtime", "prod")} {fgrb}'
+            print(cmd); os.system(cmd)
+            res[fgrb] = os.path.isfile(fgrb)
+        
+    for fgrb in fgrbs:
 
-            if not copyold_flag:
-                # download
-                cmd = f'wget {stg4_url}/{fgrb.replace("realtime", "prod")} -O {fgrb}'
-            else:
-                # copy from old path
-                cmd = f'/bin/cp -a {stg4_old}/{fgrb.replace("realtime", "prod")} {fgrb}'
+        if not res[fgrb]:
+            continue
+        fnc  = fgrb.replace('grb2', 'nc')
+        # check whtether CNRFC/NWRFC exist
+        cmd = f'{cdocmd2} {fgrb} | tail -1 | tr -d " "'
+        print(cmd)
+        ret = subprocess.check_output([cmd], shell=True)
+        npix = ret.decode().split(' ')[-1].rstrip()
+        fwt = f'stage4_to_0.04deg_weight_{npix}.nc'
+        # remap to 0.04 deg, with the weights loaded once per weight file by the python engine
+        if os.path.isfile(fwt) and config['forcing'].get('regrid', 'cdo')=='python':
+            cmd = f'{cdocmd4} {fgrb} {fnc}.tmp'
             print(cmd); os.system(cmd)
-            # check whtether CNRFC/NWRFC exist
-            cmd = f'{cdocmd2} {fgrb} | tail -1 | tr -d " "'
-            print(cmd)
-            ret = subprocess.check_output([cmd], shell=True)
-            npix = ret.decode().split(' ')[-1].rstrip()
-            fwt = f'stage4_to_0.04deg_weight_{npix}.nc'
-            # remap to 0.04 deg
-            if os.path.isfile(fwt):
-                cmd = f'{cdocmd1},{fwt} {fgrb} {fnc}'
-            else:
-                cmd = f'{cdocmd3} {fgrb} {fnc}'
+            regrid.remap_files(fwt, [f'{fnc}.tmp'], fnc)
+            os.system(f'/bin/rm -f {fnc}.tmp')
+        elif os.path.isfile(fwt):
+            cmd = f'{cdocmd1},{fwt} {fgrb} {fnc}'
             print(cmd); os.system(cmd)
-            cmd = f'/bin/rm -f {fgrb}'
+        else:
+            cmd = f'{cdocmd3} {fgrb} {fnc}'
             print(cmd); os.system(cmd)
-        
-        t += timedelta(hours=1)
+        cmd = f'/bin/rm -f {fgrb}'
+        print(cmd); os.system(cmd)
+
+    # the grb2 files are deleted once converted, keep only pending downloads in the manifest
+    if not copyold_flag:
+        grib_download.forget('realtime/download.json', [fgrb for fgrb in fgrbs if res[fgrb]])
         
     time_finish = time.time()
     print(f'Total download/process time {(time_finish-time_start):.1f} seconds')
@@ -1,5 +1,8 @@
 ''' Process West-WRF ensemble forecast data into WRF-Hydro format
 
+Members (of all domains) are spread over the MPI ranks; each member is processed one day at a time, its
+3-hourly steps regridded one field at a time, each step filling its own hour and the next two of the daily file.
+
 Usage:
     mpirun -np [# of procs] python process_wwrf_ens.py [fcst_length] [fcst_date]
 Default values:
@@ -17,9 +20,11 @@ import sys, os, pytz, time
 from glob import glob
 import numpy as np
 import numpy.ma as ma
+import netCDF4 as nc
 from datetime import datetime, timedelta, UTC
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time
+import regrid
 from mpi4py import MPI
 
 # MPI setup
@@ -39,7 +44,20 @@ enss = [ 'ecm%03d' % i for i in [4, 5, 6, 7, 24, 25, 26, 27, 40, 41, 42, 43, 44,
 enss = [ 'ecm%03d' % i for i in [4, 5, 6, 7, 24, 25, 26, 27, 40, 41, 42, 43, 44, 45, 46, 47, 48, 49, 50, 51, 52, 53, 54, 55, 56, 57, 58, 59, 
                                  64, 65, 66, 67, 84, 85, 86, 87, 104, 105, 106, 107, 116, 117, 118, 119]]
 
-tmpdir = f'/scratch/{os.getenv("USER")}/job_{os.getenv("SLURM_JOBID")}'
+## one West-WRF 3-hour bucket regridded to a domain, {WRF-Hydro name: [y, x]}, by cdo remap (through ftmp)
+## or with the cdo weights applied as a sparse matrix (forcing: regrid: python in config.yaml)
+def regrid_bucket(fww, wwvars, rg, domain, fweights, ftmp):
+
+    if config['forcing'].get('regrid', 'cdo')=='python':
+        with nc.Dataset(fww, 'r') as f:
+            return {wwvars[name]: rg(regrid.read_field(f, name, 0)) for name in wwvars}
+    chname = ','.join([f'{name},{wwvars[name]}' for name in wwvars])
+    cmd = f'cdo -O -f nc4 remap,../nwm/domain/scrip_{domain}_bilinear.nc,{fweights} -chname,{chname} -selname,{",".join(wwvars)} {fww} {ftmp}'
+    os.system(cmd)
+    with nc.Dataset(ftmp, 'r') as f:
+        fields = {name: regrid.read_field(f, name, 0) for name in wwvars.values()}
+    os.remove(ftmp)
+    return fields
 
 ## main function
 def main(argv):
@@ -49,7 +67,7 @@ def main(argv):
     os.chdir(wwrfdir)
         
     # keep the time
-    #time_start = time.time()
+    time_start = time.time()
     
     # get current UTC time
     curr_time = datetime.now(UTC)
@@ -80,113 +98,115 @@ def main(argv):
     
     #sys.exit("here")
 
-    for domain in ['cnrfc', 'cbrfc']: #config['forcing']['domains']:
-        
-        if latest_day.year==2025:
-            cdocmd = f'cdo -O -f nc4 -z zip remap,../nwm/domain/scrip_{domain}_bilinear.nc,{out_dir}/cdo_weights_d01_cf_{domain}.nc -chname,p_sfc,PSFC,T_2m,T2D,q_2m,Q2D,LW_d,LWDOWN,SW_d,SWDOWN,precip_bkt,RAINRATE,u_10m,U2D,v_10m,V2D -selname,p_sfc,T_2m,q_2m,LW_d,SW_d,precip_bkt,u_10m,v_10m'
+    # variables to regrid -> WRF-Hydro names, and unit conversion (scale, units)
+    if latest_day.year==2025:
+        wwvars = {'p_sfc': 'PSFC', 'T_2m': 'T2D', 'q_2m': 'Q2D', 'LW_d': 'LWDOWN', 'SW_d': 'SWDOWN', 'precip_bkt': 'RAINRATE', 'u_10m': 'U2D', 'v_10m': 'V2D'}
+    else:
+        wwvars = {'p_sfc': 'PSFC', 'T_2m': 'T2D', 'q_2m': 'Q2D', 'LW_d': 'LWDOWN', 'SW_d': 'SWDOWN', 'precip_bkt': 'RAINRATE', 'u_10m_gr': 'U2D', 'v_10m_gr': 'V2D'}
+    convert = {'PSFC': (100, 'Pa'), 'RAINRATE': (1/10800, 'kg m-2 s-1')}   # 3-hour precip bucket (mm) to rate
+
+    # West-WRF files of a member and forecast hour
+    def wwrf_file(ens, t):
+        if latest_day.year>=2025:
+            return f'{fcst_dir}/{latest_day:%Y%m%d%H}/{ens}/wrfcf_hydro_d{fcst_domain}_{t:%Y-%m-%d_%H}_00_00.nc'
         else:
-            cdocmd = f'cdo -O -f nc4 -z zip remap,../nwm/domain/scrip_{domain}_bilinear.nc,{out_dir}/cdo_weights_d01_cf_{domain}.nc -chname,p_sfc,PSFC,T_2m,T2D,q_2m,Q2D,LW_d,LWDOWN,SW_d,SWDOWN,precip_bkt,RAINRATE,u_10m_gr,U2D,v_10m_gr,V2D -selname,p_sfc,T_2m,q_2m,LW_d,SW_d,precip_bkt,u_10m_gr,v_10m_gr'
-        ncocmd1 = 'ncap2 -O -s "PSFC=PSFC*100; RAINRATE=RAINRATE/10800" '
-        ncocmd2 = 'ncatted -a units,PSFC,o,c,"Pa" -a units,RAINRATE,o,c,"kg m-2 s-1" '
-    
-        t = latest_day + timedelta(hours=1)
-        last_day = latest_day + timedelta(days=fcst_length)
-        allsteps = []
-        alldays  = []
-        while t <= last_day:
-            if latest_day.year>=2025:
-                fww = f'{fcst_dir}/{latest_day:%Y%m%d%H}/ecm004/wrfcf_hydro_d{fcst_domain}_{t:%Y-%m-%d_%H}_00_00.nc'
-            else:
-                fww = f'{fcst_dir}/{latest_day:%Y%m%d%H}/cf/ecm004/wrfcf_d{fcst_domain}_{t:%Y-%m-%d_%H}_00_00.nc'
-            fnwm = f'{out_dir}/{domain}/{t:%Y%m%d%H}.LDASIN_DOMAIN1'
-            if os.path.isfile(fww): # and not os.path.isfile(fnwm):
-                allsteps.append(t)
-            if t.hour == 23:
-                alldays.append(t-timedelta(hours=23))
-            t = t + timedelta(hours=1)
-        # add last day for WRF-Hydro
-        alldays.append(alldays[-1]+timedelta(days=1))
-        #print(allsteps); print(alldays)
-
-
-        for ens in enss[rank::size]:
-        
-            for t in allsteps:
-        
-                #print(t.strftime('Processing %Y-%m-%d %H:00'))
-
-                if latest_day.year>=2025:
-                    fww = f'{fcst_dir}/{latest_day:%Y%m%d%H}/{ens}/wrfcf_hydro_d{fcst_domain}_{t:%Y-%m-%d_%H}_00_00.nc'
-                else:
-                    fww = f'{fcst_dir}/{latest_day:%Y%m%d%H}/cf/{ens}/wrfcf_d{fcst_domain}_{t:%Y-%m-%d_%H}_00_00.nc'
-                ftmp = f'{tmpdir}/{ens}/{t:%Y%m%d%H}.LDASIN_DOMAIN1'
-                ftmp2 = f'{ftmp}.nc'
-                dtmp = os.path.dirname(ftmp)
-                if not os.path.isdir(dtmp):
-                    os.system(f'mkdir -p {dtmp}')
-                fnwm = f'{out_dir}/{domain}/{ens}/{t:%Y%m%d%H}.LDASIN_DOMAIN1'
-                dnwm = os.path.dirname(fnwm)
-                if not os.path.isdir(dnwm):
-                    os.system(f'mkdir -p {dnwm}')
-                if os.path.isfile(fww):
-                    cmd = f'{cdocmd} {fww} {ftmp}'
-                    #print(cmd)
-                    os.system(cmd)
-                    cmd = f'{ncocmd1} {ftmp} {ftmp2}'
-                    os.system(cmd)
-                    cmd = f'{ncocmd2} {ftmp2}' 
-                    os.system(cmd)
-                    cmd = f'cdo -f nc4 -z zip add {ftmp2} ../nwm/domain/xmask0_{domain}.nc {fnwm}'
-                    os.system(cmd)
-                    cmd = f'/bin/rm -f {ftmp} {ftmp2}'
-                    os.system(cmd)
-    
-            for t in alldays:
-            
-                fh = f'{out_dir}/{domain}/{ens}/{t:%Y%m%d}??.LDASIN_DOMAIN1'
-                # repeat each hour 3 times to "fake" hourly data
-                fhs = glob(fh)
-                fhs.sort()
-                #print(fhs)
-                fh3 = ' '.join([ f+' '+f+' '+f for f in fhs])
-                fd = f'{out_dir}/{domain}/{ens}/{t:%Y%m%d}.LDASIN_DOMAIN1'
-                cmd = f'cdo -O -f nc4 -z zip mergetime {fh3} {fd}'
+            return f'{fcst_dir}/{latest_day:%Y%m%d%H}/cf/{ens}/wrfcf_d{fcst_domain}_{t:%Y-%m-%d_%H}_00_00.nc'
+
+    t = latest_day + timedelta(hours=1)
+    last_day = latest_day + timedelta(days=fcst_length)
+    allsteps = []
+    alldays  = []
+    while t <= last_day:
+        if os.path.isfile(wwrf_file('ecm004', t)):
+            allsteps.append(t)
+        if t.hour == 23:
+            alldays.append(t-timedelta(hours=23))
+        t = t + timedelta(hours=1)
+    # add last day for WRF-Hydro
+    alldays.append(alldays[-1]+timedelta(days=1))
+
+    # members of all domains are spread over the ranks
+    tasks = [(domain, ens) for domain in ['cnrfc', 'cbrfc'] for ens in enss] #config['forcing']['domains']
+    t_avail = 0
+    for domain, ens in tasks[rank::size]:
+
+        fweights = f'{out_dir}/cdo_weights_d01_cf_{domain}.nc'
+        fmask    = f'../nwm/domain/xmask0_{domain}.nc'
+
+        # 3-hourly West-WRF files of the member
+        fwws = []; thours = []
+        for t in allsteps:
+            fww = wwrf_file(ens, t)
+            if os.path.isfile(fww):
+                fwws.append(fww); thours.append(t)
+        if len(fwws)==0:
+            continue
+        t_avail = max([t_avail]+[os.path.getmtime(fww) for fww in fwws])
+        dnwm = f'{out_dir}/{domain}/{ens}'
+        if not os.path.isdir(dnwm):
+            os.system(f'mkdir -p {dnwm}')
+
+        rg = regrid.load_regridder(fweights)
+        mask = regrid.load_mask(fmask)
+        tatts = regrid.time_steps(fwws[:1])[0]
+        with nc.Dataset(fwws[0], 'r') as f:
+            attrs = {wwvars[name]: a for name, a in regrid.grid_vars(f, list(wwvars.keys()), rg.nsrc).items()}
+        for name, (scale, units) in convert.items():
+            attrs[name]['units'] = units
+
+        # each 3-hourly step t fills the hours t, t+1 and t+2 of its own day, as the hourly files of
+        # the step repeated three times did, the 00Z step being the first of its day
+        hourly = [(th+timedelta(hours=j), k) for k, th in enumerate(thours) for j in range(3)]
+
+        for t in alldays:
+
+            hh = [(h, k) for h, k in hourly if h.date()==t.date()]
+            if len(hh)==0:
+                continue
+            fd = f'{out_dir}/{domain}/{ens}/{t:%Y%m%d}.LDASIN_DOMAIN1'
+            dst = regrid.create(fd, rg, tatts, attrs, os.path.basename(fweights))
+            dst['time'][:] = nc.date2num([h.replace(tzinfo=None) for h, k in hh], tatts['units'], tatts.get('calendar', 'standard'))
+            for k in sorted(set([k for h, k in hh])):
+                fields = regrid_bucket(fwws[k], {name: wwvars[name] for name in wwvars if wwvars[name] in attrs}, rg, domain,
+                                       fweights, f'{dnwm}/{thours[k]:%Y%m%d%H}.LDASIN_DOMAIN1.tmp')
+                for name, x in fields.items():
+                    y = (x*convert.get(name, (1, None))[0]+mask).astype(np.float32)
+                    for n in [n for n, (h, kn) in enumerate(hh) if kn==k]:
+                        dst[name][n] = y
+            regrid.close(dst, fd)
+
+            # subsetting
+            if domain=='cnrfc':
+                fd2 = f'{out_dir}/basins24/{ens}/{t:%Y%m%d}.LDASIN_DOMAIN1'
+                dd2 = os.path.dirname(fd2)
+                if not os.path.isdir(dd2):
+                    os.system(f'mkdir -p {dd2}')
+                cmd = f'cdo -O -f nc4 -z zip add -selindexbox,111,410,381,1130 {fd} ../nwm/domain/xmask0_basins24.nc {fd2}'
                 os.system(cmd)
-                if True:
-                    fh4 = f'{out_dir}/{domain}/{ens}/{t:%Y%m%d}[12]?.LDASIN_DOMAIN1'
-                    cmd = f'rm -f {fh4}'
-                    os.system(cmd)
-                    fh4 = f'{out_dir}/{domain}/{ens}/{t:%Y%m%d}0[369].LDASIN_DOMAIN1'
-                    cmd = f'rm -f {fh4}'
-                    os.system(cmd)
-
-                # subsetting
-                if domain=='cnrfc':
-                    fd2 = f'{out_dir}/basins24/{ens}/{t:%Y%m%d}.LDASIN_DOMAIN1'
-                    dd2 = os.path.dirname(fd2)
-                    if not os.path.isdir(dd2):
-                        os.system(f'mkdir -p {dd2}')
-                    cmd = f'cdo -O -f nc4 -z zip add -selindexbox,111,410,381,1130 {fd} ../nwm/domain/xmask0_basins24.nc {fd2}'
-                    os.system(cmd)
-                if domain=='cbrfc':
-                    fd2 = f'{out_dir}/yampa/{ens}/{t:%Y%m%d}.LDASIN_DOMAIN1'
-                    dd2 = os.path.dirname(fd2)
-                    if not os.path.isdir(dd2):
-                        os.system(f'mkdir -p {dd2}')
-                    cmd = f'cdo -O -f nc4 -z zip add -selindexbox,579,948,962,1401 {fd} ../nwm/domain/xmask0_yampa.nc {fd2}'
-                    os.system(cmd)
-    
-        # delete hourly files older than 5 days
-        if rank==0:
-            old_day = latest_day - timedelta(days=5)
+            if domain=='cbrfc':
+                fd2 = f'{out_dir}/yampa/{ens}/{t:%Y%m%d}.LDASIN_DOMAIN1'
+                dd2 = os.path.dirname(fd2)
+                if not os.path.isdir(dd2):
+                    os.system(f'mkdir -p {dd2}')
+                cmd = f'cdo -O -f nc4 -z zip add -selindexbox,579,948,962,1401 {fd} ../nwm/domain/xmask0_yampa.nc {fd2}'
+                os.system(cmd)
+        print(f'{ens} {domain}: {len(fwws)} 3-hourly steps to {len(alldays)} daily files in {time.time()-time_start:.1f} seconds since start.')
+
+    comm.Barrier()
+
+    # delete hourly files older than 5 days
+    if rank==0:
+        old_day = latest_day - timedelta(days=5)
+        for domain in ['cnrfc', 'cbrfc']:
             for ens in enss:
                 cmd = f'/bin/rm -f {out_dir}/{domain}/{ens}/{old_day:%Y%m%d}??.LDASIN_DOMAIN1'
                 os.system(cmd)
-    
-    #time_finish = time.time()
-    #print('Total download/process time %.1f seconds' % (time_finish-time_start))
-    
-    comm.Barrier()
+
+    # time from the arrival of the last West-WRF file to all members' forcing ready
+    t_avail = comm.allreduce(t_avail, op=MPI.MAX)
+    if rank==0 and t_avail>0:
+        print(f'All {len(tasks)} members ready: {time.time()-time_start:.1f} seconds processing, {time.time()-t_avail:.1f} seconds since the last West-WRF file arrived.')
+
     return 0
     
 
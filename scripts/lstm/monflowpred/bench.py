@@ -0,0 +1,70 @@
+''' Micro-benchmarks and equivalence checks for monflowpred
+
+Usage:
+    python -m monflowpred.bench loss [# of time steps] [# of basins]   # weighted RMSE losses, vectorized vs. loop
+    python -m monflowpred.bench dataset [# of basins] [# of years] [# of workers]   # training windows/sec by batch size
+'''
+
+import sys, time
+import numpy as np
+import pandas as pd
+import xarray as xr
+import torch
+from monflowpred import core
+
+def bench_loss(nt=12, nb=24, nrep=20):
+    torch.manual_seed(0)
+    target = torch.rand(nt, nb, 1)
+    for lossfunc in [core.RMSE_high_Loss(), core.RMSE_only_Loss()]:
+        out1 = torch.rand(nt, nb, 1, requires_grad=True)
+        out2 = out1.detach().clone().requires_grad_()
+
+        t0 = time.time()
+        for _ in range(nrep):
+            loss1 = lossfunc.forward_loop(out1, target)
+            out1.grad = None
+            loss1.backward()
+        t1 = time.time()
+        for _ in range(nrep):
+            loss2 = lossfunc(out2, target)
+            out2.grad = None
+            loss2.backward()
+        t2 = time.time()
+
+        print(f'{type(lossfunc).__name__} [{nt}, {nb}]: loop {(t1-t0)/nrep*1000:.2f}ms, vectorized {(t2-t1)/nrep*1000:.3f}ms, '
+              f'loss diff {abs(loss1.item()-loss2.item()):.1e}, max grad diff {(out1.grad-out2.grad).abs().max().item():.1e}')
+
+def bench_dataset(nb=24, ny=40, num_workers=0, nepoch=3, hiddensize=64):
+    torch.manual_seed(0)
+    rng   = np.random.default_rng(0)
+    time_ = pd.date_range('1979-10-31', periods=ny*12, freq='M')
+    vs    = ['PREC', 'T2D', 'SWDOWN', 'LWDOWN', 'SMTOT', 'SWE', 'Qsim', 'elev', 'sand', 'slope', 'size', 'p_mean']
+    ds = xr.Dataset({v: (('id', 'time'), rng.standard_normal((nb, ny*12))) for v in vs+['FNF']},
+                    coords={'id': np.arange(nb), 'time': time_})
+    dataset = core.seqDataset(ds, target=['FNF'], features=vs, seq_len=12)
+
+    for batch_size in [1, 4, 16]:
+        model    = core.LSTMmodel(nx=len(vs), ny=1, hiddensize=hiddensize)
+        optim    = torch.optim.Adadelta(model.parameters())
+        lossfunc = core.RMSE_Loss()
+        loader   = core.window_loader(dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers)
+        t0 = time.time()
+        for iepoch in range(nepoch):
+            for xi, yi in loader:
+                loss = lossfunc(model(xi), yi.float())
+                loss.backward()
+                optim.step()
+                optim.zero_grad()
+        dt = time.time()-t0
+        print(f'{nb} basins x {ny} years, batch {batch_size} windows, {num_workers} workers: '
+              f'{len(dataset)*nepoch/dt:.1f} windows/sec')
+
+if __name__ == '__main__':
+    if len(sys.argv)>1 and sys.argv[1]=='loss':
+        args = [int(a) for a in sys.argv[2:4]]
+        bench_loss(*(args+[12, 24][len(args):]))
+    elif len(sys.argv)>1 and sys.argv[1]=='dataset':
+        args = [int(a) for a in sys.argv[2:5]]
+        bench_dataset(*(args+[24, 40, 0][len(args):]))
+    else:
+        print(__doc__)
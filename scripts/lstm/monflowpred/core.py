@@ -3,6 +3,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as Funct
 from torch.utils.data import Dataset as TorchData
+from torch.utils.data import DataLoader
 
 ############ CLASS: loss function section
 class RMSE_Loss(nn.Module):
@@ -19,106 +20,89 @@ class RMSE_Loss(nn.Module):
             loss = loss + temp
         return loss
 
-class RMSE_high_Loss(nn.Module): 
-    ### create loss func, weight on high values
-    ### to create better prediction for Apr-May forecast
-    def __init__(self):
+def season_weights(nt, weights):
+    ### [time, 1] weights, weights[1] on months 6-9 of each 12-month window
+    ### (manually selected Mar-Jul), weights[0] elsewhere
+    monind = torch.arange(nt) % 12
+    high   = (monind>=6) & (monind<=9)
+    return torch.where(high, weights[1], weights[0]).to(torch.float32).unsqueeze(1)
+
+class RMSE_weighted_Loss(nn.Module):
+    ### RMSE with seasonal weights broadcast over basins,
+    ### the [time, 1] weight tensor is built once per sequence length
+    def __init__(self, weights):
         super().__init__()
+        self.weights = weights
+        self.wt = {}
 
     def forward(self, output, target):
-        weights  = [0.2, 1.75]    ## tentative weights
-        # high_pct = 0.10        ## tentative high value threshold
-        # med_pct  = 0.35        ## tentative medium value threshold
-        ny = target.shape[2]
-        nb = target.shape[1]  ## number of basin
         nt = target.shape[0]  ## number of time step
-        #print(output.size(), target.size())
+        if nt not in self.wt:
+            self.wt[nt] = season_weights(nt, self.weights)
+        wt = self.wt[nt].to(output.device)
+        ny = target.shape[2]
         loss = 0
         for k in range(ny):
-            p0 = output[:, :, k]
-            t0 = target[:, :, k]
-            dif = p0-t0
-            ## print(t0[:,0])
-            ## print(dif[:,0])
-            for bi in range(nb):
-                for ti in range(nt):
-                    monind = ti%12
-                    if monind>=6 and monind<=9 :  ## manually select Mar-Jul
-                        dif[ti,bi] = dif[ti,bi]*weights[1]
-                    else:
-                        dif[ti,bi] = dif[ti,bi]*weights[0]
-            ## print(dif.size(), nb, nt)
-            ## print(dif[:,0])
-            temp1 = torch.sqrt(((p0 - t0) ** 2).mean())
-            temp = torch.sqrt((dif ** 2).mean())
-            #print(temp1, temp)
-            loss = loss + temp
+            dif = (output[:, :, k] - target[:, :, k]) * wt
+            loss = loss + torch.sqrt((dif ** 2).mean())
         return loss
 
-class RMSE_only_Loss(nn.Module): 
-    ### create loss func, weight on high values
-    ### to create better prediction for Apr-May forecast
-    def __init__(self):
-        super().__init__()
-
-    def forward(self, output, target):
-        weights  = [0.05, 2.]    ## tentative weights
-        # high_pct = 0.10        ## tentative high value threshold
-        # med_pct  = 0.35        ## tentative medium value threshold
+    def forward_loop(self, output, target):
+        ### original element-wise loop, kept for checking
         ny = target.shape[2]
         nb = target.shape[1]  ## number of basin
         nt = target.shape[0]  ## number of time step
-        #print(output.size(), target.size())
         loss = 0
         for k in range(ny):
             p0 = output[:, :, k]
             t0 = target[:, :, k]
             dif = p0-t0
-            ## print(t0[:,0])
-            ## print(dif[:,0])
             for bi in range(nb):
                 for ti in range(nt):
                     monind = ti%12
                     if monind>=6 and monind<=9 :  ## manually select Mar-Jul
-                        dif[ti,bi] = dif[ti,bi]*weights[1]
+                        dif[ti,bi] = dif[ti,bi]*self.weights[1]
                     else:
-                        dif[ti,bi] = dif[ti,bi]*weights[0]
-            ## print(dif.size(), nb, nt)
-            ## print(dif[:,0])
-            temp1 = torch.sqrt(((p0 - t0) ** 2).mean())
+                        dif[ti,bi] = dif[ti,bi]*self.weights[0]
             temp = torch.sqrt((dif ** 2).mean())
-            #print(temp1, temp)
             loss = loss + temp
         return loss
 
+class RMSE_high_Loss(RMSE_weighted_Loss): 
+    ### create loss func, weight on high values
+    ### to create better prediction for Apr-May forecast
+    def __init__(self):
+        super().__init__([0.2, 1.75])    ## tentative weights
+
+class RMSE_only_Loss(RMSE_weighted_Loss): 
+    ### create loss func, weight on high values
+    ### to create better prediction for Apr-May forecast
+    def __init__(self):
+        super().__init__([0.05, 2.])    ## tentative weights
+
 ############ CLASS: dataset section
 class seqDataset(TorchData):
+    ### 12-month windows stepping by 12 months, the last one ending at the last step;
+    ### window starts are precomputed and windows are views of contiguous [time, basin, var] tensors
     def __init__(self, dataset, target, features, seq_len=12):
         self.features = features
         self.target = target
         self.seq_len = seq_len
         self.yt = torch.from_numpy(np.array(dataset[target].to_array()))
-        self.y  = self.yt.permute(2,1,0)
+        self.y  = self.yt.permute(2,1,0).contiguous()
         self.Xt = torch.from_numpy(np.array(dataset[features].to_array()))
-        self.X  = self.Xt.permute(2,1,0)
-        self.X  = self.Xt.permute(2,1,0)
+        self.X  = self.Xt.permute(2,1,0).contiguous()
         self.step = self.X.shape[0]                ## total time steps
         self.lps  = 1+ int( np.ceil((self.step-self.seq_len)/12.) ) ## ttl loops
+        self.starts = [i*12 for i in range(self.lps-1)] + [self.step-self.seq_len]
 
     def __len__(self):
-        ttlstep = self.X.shape[0]                ## total time steps
-        ttlps   = 1+ int( np.ceil((ttlstep-self.seq_len)/12.) ) ## ttl loops
-        return int(ttlps)
+        return self.lps
 
     def __getitem__(self, i): 
-        if i==self.lps-1:   ### deal with last batch
-            x = self.X[self.step-self.seq_len:, :, :]
-            y = self.y[self.step-self.seq_len:, :, :]
-        else:     ### normal case
-            istart = i*12
-            ind    = istart+self.seq_len
-            x = self.X[istart:ind, :, :]
-            y = self.y[istart:ind, :, :]
+        istart = self.starts[i]
+        x = self.X[istart:istart+self.seq_len, :, :]
+        y = self.y[istart:istart+self.seq_len, :, :]
         return x, y
 
     def shape(self):
@@ -129,6 +113,18 @@ class seqDataset(TorchData):
         print(self.step)
         print(self.lps)
 
+def collate_windows(batch):
+    ### several windows stacked along the batch (basin) dimension: [seq_len, nwin*basin, var]
+    x = torch.cat([b[0] for b in batch], dim=1)
+    y = torch.cat([b[1] for b in batch], dim=1)
+    return x, y
+
+def window_loader(dataset, batch_size=1, shuffle=False, num_workers=0):
+    ### DataLoader over windows, batch_size windows per step, optional worker prefetch
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, collate_fn=collate_windows,
+                      num_workers=num_workers, pin_memory=torch.cuda.is_available(),
+                      persistent_workers=num_workers>0)
+
 
 ############ CLASS: nerual network section
 class LSTMmodel(nn.Module):
@@ -144,6 +140,20 @@ class LSTMmodel(nn.Module):
         self.linearOut = nn.Linear(hiddensize, ny)
 
     def forward(self, x, doDropMC=False):
+        ### the state is reset to zeros at every time step, so the steps are
+        ### independent: fold time into the batch and run one length-1 sequence
+        ntstep     = x.shape[0]
+        batch_size = x.shape[1]
+        xt = x.reshape(1, ntstep*batch_size, x.shape[2])
+        h0 = torch.zeros(1, ntstep*batch_size, self.hiddensize)
+        c0 = torch.zeros(1, ntstep*batch_size, self.hiddensize)
+        x0 = Funct.relu(self.linearIn(xt.to(torch.float32)))
+        x1, (h1, c1) = self.lstm(x0, (h0, c0) )
+        output = self.linearOut(h1)
+        return output.reshape(ntstep, batch_size, self.ny)
+
+    def forward_steps(self, x, doDropMC=False):
+        ### original step-by-step loop, kept for checking
         batch_size = x.shape[1]
         ntstep     = x.shape[0]
         output     = torch.zeros(ntstep, batch_size, self.ny)
@@ -156,5 +166,3 @@ class LSTMmodel(nn.Module):
             yi  = self.linearOut(h1)
             output[ti,:,:] = yi
         return output
-
-
@@ -1,3 +1,4 @@
+import os, json
 import numpy  as np
 import pandas as pd
 import xarray as xr
@@ -61,3 +62,111 @@ def trans_to_flow(y_in, data_ori, config, t_train):
     y_final = np.power(np.power(10, y_out)-0.1, 2)
 
     return y_final[:,:,0]
+
+
+'''
+Normalization statistics of the training period computed once at training
+time, saved by TrainLSTM next to each model_EpNNN.pt and applied to the whole
+batch at inference. The json records the Ttrain, log_var_list and model file
+mtime they were made for; stats that no longer match are recomputed (and
+saved again) at the first prediction.
+'''
+
+def stats_file(model_file):
+    return model_file.replace('.pt', '.norm.json')
+
+
+def calc_stats(xr_dyn, flow, df_stc, config, t_train):
+    ### same avg/std as norm_dyn, norm_stc and trans_to_flow
+    log_list = config['TEST_PARA']['log_var_list']
+    stats = {'dyn': {}, 'stc': {}, 'target': {}}
+    inputs = xr_dyn.sel(time=slice(t_train[0], t_train[1]))
+    for vari in inputs.keys():
+        xtmp = inputs[vari]
+        if vari in log_list:
+            xtmp = np.log10(np.sqrt(xtmp)+0.1)
+        avg = float(xtmp.mean())
+        std = float(xtmp.std())
+        stats['dyn'][vari] = [avg, std if std>=0.001 else 1.]
+    inputs = df_stc.to_xarray()
+    for vari in inputs.keys():
+        if vari != 'id':
+            xtmp = inputs[vari]
+            if vari in log_list:
+                xtmp = np.log10(np.sqrt(xtmp)+0.1)
+            avg = float(xtmp.mean())
+            std = float(xtmp.std())
+            stats['stc'][vari] = [avg, std if std>=0.001 else 1.]
+    for vari in flow.keys():
+        xtmp = flow[vari].sel(time=slice(t_train[0], t_train[1]))
+        xtmp = np.log10(np.sqrt(xtmp)+0.1)
+        stats['target'][vari] = [float(xtmp.mean()), float(xtmp.std())]
+    return stats
+
+
+def stats_key(config, model_file):
+    ### what the stats were computed for: training period, log-transformed variables, model file version
+    return {'Ttrain': [str(t) for t in config['TEST_PARA']['Ttrain']],
+            'log_var_list': list(config['TEST_PARA']['log_var_list']),
+            'model_mtime': os.path.getmtime(model_file)}
+
+
+def save_stats(stats, fname, config, model_file):
+    ### written to a temporary file first, several ranks may save at once
+    stats = dict(stats, key=stats_key(config, model_file))
+    ftmp = f'{fname}.{os.getpid()}'
+    with open(ftmp, 'w') as f:
+        json.dump(stats, f, indent=1)
+    os.replace(ftmp, fname)
+
+
+def load_stats(fname, config, model_file):
+    ### None if missing or made for another training period, variable list or model file
+    if not os.path.isfile(fname):
+        return None
+    with open(fname) as f:
+        stats = json.load(f)
+    if stats.get('key')!=stats_key(config, model_file):
+        print(f'{fname} does not match the configuration or {model_file}, recomputing')
+        return None
+    return stats
+
+
+def apply_stc(data_ori, stats, config):
+    ### norm_stc with saved stats
+    inputs = data_ori.to_xarray()
+    log_list   = config['TEST_PARA']['log_var_list']
+    for vari in inputs.keys():
+        if vari != 'id':
+            xtmp = inputs[vari]
+            if vari in log_list:
+                xtmp = np.log10(np.sqrt(xtmp)+0.1)
+            avg, std = stats['stc'][vari]
+            xtmp = (xtmp-avg) / std
+            inputs[vari][:] = xtmp[:]
+    return inputs
+
+
+def transform(x, stats, features, config):
+    ### dynamic features of a [time, batch, feature] tensor normalized in place,
+    ### static features (already normalized by apply_stc) left as they are
+    log_list = config['TEST_PARA']['log_var_list']
+    xn = x.numpy()
+    for k, vari in enumerate(features):
+        if vari in stats['dyn']:
+            xtmp = xn[:, :, k]
+            if vari in log_list:
+                xtmp = np.log10(np.sqrt(xtmp)+0.1) ### eqt(11) in Feng et al.
+            avg, std = stats['dyn'][vari]
+            xn[:, :, k] = (xtmp-avg) / std
+    return x
+
+
+def to_flow(y_in, stats, config):
+    ### trans_to_flow with saved stats, on the whole [time, batch, 1] output
+    target = config['TEST_PARA']['target_var'][0]
+    y_out = y_in.detach().numpy()
+    avg, std = stats['target'][target]
+    y_out = y_out*np.float64(std) + np.float64(avg)
+    y_final = np.power(np.power(10, y_out)-0.1, 2)
+    return y_final[:,:,0]
@@ -3,13 +3,18 @@ import pandas as pd
 import torch
 import time
 import os
+from monflowpred import normalize
 
 def TrainLSTM(
     model,
     dataloader,
     lossFunc,
-    config
+    config,
+    stats=None
 ):
+    ### stats: normalization stats of the training period (normalize.calc_stats on the training
+    ### inputs, flow divided by area*p_mean, and config['TEST_PARA']['Ttrain']), saved next to
+    ### each model for the predictions
     nepoch      =  int(config['HYPER_PARA']['nepoch'])
     saveEpoch   =  int(config['HYPER_PARA']['EPOCHsave'])
     saveFolder  =  config['INPUT']['savemodel_dir']
@@ -30,8 +35,9 @@ def TrainLSTM(
         ####### main loop over train_data for each epoch
         countmx = 0
         for (batch_idx, batch) in enumerate(dataloader):
-            xi = batch[0][0,:,:,:]
-            yi = batch[1][0,:,:,:]
+            ### [1, time, basin, var] from a plain DataLoader, [time, nwin*basin, var] from core.window_loader
+            xi = batch[0][0,:,:,:] if batch[0].dim()==4 else batch[0]
+            yi = batch[1][0,:,:,:] if batch[1].dim()==4 else batch[1]
             model_out  = model(xi)
             loss = lossFunc(model_out, yi.float())
             loss.backward()
@@ -52,5 +58,7 @@ def TrainLSTM(
                     saveFolder, "model_Ep" + str(iepoch) + ".pt"
                 )
                 torch.save(model, modelFile)
+                if stats is not None:
+                    normalize.save_stats(stats, normalize.stats_file(modelFile), config, modelFile)
     # return model
 
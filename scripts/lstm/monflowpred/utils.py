@@ -1,3 +1,4 @@
+import os
 import numpy  as np
 import pandas as pd
 import xarray as xr
@@ -87,3 +88,52 @@ def read_flow_obs(config):
 
     return ds_all
 
+
+
+def frames_to_dataset(frames, var_list):
+    ''' per-basin DataFrames (with an indx column, in basin list order) -> Dataset [id, time],
+        same as read_dyn_inputs/read_flow_obs without the per-basin xarray concat '''
+    times = [pd.DatetimeIndex(pd.to_datetime(df['indx'])) for df in frames]
+    time  = times[0]
+    if not all([t.equals(time) for t in times[1:]]):
+        # basins with different dates: union of the dates, NaN where a basin has none, as the xarray concat (outer join)
+        for t in times[1:]:
+            time = time.union(t)
+        frames = [df.set_axis(t).reindex(time) for df,t in zip(frames, times)]
+    time = time.values
+    vs   = [varf for varf in list(frames[0]) if varf in var_list]
+    ds_all = xr.Dataset({varf: (('id', 'time'), np.stack([df[varf].to_numpy() for df in frames])) for varf in vs},
+                        coords={'id': np.arange(len(frames)), 'time': time})
+    return ds_all
+
+
+def assemble_inputs(config, hist, fcst, dump_dir=None, members=None):
+    ''' dynamic inputs and target of all ensemble members in memory, Dataset [var, id, time, member]
+        hist: {basin: historical DataFrame}; fcst: {basin: [forecast DataFrame of each member]}
+        dump_dir: optionally write the concatenated [dump_dir]/[member]/[basin].csv files for debugging
+        members: member numbers of the fcst lists, 1, 2, ... by default '''
+    with open(config['INPUT']['basin_listf']) as f:
+        basinlist = [line.rstrip() for line in f]
+    var_list = config['TEST_PARA']['dyn_var_list'] + config['TEST_PARA']['target_var']
+    nens = len(fcst[basinlist[0]])
+    if members is None:
+        members = list(range(1, nens+1))
+    dss = []
+    for ens in range(nens):
+        frames = [pd.concat([hist[bi], fcst[bi][ens]], ignore_index=True) for bi in basinlist]
+        if dump_dir is not None:
+            os.makedirs(f'{dump_dir}/{members[ens]:02d}', exist_ok=True)
+            for bi, df in zip(basinlist, frames):
+                df.to_csv(f'{dump_dir}/{members[ens]:02d}/{bi}.csv', index=False)
+        dss.append(frames_to_dataset(frames, var_list))
+    ds_all = xr.concat(dss, 'member').transpose('id', 'time', 'member')
+    return ds_all
+
+
+def split_inputs(config, ds_member):
+    ''' dynamic inputs and target of one member, as returned by read_dyn_inputs and read_flow_obs '''
+    dyn_list = [varf for varf in ds_member.keys() if varf in config['TEST_PARA']['dyn_var_list']]
+    tgt_list = [varf for varf in ds_member.keys() if varf in config['TEST_PARA']['target_var']]
+    xr_dyn = ds_member[dyn_list].copy(deep=True)
+    flow   = ds_member[tgt_list].copy(deep=True)
+    return xr_dyn, [len(dyn_list), ds_member.sizes['id']], flow
@@ -1,7 +1,7 @@
 ''' Run LSTM post-processing for ensemble forecast with additional CDF-matching
 
 Usage:
-    python run_lstm_cdfm_ens.py [domain] [fcst_start] [fcst_end] [fcst_update] [fcst_type]
+    [mpirun -np [# of procs]] python run_lstm_cdfm_ens.py [domain] [fcst_start] [fcst_end] [fcst_update] [fcst_type]
 Default values:
     must specify all
 '''
@@ -10,7 +10,7 @@ __author__ = 'Ming Pan'
 __email__  = 'm3pan@ucsd.edu'
 __status__ = 'Prototype'
 
-import sys, os, pytz, time, subprocess
+import sys, os, pytz, time, subprocess, copy
 from glob import glob
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
@@ -18,18 +18,28 @@ import pandas as pd
 import numpy as np
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time, replace_brackets
+from fcst_summary import write_summary, station_coords
 from cdf_match_lstm import sparse_cdf_match_lstm
 
+from mpi4py import MPI
 import s5_p1_predict
+from monflowpred import utils
 
 t1_hist = datetime(1979, 10, 1)
 t2_hist = datetime(2024, 9, 30)
 
+flag_dump_inputs = False  # write the concatenated inputs and predictions under lstm_tmp for debugging
+
 flag_cdfm_a2j = True
 
 ## main function
 def main(argv):
 
+    # MPI setup, ensemble members are distributed across ranks
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+
     domain = argv[0]
 
     t1 = datetime.strptime(argv[1], '%Y%m%d')
@@ -49,32 +59,35 @@ def main(argv):
     
     os.chdir(workdir)
     nens = len(glob('??'))
+    members = list(range(1, nens+1))[rank::size]
 
-    if not os.path.isdir(f'{tmpdir}/01'):
+    if flag_dump_inputs and not os.path.isdir(f'{tmpdir}/01'):
         allens = ' '.join([f'{tmpdir}/{e:02d}' for e in range(1, nens+1)])
         os.system(f'mkdir -p {allens}')
     if not os.path.isdir(outdir):
         os.system(f'mkdir -p {outdir}')
 
-    # concatennate historical and ensemble forecast data
-    print('Concatennate historical and ensemble forecast data...')
+    # historical and ensemble forecast data, concatenated in memory
+    print('Read historical and ensemble forecast data...')
+    hist = {}; fcst = {}
     for num,id in zip(namls['num'], namls['id']):
-        df_hist = pd.read_csv(f'{histdir}/{id}.{t1_hist:%Y%m}-{t2_hist:%Y%m}.dyn.csv')
-        for ens in range(1, nens+1):
+        hist[str(num)] = pd.read_csv(f'{histdir}/{id}.{t1_hist:%Y%m}-{t2_hist:%Y%m}.dyn.csv')
+        fcst[str(num)] = []
+        for ens in members:
             df_ens = pd.read_csv(f'{fcstdir}/{ens:02d}/{id}_monthly.csv')
             df_ens['FNF'] = 9999.0
             df_ens.rename(columns={'Date': 'indx'}, inplace=True)
-            df_tmp = pd.concat([df_hist, df_ens], ignore_index=True)
-            df_tmp.to_csv(f'{tmpdir}/{ens:02d}/{num}.csv', index=False)
+            fcst[str(num)].append(df_ens)
     
-    # lstm predictions
-    for ens in range(1, nens+1):
-        config_lstm = config['wrf_hydro'][domain]['lstm']
+    # lstm predictions, all members in one batch with the model loaded once
+    configs_lstm = []
+    for ens in members:
+        config_lstm = copy.deepcopy(config['wrf_hydro'][domain]['lstm'])
         config_lstm['INPUT'] = {'basin_listf':   f'{inputdir}/basin_24_list.txt',
                                 'dynamic_dir':   f'{tmpdir}/{ens:02d}/',
                                 'static_inputs': f'{inputdir}/basin_24_stable_vars.txt',
                                 'bs_name_ls':    f'{inputdir}/stn.names.24.txt',
-                                'output_dir':    f'{tmpdir}/{ens:02d}/',
+                                'output_dir':    f'{tmpdir}/{ens:02d}/' if flag_dump_inputs else None,
                                 'savemodel_dir': f'{inputdir}/'}
         # shift Tpredc to a new 48-month period that ends at t2
         t1_pred = datetime.strptime(config_lstm['TEST_PARA']['Tpredc'][0], '%Y%m%d')
@@ -84,7 +97,11 @@ def main(argv):
         t1_pred += relativedelta(months=monoff)
         config_lstm['TEST_PARA']['Tpredc'][0] = f'{t1_pred:%Y%m%d}'
         config_lstm['TEST_PARA']['Tpredc'][1] = f'{t2_pred:%Y%m%d}'
-        s5_p1_predict.main([config_lstm])
+        configs_lstm.append(config_lstm)
+    if len(members)>0:
+        inputs = utils.assemble_inputs(configs_lstm[0], hist, fcst, dump_dir=tmpdir if flag_dump_inputs else None, members=members)
+        preds  = s5_p1_predict.predict_members(configs_lstm, [inputs.isel(member=e) for e in range(len(members))],
+                                               nthreads=max(1, min(os.cpu_count(), config['wrf_hydro'][domain]['nprocs'])//size))
 
     # force the end date to the preset tvalid period
     # t2 = datetime.strptime(config_lstm['TEST_PARA']['Tpredc'][1], '%Y%m%d')
@@ -102,6 +119,41 @@ def main(argv):
     index2.append(f'{t2:%Y}-07-31')
     print(f'Number of months in forecast = {nmons}, April is {mapr}th month and July is {mjul}th month (counting from 0)')
     header = [f'Ens{e:02d}' for e in range(1,nens+1)] + ['Exc10','Exc50','Exc90','Pav10','Pav50','Pav90','Avg']
+    print('Record and CDF match the ensemble members of this rank...')
+    cols = [ens-1 for ens in members]
+    part = {}
+    for num,id in (zip(namls['num'], namls['id']) if len(members)>0 else []):
+
+        rec  = np.zeros((nmons+1,nens))-999.
+
+        #### record ensemble members
+        for j,ens in enumerate(members):
+            flw = preds[j][[num]].rename(columns={num: 'flow'})
+            rec[0:nmons,ens-1] = np.array(flw['flow'].loc[f'{t1:%Y%m%d}':f'{t2:%Y%m%d}'])
+            tstamps = list(flw['flow'].loc[f'{t1:%Y%m%d}':f'{t2:%Y%m%d}'].index.to_pydatetime())
+
+        #### CDF matching, all ensemble members of a month at once
+        ajsum0 = np.sum(rec[mapr:mjul+1,cols], axis=0)
+        for m in range(nmons):
+            month = tstamps[m].month
+            year  = tstamps[m].year
+            [matched, mavg] = sparse_cdf_match_lstm(domain, rec[m,cols], id, month, year)
+            rec[m,cols] = matched
+        [matched, mavg] = sparse_cdf_match_lstm(domain, ajsum0, id, 0, year)
+        ajsum1 = matched
+        ajsum2 = np.sum(rec[mapr:mjul+1,cols], axis=0)
+
+        rec[nmons,cols] = np.where(ajsum1<ajsum2, ajsum1, ajsum2)
+        if id=='FTO':
+            rec[nmons,cols] = (ajsum1+ajsum2)/2.0
+
+        part[num] = rec[:,cols]
+
+    # gather all members on rank 0 for the percentiles and %AVG
+    parts = comm.gather((cols, part), root=0)
+    if rank!=0:
+        return 0
+
     print('Merge ensembles and calculate percentiles...')
     for num,id in zip(namls['num'], namls['id']):
         
@@ -117,30 +169,9 @@ def main(argv):
         mcol = len(header)
         rec  = np.zeros((nmons+1,mcol))-999.
 
-        #### record ensemble members
-        for ens in range(nens):
-            flw = pd.read_csv(f'{tmpdir}/{ens+1:02d}/{num}.predicted-flow.{t1_pred:%Y%m%d}-{t2:%Y%m%d}.csv')
-            flw.index = pd.to_datetime(flw['date'])
-            rec[0:nmons,ens] = np.array(flw['flow'].loc[f'{t1:%Y%m%d}':f'{t2:%Y%m%d}'])
-            tstamps = [ datetime.strptime(ts, '%Y-%m-%d') for ts in flw['date'].loc[f'{t1:%Y%m%d}':f'{t2:%Y%m%d}'] ]
-
-            ajsum0 = np.sum(rec[mapr:mjul+1,ens])
-            for m in range(nmons):
-                month = tstamps[m].month
-                year  = tstamps[m].year
-                #print(id, ens, m, rec[m,ens], id, month, year)
-                [matched, mavg] = sparse_cdf_match_lstm(domain, rec[m,ens], id, month, year)
-                rec[m,ens] = matched
-            [matched, mavg] = sparse_cdf_match_lstm(domain, ajsum0, id, 0, year)
-            ajsum1 = matched
-            ajsum2 = np.sum(rec[mapr:mjul+1,ens])
-
-            rec[nmons,ens] = ajsum1 if ajsum1<ajsum2 else ajsum2
-            if id=='FTO':
-                rec[nmons,ens] = (ajsum1+ajsum2)/2.0
-                #rec[nmons,ens] = ajsum2
-            #rec[nmons,ens] = ajsum1
-            #rec[nmons,ens] = ajsum2
+        for rcols, rpart in parts:
+            if len(rcols)>0:
+                rec[:,rcols] = rpart[num]
 
         #### calculate p10, p50, p90, avg
         rec[:,nens]   = np.quantile(rec[:,0:nens], 0.9, axis=1)
@@ -158,6 +189,9 @@ def main(argv):
         dout = dout[f'{t1:%Y%m%d}':]
         dout.to_csv(f'{outdir}/{id}_{t1:%Y%m%d}-{t2:%Y%m%d}.csv',float_format="%.3f", index_label='Date')
 
+    # all stations in one file for the dashboard
+    write_summary(outdir, t1, t2, station_coords(domain))
+
     return 0
 
 if __name__ == '__main__':
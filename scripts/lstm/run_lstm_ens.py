@@ -10,7 +10,7 @@ __author__ = 'Ming Pan'
 __email__  = 'm3pan@ucsd.edu'
 __status__ = 'Prototype'
 
-import sys, os, pytz, time, subprocess
+import sys, os, pytz, time, subprocess, copy
 from glob import glob
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
@@ -20,10 +20,13 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/ut
 from utilities import config, find_last_time, replace_brackets
 
 import s5_p1_predict
+from monflowpred import utils
 
 t1_hist = datetime(1979, 10, 1)
 t2_hist = datetime(2024, 9, 30)
 
+flag_dump_inputs = False  # write the concatenated inputs and predictions under lstm_tmp for debugging
+
 ## main function
 def main(argv):
 
@@ -47,31 +50,33 @@ def main(argv):
     os.chdir(workdir)
     nens = len(glob('??'))
 
-    if not os.path.isdir(f'{tmpdir}/01'):
+    if flag_dump_inputs and not os.path.isdir(f'{tmpdir}/01'):
         allens = ' '.join([f'{tmpdir}/{e:02d}' for e in range(1, nens+1)])
         os.system(f'mkdir -p {allens}')
     if not os.path.isdir(outdir):
         os.system(f'mkdir -p {outdir}')
 
-    # concatennate historical and ensemble forecast data
-    print('Concatennate historical and ensemble forecast data...')
+    # historical and ensemble forecast data, concatenated in memory
+    print('Read historical and ensemble forecast data...')
+    hist = {}; fcst = {}
     for num,id in zip(namls['num'], namls['id']):
-        df_hist = pd.read_csv(f'{histdir}/{id}.{t1_hist:%Y%m}-{t2_hist:%Y%m}.dyn.csv')
+        hist[str(num)] = pd.read_csv(f'{histdir}/{id}.{t1_hist:%Y%m}-{t2_hist:%Y%m}.dyn.csv')
+        fcst[str(num)] = []
         for ens in range(1, nens+1):
             df_ens = pd.read_csv(f'{fcstdir}/{ens:02d}/{id}_monthly.csv')
             df_ens['FNF'] = 9999.0
             df_ens.rename(columns={'Date': 'indx'}, inplace=True)
-            df_tmp = pd.concat([df_hist, df_ens], ignore_index=True)
-            df_tmp.to_csv(f'{tmpdir}/{ens:02d}/{num}.csv', index=False)
+            fcst[str(num)].append(df_ens)
     
-    # lstm predictions
+    # lstm predictions, all members in one batch with the model loaded once
+    configs_lstm = []
     for ens in range(1, nens+1):
-        config_lstm = config['wrf_hydro'][domain]['lstm']
+        config_lstm = copy.deepcopy(config['wrf_hydro'][domain]['lstm'])
         config_lstm['INPUT'] = {'basin_listf':   f'{inputdir}/basin_24_list.txt',
                                 'dynamic_dir':   f'{tmpdir}/{ens:02d}/',
                                 'static_inputs': f'{inputdir}/basin_24_stable_vars.txt',
                                 'bs_name_ls':    f'{inputdir}/stn.names.24.txt',
-                                'output_dir':    f'{tmpdir}/{ens:02d}/',
+                                'output_dir':    f'{tmpdir}/{ens:02d}/' if flag_dump_inputs else None,
                                 'savemodel_dir': f'{inputdir}/'}
         # shift Tpredc to a new 48-month period that ends at t2
         t1_pred = datetime.strptime(config_lstm['TEST_PARA']['Tpredc'][0], '%Y%m%d')
@@ -81,7 +86,9 @@ def main(argv):
         t1_pred += relativedelta(months=monoff)
         config_lstm['TEST_PARA']['Tpredc'][0] = f'{t1_pred:%Y%m%d}'
         config_lstm['TEST_PARA']['Tpredc'][1] = f'{t2_pred:%Y%m%d}'
-        s5_p1_predict.main([config_lstm])
+        configs_lstm.append(config_lstm)
+    inputs = utils.assemble_inputs(configs_lstm[0], hist, fcst, dump_dir=tmpdir if flag_dump_inputs else None)
+    preds  = s5_p1_predict.predict_members(configs_lstm, [inputs.isel(member=e) for e in range(nens)], nthreads=min(os.cpu_count(), config['wrf_hydro'][domain]['nprocs']))
 
     # force the end date to the preset tvalid period
     # t2 = datetime.strptime(config_lstm['TEST_PARA']['Tpredc'][1], '%Y%m%d')
@@ -116,8 +123,7 @@ def main(argv):
 
         #### record ensemble members
         for ens in range(nens):
-            flw = pd.read_csv(f'{tmpdir}/{ens+1:02d}/{num}.predicted-flow.{t1_pred:%Y%m%d}-{t2:%Y%m%d}.csv')
-            flw.index = pd.to_datetime(flw['date'])
+            flw = preds[ens][[num]].rename(columns={num: 'flow'})
             rec[0:nmons,ens] = np.array(flw['flow'].loc[f'{t1:%Y%m%d}':f'{t2:%Y%m%d}'])
             rec[nmons,ens]   = np.sum(np.array(flw['flow'].loc[f'{t2:%Y}0401':f'{t2:%Y}0731']))
 
@@ -1,4 +1,4 @@
-import sys, os
+import sys, os, time
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import torch, random
 import numpy as np
@@ -9,6 +9,9 @@ from monflowpred.train import TrainLSTM
 from torch.utils.data import DataLoader
 from matplotlib import pyplot as plt
 
+kaf_2_mm3 = 1.2335e15   ### Kaf to mm^3
+m2_2_mm2  = 10 ** 6      ### m^2 to mm^2
+
 def cal_rmse(pred, obs):
     err = np.array(pred) - np.array(obs)
     rmse = np.sqrt(np.mean(np.power(err,2)))
@@ -53,138 +56,131 @@ def plt_mon(pred, qsim, obs, outf, lbs):
     plt.savefig(outf, dpi=180)
     plt.close()
 
-def main(argv):
-    
-    # Fix random seed (Yuan's version of hydroDL)
-    seedid = 111111
+## fix random seed (Yuan's version of hydroDL)
+def set_seed(seedid=111111):
     random.seed(seedid)
     torch.manual_seed(seedid)
     np.random.seed(seedid)
     torch.cuda.manual_seed(seedid)
     torch.backends.cudnn.deterministic = True
     torch.backends.cudnn.benchmark = False
-    ################################################
-    ################# Header Ends ##################
-    ################################################
 
-    
+## saved model of an epoch
+def model_file(config, epoch_use=350):
+    saveFolder = config['INPUT']['savemodel_dir']
+    return os.path.join(saveFolder, "model_Ep" + str(epoch_use) + ".pt")
 
-    config = argv[0]
-    output_dir = config['INPUT']['output_dir']
+## load the saved model once
+def load_model(config, epoch_use=350):
+    model = torch.load(model_file(config, epoch_use))
+    model.eval()
+    return model
+
+## read (or take the in-memory inputs of utils.assemble_inputs) and scale the inputs of one configuration
+## (e.g. one ensemble member), all prediction windows concatenated along time; the static inputs are
+## normalized here, the dynamic ones later on the whole batch with normalize.transform
+def prepare(config, inputs=None, stats=None):
 
     ###### Read static inputs
-    print('Reading static parameters...')
     df_stc, n_stc_var = utils.read_stc_inputs(config)
     df_stc_ori = df_stc.copy(deep=True)
 
     ###### Read dynamic inputs and natural flow (target)
-    print('Reading dynamic inputs for each basin...')
-    xr_dyn_rec, [n_dyn_var, n_stn] = utils.read_dyn_inputs(config)
-    flow_rec = utils.read_flow_obs(config)
-    xr_dyn_ori = xr_dyn_rec.copy(deep=True)
-
-    ###### Adjust units, prec to mm
-    #xr_dyn_rec['prec'][:] = xr_dyn_rec['prec'][:]*3600*24  ### adjust prcp to daily
-    #df_stc_ori['p_mean'][:] = df_stc_ori['p_mean'][:]*3600*24  ### adjust prcp to daily
-    kaf_2_mm3 = 1.2335e15
+    if inputs is None:
+        xr_dyn_rec, [n_dyn_var, n_stn] = utils.read_dyn_inputs(config)
+        flow_rec = utils.read_flow_obs(config)
+    else:
+        xr_dyn_rec, [n_dyn_var, n_stn], flow_rec = utils.split_inputs(config, inputs)
 
     ###### For each station, divide flow with (area*mean_p)
     for ni in range(n_stn):
         areai = df_stc_ori['size'].iloc[ni]
         pavgi = df_stc_ori['p_mean'].iloc[ni]
-        tmpc1 = kaf_2_mm3 ### Kaf to mm^3
-        tmpc2 = 10 ** 6   ### m^2 to mm^2
-        tmpc3 = 1.
-        flow_rec.loc[dict(id=ni)] = tmpc1/(tmpc2*tmpc3) * flow_rec.sel(id=ni) / (areai*pavgi)
-
-    ###### Normalize data, avg and std of the training data are
-    ###### also applied in the verifcation and prediction process
-    print('Normalize the inputs based on stats of the training period...')
+        flow_rec.loc[dict(id=ni)] = kaf_2_mm3/(m2_2_mm2*1.) * flow_rec.sel(id=ni) / (areai*pavgi)
+
+    ###### avg and std of the training period, only if not saved with the model
     t_train = config['TEST_PARA']['Ttrain']
-    t_valid = config['TEST_PARA']['Tvalid']
     t_valid = config['TEST_PARA']['Tpredc']
-    in_tmp  = normalize.norm_dyn(xr_dyn_rec, config,  t_train,  t_valid)
-    out_tmp = normalize.norm_dyn(flow_rec,   config,  t_train,  t_valid)
-    stc_tmp = normalize.norm_stc(df_stc, config)
+    if stats is None:
+        stats = normalize.calc_stats(xr_dyn_rec, flow_rec, df_stc, config, t_train)
+    in_tmp  = xr_dyn_rec.sel(time=slice(t_valid[0], t_valid[1]))
+    out_tmp = flow_rec.sel(time=slice(t_valid[0], t_valid[1]))
+    stc_tmp = normalize.apply_stc(df_stc, stats, config)
     stc_epd = stc_tmp.expand_dims(dim={"time": in_tmp.sizes['time']}, axis=1)
 
-    ###### Convert data to pytorch Dataset Class
+    ###### Prediction windows in the order the DataLoader gives them
     train_all = xr.merge([in_tmp, stc_epd, out_tmp])
     target   = config['TEST_PARA']['target_var']
     features = [xs for xs in train_all.keys() if xs not in target]
-    print(target)
-    print(features)
-
-    train_dataset = core.seqDataset(
-        train_all,
-        target=target,
-        features=features,
-        seq_len=12
-    )
-    train_loader = DataLoader(train_dataset, batch_size=1, shuffle=False)
-
-
-    ###### Train model and save at selected epoch
-    nx = n_dyn_var + n_stc_var
-    ny = 1
-    nt = int(config['HYPER_PARA']['rho'])
-
-    lossfunc = torch.nn.MSELoss()
-    lossfunc = core.RMSE_Loss()
-
-    nepoch      =  config['HYPER_PARA']['nepoch']
-    saveEpoch   =  config['HYPER_PARA']['EPOCHsave']
-    saveFolder  =  config['INPUT']['savemodel_dir']
-    ## saveFolder  =  './saved.model.with.swe/'
-    #saveFolder  =  './saved.model/'
-
-    epoch_use = 350
-
-    if 2>1:
-        modelFile = os.path.join(
-            saveFolder, "model_Ep" + str(epoch_use) + ".pt"
-            )
-        model = torch.load(modelFile)
-        loss_ttl = 0.
-        ####### main loop over data
-        outrec = []
-        for (batch_idx, batch) in enumerate(train_loader):
-            xi = batch[0][0,:,:,:]
-            yi = batch[1][0,:,:,:]
-            model_out  = model(xi)
-            outrec.append(normalize.trans_to_flow(model_out, flow_rec, config, t_train) )
-
-    y_predict = np.concatenate((outrec[:]), axis=0)
-
-
-    ###### flow mulitply by area and pavg
-    for ni in range(n_stn):
-        areai = df_stc_ori['size'].iloc[ni]
-        pavgi = df_stc_ori['p_mean'].iloc[ni]
-        flow_rec.loc[dict(id=ni)] = flow_rec.sel(id=ni) * (areai) * (tmpc2*tmpc3/tmpc1) * pavgi
-        y_predict[:,ni] = y_predict[:,ni] * (areai) * (tmpc2*tmpc3/tmpc1) * pavgi
-
-    obs = flow_rec.sel(time=slice(t_valid[0], t_valid[1]))
-    qsim = xr_dyn_ori['Qsim'].sel(time=slice(t_valid[0], t_valid[1]))
+    dataset  = core.seqDataset(train_all, target=target, features=features, seq_len=12)
+    x = torch.cat([dataset[i][0] for i in range(len(dataset))], dim=0)
 
-    nams = pd.read_csv(config['INPUT']['bs_name_ls'], names=['nums','ids','nams'])
+    return {'x': x, 'features': features, 'stats': stats, 'stc': df_stc_ori, 'n_stn': n_stn, 't_valid': t_valid}
 
-    output_dir = config['INPUT']['output_dir']
-
-    for bi in range(config['HYPER_PARA']['batch_size']):
-        predbi = pd.Series(y_predict[:,bi])
-        #predbi.index = pd.date_range(t_valid[0], t_valid[1], freq='ME')
-        predbi.index = pd.date_range(t_valid[0], t_valid[1], freq='M')
-        obsbi = pd.Series(obs.isel(id=bi).to_array()[0,:])
-        #obsbi.index = pd.date_range(t_valid[0], t_valid[1], freq='ME')
-        obsbi.index = pd.date_range(t_valid[0], t_valid[1], freq='M')
-
-        qsimbi = pd.Series(qsim.isel(id=bi)[:])
-        #qsimbi.index = pd.date_range(t_valid[0], t_valid[1], freq='ME')
-        qsimbi.index = pd.date_range(t_valid[0], t_valid[1], freq='M')
+## predicted flow of one configuration, [time, basin] with basins numbered from 1,
+## also written to output_dir if given
+def write_prediction(config, inp, y_predict):
 
+    ###### flow mulitply by area and pavg
+    for ni in range(inp['n_stn']):
+        areai = inp['stc']['size'].iloc[ni]
+        pavgi = inp['stc']['p_mean'].iloc[ni]
+        y_predict[:,ni] = y_predict[:,ni] * (areai) * (m2_2_mm2*1./kaf_2_mm3) * pavgi
+
+    t_valid = inp['t_valid']
+    output_dir = config['INPUT'].get('output_dir')
+    #pred = pd.DataFrame(y_predict, index=pd.date_range(t_valid[0], t_valid[1], freq='ME'))
+    pred = pd.DataFrame(y_predict, index=pd.date_range(t_valid[0], t_valid[1], freq='M'))
+    pred = pred.iloc[:, :config['HYPER_PARA']['batch_size']]
+    pred.columns = range(1, pred.shape[1]+1)
+    if output_dir:
+        for bi in pred.columns:
+            pred[bi].to_csv(output_dir+'/'+str(bi)+'.predicted-flow.'+t_valid[0]+'-'+t_valid[1]+'.csv',index_label='date', header=['flow'])
+
+    return pred
+
+## predict several configurations (e.g. all ensemble members) with one model load and one batched call,
+## members x basins stacked along the batch dimension; inputs: optional in-memory input of each configuration
+def predict_members(configs, inputs=None, nthreads=None, check=False):
+
+    set_seed()
+    if nthreads:
+        torch.set_num_threads(int(nthreads))
+
+    t0 = time.time()
+    model = load_model(configs[0])
+    # normalization stats saved with the model at training time, recomputed and saved if missing or stale
+    fmodel = model_file(configs[0])
+    fstats = normalize.stats_file(fmodel)
+    stats  = normalize.load_stats(fstats, configs[0], fmodel)
+    print('Reading inputs...')
+    inps = []
+    for i,c in enumerate(configs):
+        inps.append(prepare(c, inputs[i] if inputs is not None else None, stats))
+        if stats is None:
+            stats = inps[0]['stats']
+            normalize.save_stats(stats, fstats, configs[0], fmodel)
+    x = normalize.transform(torch.cat([inp['x'] for inp in inps], dim=1), stats, inps[0]['features'], configs[0])
+    t1 = time.time()
+    with torch.inference_mode():
+        model_out = model(x)
+        if check:
+            print(f'Max difference from the step loop: {(model_out-model.forward_steps(x)).abs().max().item():.2e}')
+    y_predict = normalize.to_flow(model_out, stats, configs[0])
+    t2 = time.time()
+
+    i1 = 0; preds = []
+    for c, inp in zip(configs, inps):
+        i2 = i1+inp['x'].shape[1]
+        preds.append(write_prediction(c, inp, y_predict[:, i1:i2]))
+        i1 = i2
+    print(f'{len(configs)} member(s) x {inps[0]["n_stn"]} basins: inputs {t1-t0:.1f}s, '
+          f'inference {t2-t1:.2f}s ({torch.get_num_threads()} threads), output {time.time()-t2:.1f}s')
+
+    return preds
 
-        predbi.to_csv(output_dir+'/'+str(bi+1)+'.predicted-flow.'+t_valid[0]+'-'+t_valid[1]+'.csv',index_label='date', header=['flow'])
+def main(argv):
+    predict_members([argv[0]])
 
 if __name__ == '__main__':
     main(sys.argv[1:])
@@ -14,35 +14,31 @@ import netCDF4 as nc
 from datetime import datetime, timedelta
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time
+from pctl_rank import rank_block, smtot, yday_of
+from pctl_store import open_pctl
 
 modelid = 'nwm_v3'
 
-## main function
-def main(argv):
-
-    '''main loop'''
-
-    domain = argv[0]
-    fname = argv[1]
-    print(fname)
+## open the daily climatology matching an output file, returns (fpctl, variables) or (None, None)
+def open_clim(domain, fname):
 
     yclim1 = config[modelid][domain]['climrange'][0]
     yclim2 = config[modelid][domain]['climrange'][1]
     
     if 'LDASOUT' in os.path.basename(fname):
-        fpctl = nc.Dataset(f'{config["base_dir"]}/{modelid}/{domain}/retro/output/1km_daily/stat/{yclim1}-{yclim2}.SMTOT_SWE.ydrunpctl.00-99', 'r')
         vs = ['SOIL_M', 'SNEQV']
+        fpctl = open_pctl(f'{config["base_dir"]}/{modelid}/{domain}/retro/output/1km_daily/stat/{yclim1}-{yclim2}.SMTOT_SWE.ydrunpctl.00-99', vs)
+    elif 'CHRTOUT' in os.path.basename(fname):
+        vs = ['streamflow']
+        fpctl = open_pctl(f'{config["base_dir"]}/{modelid}/{domain}/retro/output/1km_daily/stat/{yclim1}-{yclim2}.STREAMFLOW.ydrunpctl.00-99', vs)
     else:
-        if 'CHRTOUT' in os.path.basename(fname):
-            fpctl = nc.Dataset(f'{config["base_dir"]}/{modelid}/{domain}/retro/output/1km_daily/stat/{yclim1}-{yclim2}.STREAMFLOW.ydrunpctl.00-99', 'r')
-            vs = ['streamflow']
-        else:
-            print('We process either LDASOUT or CHRTOUT files.')
-            return 1
+        return None, None
 
-    fdata = nc.Dataset(fname, 'a')
+    return fpctl, vs
+
+## create the percentile rank variables in an output file
+def add_rank_vars(fdata, vs):
 
-    # copy all file data except for the excluded
     for name in vs:
         if name+'_r' in fdata.variables:
             print(f'Rank variable {name}_r already exists. Overwriting.')
@@ -54,18 +50,33 @@ def main(argv):
         fdata[name+'_r'].long_name = f'Percentile rank of {fdata[name].long_name}'
         fdata[name+'_r'].units = 'percentile'
 
-    #print(fdata['time'][:])
-    for t in range(fdata['time'].size):
-        dtime = nc.num2date(fdata['time'][:].data[t], fdata['time'].units)
-        yday = (dtime - dtime.replace(month=1, day=1)).days
-        for v in vs:
-            if v == 'SOIL_M':
-                fdata[v+'_r'][t] = ((fdata[v][t, :, 0, :]*0.05+fdata[v][t, :, 1, :]*0.15+fdata[v][t, :, 2, :]*0.3+fdata[v][t, :, 3, :]*0.5)>fpctl[v][yday]).sum(axis=0).astype(float)
-            elif v == 'streamflow' and len(fdata[v].shape) == 1:
-                fdata[v+'_r'][:] = (fdata[v][:]>fpctl[v][yday]).sum(axis=0).astype(float)
-            else:
-                fdata[v+'_r'][t] = (fdata[v][t]>fpctl[v][yday]).sum(axis=0).astype(float)
-            fdata.sync()
+## main function
+def main(argv):
+
+    '''main loop'''
+
+    domain = argv[0]
+    fname = argv[1]
+    print(fname)
+
+    fpctl, vs = open_clim(domain, fname)
+    if fpctl is None:
+        print('We process either LDASOUT or CHRTOUT files.')
+        return 1
+
+    fdata = nc.Dataset(fname, 'a')
+    add_rank_vars(fdata, vs)
+
+    # rank per variable with the thresholds of each day read once, each step written as it is ranked
+    ydays = [yday_of(nc.num2date(t, fdata['time'].units)) for t in fdata['time'][:].data]
+    for v in vs:
+        if v == 'SOIL_M':
+            rank_block(fdata[v], ydays, fpctl, v, transform=smtot, out=fdata[v+'_r'])
+        elif v == 'streamflow' and len(fdata[v].shape) == 1:
+            fdata[v+'_r'][:] = rank_block(fdata[v][:][None, :], ydays[-1:], fpctl, v)[0]
+        else:
+            rank_block(fdata[v], ydays, fpctl, v, out=fdata[v+'_r'])
+    fdata.sync()
 
     fpctl.close()
     fdata.close()
@@ -14,17 +14,12 @@ import netCDF4 as nc
 from datetime import datetime, timedelta
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time
+from add_pctl_rank_daily import add_rank_vars
 
 modelid = 'nwm_v3'
 
-## main function
-def main(argv):
-
-    '''main loop'''
-
-    domain = argv[0]
-    fname = argv[1]
-    print(fname)
+## open the monthly climatology matching an output file, returns (fpctl, variables) or (None, None)
+def open_clim(domain, fname):
 
     yclim1 = config[modelid][domain]['climrange'][0]
     yclim2 = config[modelid][domain]['climrange'][1]
@@ -39,22 +34,26 @@ def main(argv):
         fpctl = nc.Dataset(f'{config["base_dir"]}/{modelid}/{domain}/retro/forcing/1km_monthly/stat/{yclim1}-{yclim2-1}.RAINRATE_T2D.monthly.ymonpctl.00-99', 'r')
         vs = ['RAINRATE', 'T2D']
     else:
+        return None, None
+
+    return fpctl, vs
+
+## main function
+def main(argv):
+
+    '''main loop'''
+
+    domain = argv[0]
+    fname = argv[1]
+    print(fname)
+
+    fpctl, vs = open_clim(domain, fname)
+    if fpctl is None:
         print('We process either LDASOUT or CHRTOUT or LDASIN files.')
         return 1
 
     fdata = nc.Dataset(fname, 'a')
-
-    # copy all file data except for the excluded
-    for name in vs:
-        if name+'_r' in fdata.variables:
-            print(f'Rank variable {name}_r already exists. Overwriting.')
-            continue
-        if name != 'SOIL_M':
-            x = fdata.createVariable(name+'_r', 'f4', fdata[name].dimensions, zlib=True)
-        else:
-            x = fdata.createVariable(name+'_r', 'f4', ('time', 'y', 'x',), zlib=True)
-        fdata[name+'_r'].long_name = f'Percentile rank of {fdata[name].long_name}'
-        fdata[name+'_r'].units = 'percentile'
+    add_rank_vars(fdata, vs)
 
     for t in range(fdata['time'].size):
         dtime = nc.num2date(fdata['time'][t], fdata['time'].units)
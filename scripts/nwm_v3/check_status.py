@@ -16,6 +16,7 @@ from datetime import datetime, timedelta, UTC
 from dateutil.relativedelta import relativedelta
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time, find_last_time2
+from basin_store import export_csv
 
 ## some setups
 modelid = 'nwm_v3'
@@ -147,8 +148,12 @@ def main(argv):
             #os.system('gcloud storage rsync data gs://cw3e-water-panel.appspot.com/data --recursive')
             os.system('rsync -av imgs/cnrfc/* m3pan@skyriver.ucsd.edu:/data/projects/website/mirror/htdocs/wrf_hydro/cnrfc/imgs/')
             os.system(f'rsync -av {fnjson} m3pan@skyriver.ucsd.edu:/data/projects/website/mirror/htdocs/wrf_hydro/cnrfc/csv/')
+            # NRT per-basin CSVs exported from the basin store (only when it changed)
+            for freq in ['hourly', 'daily', 'monthly']:
+                export_csv(f'{config["base_dir"]}/{modelid}/cnrfc/nrt/output/basins/basins.db', freq, 'Basin',
+                           f'{config["base_dir"]}/{modelid}/cnrfc/nrt/output/basins/{freq}')
             for ptype in ['nrt', 'fcst/wwrf', 'fcst/gfs']:
-                os.system(f'rsync -av {config["base_dir"]}/{modelid}/cnrfc/{ptype}/output/basins/* m3pan@skyriver.ucsd.edu:/data/projects/website/mirror/htdocs/wrf_hydro/cnrfc/csv/basins/{ptype}/')
+                os.system(f'rsync -av --exclude=".*" {config["base_dir"]}/{modelid}/cnrfc/{ptype}/output/basins/* m3pan@skyriver.ucsd.edu:/data/projects/website/mirror/htdocs/wrf_hydro/cnrfc/csv/basins/{ptype}/')
                 os.system(f'rsync -av {config["base_dir"]}/{modelid}/cnrfc/{ptype}/output/basins m3pan@skyriver.ucsd.edu:/data/projects/Hydro/wrf_hydro/cnrfc/{ptype}/output/')
     
     return 0
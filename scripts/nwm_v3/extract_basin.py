@@ -16,98 +16,60 @@ from glob import glob
 import pandas as pd
 import numpy as np
 import xarray as xr
-from scipy import ndimage
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from calendar import monthrange
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time
+from basin_weights import reach_weights, grid_weights, aggregate
+from pctl_rank import smtot
+from basin_store import BasinStore, from_csv
 
 modelid = 'nwm_v3'
 
+## basins x reaches weights, built from the basin_reach_list_fraction CSVs once and cached per domain
+def chrt_weights(domain, df_basins, feature_ids):
+
+    list_path = f'{config["base_dir"]}/{modelid}/{domain}/domain/basin_reach_list_fraction'
+    fcache    = f'{config["base_dir"]}/{modelid}/{domain}/domain/basin_weights_reach.npz'
+    return reach_weights(list_path, df_basins['Basin'].to_numpy(), feature_ids, fcache)
+
 def extract_chrt(domain, df_basins, fchrt):
     
-    # ==== USER INPUTS ====
-    #variables_to_sum = ["q_lateral", "qBucket", "qSfcLatRunoff", "qBtmVertRunoff"]  # variables to sum
     variables_to_sum = ["qBucket", "qSfcLatRunoff", "q_lateral", "qBtmVertRunoff"]  # variables to sum
-    id_column = "feature_id"                           # column name in CSVs
-    frac_column = "fraction"                            # column name in CSVs
-    list_path = f'{config["base_dir"]}/{modelid}/{domain}/domain/basin_reach_list_fraction'    # folder containing your CSV files
-    # ======================
-
 
     # 1) Open once, load variables to memory for speed
     ds = xr.open_dataset(fchrt)
-    ds_mem = ds[variables_to_sum].load()
+    variables_to_sum = [var for var in variables_to_sum if var in ds.data_vars]
+    w = chrt_weights(domain, df_basins, ds.coords["feature_id"].values)
 
-    # Assume a common feature_id coordinate across variables
-    dataset_ids = ds.coords["feature_id"].values
+    # 2) All basins and variables in one sparse product over the [time, feature_id] block
+    sums = aggregate(w, [ds[var].values for var in variables_to_sum])
+    times = ds['time'].values
+    ds.close()
 
-    # 2) Process each CSV list
     combined_all = []
-    for basin in df_basins['Basin']:
-        
-        df = pd.read_csv(f'{list_path}/{basin}.csv')
-
-        # Coerce types; drop rows with missing IDs; fill NaN fractions with 0
-        df = df[[id_column, frac_column]].copy()
-        df = df.dropna(subset=[id_column])
-        df[frac_column] = pd.to_numeric(df[frac_column], errors="coerce").fillna(0.0)
-        # If there are duplicate feature_id rows, aggregate their fractions
-        df = df.groupby(id_column, as_index=True)[frac_column].sum()
-
-        # Clip fractions to [0,1] to be safe
-        df = df.clip(lower=0.0, upper=1.0)
-
-        csv_ids = df.index.values.astype(dataset_ids.dtype, copy=False)
-
-        # Intersect with dataset IDs and get indices for alignment
-        common_ids, idx_csv, idx_ds = np.intersect1d(
-            csv_ids, dataset_ids, return_indices=True
-        )
-
-        # Aligned weights
-        weights = df.values[idx_csv]  # fractions aligned to common_ids
-
-        # Build a weight DataArray on feature_id for broadcasting over time
-        w_da = xr.DataArray(
-            weights,
-            dims=["feature_id"],
-            coords={"feature_id": common_ids},
-            name="weights",
-        )
-
-        combined = None
-
-        # 3) Weighted sum for each variable (all data already in memory)
-        for var in variables_to_sum:
-            if var not in ds_mem.data_vars:
-                print(f"Variable '{var}' not found; skipping.")
-                continue
-
-            # Select only the common feature_ids and broadcast weights
-            var_sel = ds_mem[var].sel(feature_id=common_ids, drop=True)
-
-            # Multiply by weights and sum
-            var_wsum = (var_sel * w_da).sum(dim="feature_id")
-
-            # Give the DataArray a name before converting
-            var_wsum.name = var
-
-            # Convert to DataFrame
-            var_df = var_wsum.to_dataframe().reset_index()
-
-            # Merge across variables on 'time'
-            combined = var_df if combined is None else combined.merge(var_df, on="time")
-
-        # 4) Save one CSV per list with all variables’ weighted sums
+    for j in range(w.shape[0]):
+        combined = pd.DataFrame({'Date': times})
+        for var, x in zip(variables_to_sum, sums):
+            combined[var] = x[:, j]
         # convert m^3 to m^3/s
         combined['qBtmVertRunoff'] = combined['qBtmVertRunoff']/3600.
-        combined.rename(columns={'time': 'Date'}, inplace=True)
         combined_all.append(combined)
 
     return combined_all
 
+## [time, basin] runoff from the per-basin routing sums
+def runoff(basin_sums, nb):
+
+    return np.stack([basin_sums[j]['qBucket'].to_numpy() + basin_sums[j]['qSfcLatRunoff'].to_numpy() for j in range(nb)], axis=1)
+
+## basins x grid cells mean operator, cached per domain
+def grid_means(domain, basin_data, basin_ids):
+
+    fcache = f'{config["base_dir"]}/{modelid}/{domain}/domain/basin_weights_grid.npz'
+    return grid_weights(basin_data, basin_ids, fcache)
+
 ## main function
 def main(argv):
 
@@ -128,6 +90,8 @@ def main(argv):
     workdir = f'{config["base_dir"]}/{modelid}/{domain}/{ptype}/output'
     os.chdir(workdir)
 
+    basin_means     = []
+    basin_means_mon = []
     t = t1
     while t<=t2:
 
@@ -142,33 +106,22 @@ def main(argv):
         else:
             tstamps.extend([nc.num2date(fin['time'][i], fin['time'].units).strftime('%Y-%m-%d') for i in range(ntimes)])
         #print(tstamps)
-        for i in range(ntimes):
-            data_swe = np.squeeze(fin['SNEQV'][i, :, :])
-            data_sm  = np.squeeze(fin['SOIL_M'][i, :, 0, :]*0.05 + fin['SOIL_M'][i, :, 1, :]*0.15 + fin['SOIL_M'][i, :, 2, :]*0.3 + fin['SOIL_M'][i, :, 3, :]*0.5)
-            if t==t1 and i==0:
-                basin_data[data_swe.mask] = 0
-                basin_ids = np.unique(basin_data)
-                basin_ids = basin_ids[basin_ids!=0]
-                basin_means_swe = ndimage.mean(data_swe, labels=basin_data, index=basin_ids)
-                basin_means_sm  = ndimage.mean(data_sm,  labels=basin_data, index=basin_ids)
-            else:
-                basin_means_swe = np.vstack((basin_means_swe, ndimage.mean(data_swe, labels=basin_data, index=basin_ids)))
-                basin_means_sm  = np.vstack((basin_means_sm,  ndimage.mean(data_sm,  labels=basin_data, index=basin_ids)))
+        data_swe = fin['SNEQV'][:]
+        data_sm  = smtot(fin['SOIL_M'][:])
+        if t==t1:
+            basin_data[np.ma.getmaskarray(data_swe[0])] = 0
+            basin_ids = np.unique(basin_data)
+            basin_ids = basin_ids[basin_ids!=0]
+            wgrid = grid_means(domain, basin_data, basin_ids)
+        swe, sm = aggregate(wgrid, [data_swe, data_sm])
         fin.close()
 
         # daily forcing
         print('  daily forcing')
         fin = nc.Dataset(f'../forcing/1km_daily/{t:%Y/%Y%m}.LDASIN_DOMAIN1.daily', 'r')
-        for i in range(ntimes):
-            data_p = np.squeeze(fin['RAINRATE'][i, :, :]*86400)
-            data_t = np.squeeze(fin['T2D'][i, :, :]-273.15)
-            if t==t1 and i==0:
-                basin_means_p = ndimage.mean(data_p, labels=basin_data, index=basin_ids)
-                basin_means_t = ndimage.mean(data_t, labels=basin_data, index=basin_ids)
-            else:
-                basin_means_p = np.vstack((basin_means_p, ndimage.mean(data_p, labels=basin_data, index=basin_ids)))
-                basin_means_t = np.vstack((basin_means_t, ndimage.mean(data_t, labels=basin_data, index=basin_ids)))
+        p, tt = aggregate(wgrid, [fin['RAINRATE'][:ntimes]*86400, fin['T2D'][:ntimes]-273.15])
         fin.close()
+        basin_means.append([swe, sm, p, tt])
 
         # daily routing output
         print('  daily routing output')
@@ -189,29 +142,16 @@ def main(argv):
             else:
                 tstamps_mon.append(t.strftime('%Y-%m-%d'))
             fin = nc.Dataset(f'1km_monthly/{t:%Y/%Y%m}.LDASOUT_DOMAIN1.monthly', 'r')
-            data_swe_mon = np.squeeze(fin['SNEQV'][0, :, :])
-            data_sm_mon  = np.squeeze(fin['SOIL_M'][0, :, 0, :]*0.05 + fin['SOIL_M'][0, :, 1, :]*0.15 + fin['SOIL_M'][0, :, 2, :]*0.3 + fin['SOIL_M'][0, :, 3, :]*0.5)
-            if t==t1:
-                basin_means_swe_mon = ndimage.mean(data_swe_mon, labels=basin_data, index=basin_ids)
-                basin_means_sm_mon  = ndimage.mean(data_sm_mon,  labels=basin_data, index=basin_ids)
-            else:
-                basin_means_swe_mon = np.vstack((basin_means_swe_mon, ndimage.mean(data_swe_mon, labels=basin_data, index=basin_ids)))
-                basin_means_sm_mon  = np.vstack((basin_means_sm_mon,  ndimage.mean(data_sm_mon,  labels=basin_data, index=basin_ids)))
+            swe, sm = aggregate(wgrid, [fin['SNEQV'][:1], smtot(fin['SOIL_M'][:1])])
             fin.close()
         
             # monthly forcing
             print('  monthly forcing')
             fin = nc.Dataset(f'../forcing/1km_monthly/{t:%Y/%Y%m}.LDASIN_DOMAIN1.monthly', 'r')
             md = monthrange(t.year, t.month)[1]
-            data_p_mon = np.squeeze(fin['RAINRATE'][0, :, :]*86400*md)
-            data_t_mon = np.squeeze(fin['T2D'][0, :, :]-273.15)
-            if t==t1:
-                basin_means_p_mon = ndimage.mean(data_p_mon, labels=basin_data, index=basin_ids)
-                basin_means_t_mon = ndimage.mean(data_t_mon, labels=basin_data, index=basin_ids)
-            else:
-                basin_means_p_mon = np.vstack((basin_means_p_mon, ndimage.mean(data_p_mon, labels=basin_data, index=basin_ids)))
-                basin_means_t_mon = np.vstack((basin_means_t_mon, ndimage.mean(data_t_mon, labels=basin_data, index=basin_ids)))
+            p, tt = aggregate(wgrid, [fin['RAINRATE'][:1]*86400*md, fin['T2D'][:1]-273.15])
             fin.close()
+            basin_means_mon.append([swe, sm, p, tt])
         
             # monthly routing output
             print('  monthly routing output')
@@ -235,17 +175,11 @@ def main(argv):
         
         t += relativedelta(months=1)
 
-    basin_means_swe = np.atleast_2d(basin_means_swe)
-    basin_means_sm  = np.atleast_2d(basin_means_sm)
-    basin_means_p   = np.atleast_2d(basin_means_p)
-    basin_means_t   = np.atleast_2d(basin_means_t)
+    basin_means_swe, basin_means_sm, basin_means_p, basin_means_t = [np.concatenate(x) for x in zip(*basin_means)]
     
     if ptype.split('/')[0]!='fcst':
         freqs = ['hourly', 'daily', 'monthly']
-        basin_means_swe_mon = np.atleast_2d(basin_means_swe_mon)
-        basin_means_sm_mon  = np.atleast_2d(basin_means_sm_mon)
-        basin_means_p_mon   = np.atleast_2d(basin_means_p_mon)
-        basin_means_t_mon   = np.atleast_2d(basin_means_t_mon)
+        basin_means_swe_mon, basin_means_sm_mon, basin_means_p_mon, basin_means_t_mon = [np.concatenate(x) for x in zip(*basin_means_mon)]
     else:
         freqs = ['hourly', 'daily']
             
@@ -259,9 +193,35 @@ def main(argv):
 
     print(f'Writing data: total={basin_ids.size} basins')
 
+    basin_names = [df_basins.loc[df_basins['ID']==basin_ids[j], 'Basin'].to_list()[0] for j in range(basin_ids.size)]
+    if ptype=='nrt':
+        # NRT: the basin store is the only sink and only the dates from the last stored one on are written,
+        # the per-basin CSVs are exported from it when published (basin_store.py export, see check_status.py)
+        data = {'daily': {'SWE': basin_means_swe, 'SMTOT': basin_means_sm, 'T2D': basin_means_t, 'PREC': basin_means_p,
+                          'RUNOFF': runoff(basin_sums_all, basin_ids.size)},
+                'monthly': {'SWE': basin_means_swe_mon, 'SMTOT': basin_means_sm_mon, 'T2D': basin_means_t_mon, 'PREC': basin_means_p_mon,
+                            'RUNOFF': runoff(basin_sums_mon_all, basin_ids.size)},
+                'hourly': {var: np.stack([basin_sums_hr_all[j][var].to_numpy() for j in range(basin_ids.size)], axis=1)
+                           for var in basin_sums_hr_all[0].columns if var!='Date'}}
+        data['hourly']['RUNOFF'] = runoff(basin_sums_hr_all, basin_ids.size)
+        dates = {'daily': tstamps, 'monthly': tstamps_mon,
+                 'hourly': pd.to_datetime(basin_sums_hr_all[0]['Date']).dt.strftime('%Y-%m-%d %H:%M:%S').tolist()}
+        store = BasinStore('basins/basins.db', 'Basin')
+        for freq in freqs:
+            if store.last_date(freq) is None:
+                # first NRT run on the store, import the CSV archives
+                fcsvs = [f'{outds[freq]}/{basin_name}_{freq}.csv.gz' for basin_name in basin_names]
+                for basin_name, fcsv in zip(basin_names, fcsvs):
+                    if os.path.isfile(fcsv):
+                        from_csv(store, freq, fcsv, basin_name)
+            n = store.append_new(freq, basin_names, dates[freq], data[freq])
+            print(f'  {freq}: {n} of {len(dates[freq])} dates written to basins/basins.db')
+        store.close()
+        return 0
+
     dfs = {}
     for j in range(basin_ids.size):
-        basin_name = df_basins.loc[df_basins['ID']==basin_ids[j], 'Basin'].to_list()[0] 
+        basin_name = basin_names[j]
 
         if j%10==0:
             print(f'    {j+1}th: {basin_name}')
@@ -290,11 +250,6 @@ def main(argv):
             fnout = f'{outds[freq]}/{basin_name}_{freq}.csv.gz'
             dfs[freq].set_index('Date', inplace=True)
             
-            if ptype=='nrt' and os.path.isfile(fnout):
-                df0 = pd.read_csv(fnout, parse_dates=True, index_col='Date')
-                dfs[freq] = pd.concat([df0, dfs[freq]])
-                dfs[freq] = dfs[freq].loc[~dfs[freq].index.duplicated(keep='last')]
-
             if freq=='hourly':
                 dfs[freq].to_csv(fnout, compression='gzip', float_format='%.4f')
             else:
@@ -1,4 +1,4 @@
-''' Merge WRF-Hydro per-dayoutput files into per-month and aggregate to daily/monthly
+''' Merge WRF-Hydro per-dayoutput files into per-month and aggregate to daily/monthly, in one pass per product
 
 Usage:
     mpirun -np [# of procs] python merge_aggregate.py [domain] [yyyymm1] [yyyymm2] [retro|nrt|fcst/xxx]
@@ -17,6 +17,7 @@ from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time
+from merge_engine import merge_month, update_month
 
 from mpi4py import MPI
 import add_pctl_rank_daily, add_pctl_rank_monthly
@@ -28,6 +29,24 @@ size = comm.Get_size()
 
 modelid = 'nwm_v3'
 
+## daily climatology for ranks, only for nrt and fcst
+def rank_day(domain, fname, ptype):
+
+    if ptype=='nrt' or ptype.split('/')[0]=='fcst':
+        fpctl, vs = add_pctl_rank_daily.open_clim(domain, fname)
+        if fpctl is not None:
+            return fpctl, vs
+    return None
+
+## monthly climatology for ranks, only for nrt
+def rank_mon(domain, fname, ptype):
+
+    if ptype=='nrt' and fname is not None:
+        fpctl, vs = add_pctl_rank_monthly.open_clim(domain, fname)
+        if fpctl is not None:
+            return fpctl, vs
+    return None
+
 ## main function
 def main(argv):
 
@@ -46,6 +65,9 @@ def main(argv):
         flag_deldaily  = False
         flag_delhourly = False
 
+    # NRT reruns only the last days each cycle, so only rewrite what changed in the month files
+    merge = update_month if ptype=='nrt' else merge_month
+
     workdir   = f'{config["base_dir"]}/{modelid}/{domain}/{ptype}/output/1km_daily'
     os.chdir(workdir)
 
@@ -65,23 +87,10 @@ def main(argv):
             if os.path.isfile(fn):
                 fin.append(fn)
 
-        cmd = f'cdo -O -f nc4 -z zip -mergetime {" ".join(fin)} {fout}'
-        print(cmd); os.system(cmd)
-        cmd = f'ncks -4 -L 5 {fout} {fout}.nc4; /bin/mv {fout}.nc4 {fout}'
-        print(cmd); os.system(cmd)
+        fmout = f'../1km_monthly/{m:%Y/%Y%m}.LDASOUT_DOMAIN1.monthly' if ptype.split('/')[0]!='fcst' else None
+        merge(fin, fout, fmon=fmout, rank_day=rank_day(domain, fout, ptype), rank_mon=rank_mon(domain, fmout, ptype))
         if flag_deldaily:
             os.system(f'rm -f {" ".join(fin)}')
-        if ptype=='nrt' or ptype.split('/')[0]=='fcst':
-            add_pctl_rank_daily.main([domain, fout])
-
-        if ptype.split('/')[0]!='fcst':
-            fmout = f'../1km_monthly/{m:%Y/%Y%m}.LDASOUT_DOMAIN1.monthly'
-            cmd = f'cdo -O -f nc4 -z zip monmean {fout} {fmout}'
-            print(cmd); os.system(cmd)
-            cmd = f'ncks -4 -L 5 {fmout} {fmout}.nc4; /bin/mv {fmout}.nc4 {fmout}'
-            print(cmd); os.system(cmd)
-            if ptype=='nrt':
-                add_pctl_rank_monthly.main([domain, fmout])
 
         outtypes = ['CHRT']
         if config[modelid][domain]['lake']:
@@ -97,29 +106,11 @@ def main(argv):
                 if os.path.isfile(fn):
                     fin.append(fn)
 
-            cmd = f'cdo -O -f nc4 -z zip -mergetime {" ".join(fin)} {fout}'
-            print(cmd); os.system(cmd)
-            cmd = f'ncks -4 -L 5 {fout} {fout}.nc4; /bin/mv {fout}.nc4 {fout}'
-            print(cmd); os.system(cmd)
+            fdout = f'{m:%Y/%Y%m}.{rout}OUT_DOMAIN1.daily'
+            fmout = f'../1km_monthly/{m:%Y/%Y%m}.{rout}OUT_DOMAIN1.monthly' if ptype.split('/')[0]!='fcst' else None
+            merge(fin, fout, fday=fdout, fmon=fmout, rank_day=rank_day(domain, fdout, ptype), rank_mon=rank_mon(domain, fmout, ptype))
             if flag_delhourly:
                 os.system(f'rm -f {" ".join(fin)}')
-        
-            fdout = f'{m:%Y/%Y%m}.{rout}OUT_DOMAIN1.daily'
-            cmd = f'cdo -O -f nc4 -z zip daymean {fout} {fdout}'
-            print(cmd); os.system(cmd)
-            cmd = f'ncks -4 -L 5 {fdout} {fdout}.nc4; /bin/mv {fdout}.nc4 {fdout}'
-            print(cmd); os.system(cmd)
-            if ptype=='nrt' or ptype.split('/')[0]=='fcst':
-                add_pctl_rank_daily.main([domain, fdout])
-            
-            if ptype.split('/')[0]!='fcst':
-                fmout = f'../1km_monthly/{m:%Y/%Y%m}.{rout}OUT_DOMAIN1.monthly'
-                cmd = f'cdo -O -f nc4 -z zip monmean {fdout} {fmout}'
-                print(cmd); os.system(cmd)
-                cmd = f'ncks -4 -L 5 {fmout} {fmout}.nc4; /bin/mv {fmout}.nc4 {fmout}'
-                print(cmd); os.system(cmd)
-                if ptype=='nrt':
-                    add_pctl_rank_monthly.main([domain, fmout])
 
     return 0
 
@@ -0,0 +1,306 @@
+''' Basin/HUC (and river reach) time series store, replacing the per-basin (or per-HUC4) gzip CSVs rewritten
+    every NRT cycle and the wide transposed river tables
+
+One SQLite file per basin set, one table per frequency (hourly/daily/monthly) keyed by (basin, Date).
+The store is the NRT sink: each cycle writes only the dates from the last stored one on (append_new), and
+the per-basin (or per-HUC4) CSVs are exported from it when they are published (export_csv).
+The tables are WITHOUT ROWID, i.e. stored clustered on the key, so that all dates of one basin sit together
+and a single basin's series is one index range read. New days are upserted, only the columns written are
+touched, so different columns (e.g. monitor, forecast, percentiles of a reach) can be filled in the same rows
+and nothing already stored is read back or rewritten. A file must only ever have one writing job: it uses the
+default rollback journal (WAL is not supported on the shared HPC file system), where concurrent writers from
+separate jobs end in lock timeouts. Series filled by independent jobs (river monitor, percentiles, forecast,
+ensemble members) are therefore written to one part file per producer and merged into the published store in
+a single downstream step (merge_stores, run by check_status.py).
+
+Usage:
+    python basin_store.py convert [db file] [hourly|daily|monthly] [id column] [csv files ...]   # import CSV archives
+    python basin_store.py merge [db file] [table] [id column] [part db files ...]   # merge per-producer stores
+    python basin_store.py export [db file] [hourly|daily|monthly] [id column] [out dir] [id prefix length]   # CSVs from the store
+    python basin_store.py bench [# of basins] [# of days]   # synthetic daily update and single-basin read vs. CSV
+    python basin_store.py read [db file] [table] [id column] [id]   # cold and warm latency of a single-basin read
+    otherwise imported by other scripts
+'''
+
+__author__ = 'Ming Pan'
+__email__  = 'm3pan@ucsd.edu'
+__status__ = 'Development'
+
+import sys, os, time, sqlite3, tempfile
+import numpy as np
+import pandas as pd
+
+## time series store of one basin set
+class BasinStore:
+
+    '''idcol: name of the basin column, e.g. "Basin" or "HUC8"'''
+
+    def __init__(self, fname, idcol='Basin'):
+
+        self.fname = fname
+        self.idcol = idcol
+        self.conn  = sqlite3.connect(fname, timeout=600)
+        # back to the rollback journal for files created in WAL mode by earlier versions
+        self.conn.execute('PRAGMA journal_mode=DELETE')
+
+    ## columns of a table, empty if the table does not exist
+    def columns(self, table):
+
+        return [r[1] for r in self.conn.execute(f'PRAGMA table_info([{table}])')]
+
+    ## create the table or add missing variable columns
+    def prepare(self, table, vs):
+
+        defs = ', '.join([f'[{v}] REAL' for v in vs])
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS [{table}] ([{self.idcol}] TEXT NOT NULL, Date TEXT NOT NULL, {defs}, '
+                          f'PRIMARY KEY ([{self.idcol}], Date)) WITHOUT ROWID')
+        for v in vs:
+            if v not in self.columns(table):
+                try:
+                    self.conn.execute(f'ALTER TABLE [{table}] ADD COLUMN [{v}] REAL')
+                except sqlite3.OperationalError:
+                    # another script writing the same file may have added it in the meantime
+                    if v not in self.columns(table):
+                        raise
+
+    ## insert rows, or update only the given variables of existing rows
+    def upsert(self, table, vs, cols):
+
+        names = ', '.join([f'[{self.idcol}]', 'Date']+[f'[{v}]' for v in vs])
+        marks = ', '.join(['?']*len(cols))
+        sets  = ', '.join([f'[{v}]=excluded.[{v}]' for v in vs])
+        with self.conn:
+            self.conn.executemany(f'INSERT INTO [{table}] ({names}) VALUES ({marks}) '
+                                  f'ON CONFLICT([{self.idcol}], Date) DO UPDATE SET {sets}', zip(*cols))
+
+    ## append (or replace) the [time, basin] arrays of several variables
+    def append_block(self, table, ids, dates, data):
+
+        '''ids: basin ids as strings; dates: ISO date strings; data: {variable: [time, basin] array}'''
+
+        vs = list(data.keys())
+        self.prepare(table, vs)
+        nt, nb = len(dates), len(ids)
+        # rows in key order (basin, then date) so the b-tree is filled sequentially
+        cols = [np.repeat(np.asarray(ids, dtype=str), nt).tolist(), np.tile(np.asarray(dates, dtype=str), nb).tolist()]
+        for v in vs:
+            x = np.ma.asarray(data[v]).astype(np.float64).filled(np.nan)
+            cols.append(x.T.ravel().tolist())
+        self.upsert(table, vs, cols)
+
+    ## append the [time, basin] arrays of the dates from the last stored date on only, that date is rewritten
+    ## as its values may have been partial (current day or month); returns the # of dates written
+    def append_new(self, table, ids, dates, data):
+
+        '''dates: ISO date strings in ascending order, as for append_block'''
+
+        last = self.last_date(table)
+        k = 0 if last is None else int(np.searchsorted(np.asarray(dates, dtype=str), last[:len(dates[0])]))
+        if k<len(dates):
+            self.append_block(table, ids, dates[k:], {v: x[k:] for v, x in data.items()})
+        return len(dates)-k
+
+    ## as append_new for a long table with the id column, a Date column/index and variable columns
+    def append_new_frame(self, table, df):
+
+        df = df.reset_index() if 'Date' not in df.columns else df
+        last = self.last_date(table)
+        if last is not None:
+            df = df[pd.to_datetime(df['Date'])>=pd.Timestamp(last)]
+        if len(df)>0:
+            self.append(table, df)
+        return len(df)
+
+    ## append (or replace) a long table with the id column, a Date column/index and variable columns
+    def append(self, table, df):
+
+        df = df.reset_index() if 'Date' not in df.columns else df
+        vs = [c for c in df.columns if c not in [self.idcol, 'Date']]
+        self.prepare(table, vs)
+        dates = df['Date'].astype(str) if df['Date'].dtype==object else df['Date'].dt.strftime('%Y-%m-%d %H:%M:%S' if table=='hourly' else '%Y-%m-%d')
+        cols  = [df[self.idcol].astype(str).tolist(), dates.tolist()]+[df[v].astype(np.float64).tolist() for v in vs]
+        self.upsert(table, vs, cols)
+
+    ## the series of one basin, indexed by Date
+    def read(self, table, bid, vs=None):
+
+        sel = '*' if vs is None else ', '.join(['Date']+[f'[{v}]' for v in vs])
+        df = pd.read_sql_query(f'SELECT {sel} FROM [{table}] WHERE [{self.idcol}]=? ORDER BY Date', self.conn,
+                               params=(str(bid),), parse_dates=['Date'], index_col='Date')
+        return df.drop(columns=[self.idcol], errors='ignore')
+
+    ## last date stored in a table, None if empty
+    def last_date(self, table):
+
+        if len(self.columns(table))==0:
+            return None
+        return self.conn.execute(f'SELECT MAX(Date) FROM [{table}]').fetchone()[0]
+
+    def close(self):
+
+        self.conn.close()
+
+## import a CSV archive file (one basin per file, or many basins with an id column)
+def from_csv(store, table, fcsv, bid=None):
+
+    '''bid: basin id of a single-basin file without an id column, by default taken from the file name'''
+
+    df = pd.read_csv(fcsv, dtype={store.idcol: str})
+    if store.idcol not in df.columns:
+        df[store.idcol] = bid if bid is not None else os.path.basename(fcsv).split('_'+table)[0]
+    store.append(table, df)
+
+## convert CSV archives into a store
+def convert(fdb, table, idcol, fcsvs):
+
+    t0 = time.time()
+    store = BasinStore(fdb, idcol)
+    for fcsv in fcsvs:
+        from_csv(store, table, fcsv)
+    store.close()
+    print(f'{len(fcsvs)} files into {fdb}:{table} in {time.time()-t0:.1f}s, {os.path.getsize(fdb)/1e6:.1f} MB')
+
+## merge the part stores of several producers into one store, built in a temporary file and renamed so
+## readers never see a partial file; skipped when no part changed since the last merge
+def merge_stores(fdb, fparts, table='daily', idcol='Basin'):
+
+    fparts = [f for f in fparts if os.path.isfile(f)]
+    if len(fparts)==0:
+        print(f'No part stores for {fdb}')
+        return 1
+    if os.path.isfile(fdb) and os.path.getmtime(fdb)>=max([os.path.getmtime(f) for f in fparts]):
+        print(f'{fdb} up to date with {len(fparts)} part stores')
+        return 0
+
+    t0 = time.time()
+    ftmp = f'{fdb}.tmp'
+    if os.path.isfile(ftmp):
+        os.remove(ftmp)
+    store = BasinStore(ftmp, idcol)
+    for fpart in fparts:
+        part = BasinStore(fpart, idcol)
+        vs = [v for v in part.columns(table) if v not in [idcol, 'Date']]
+        part.close()
+        if len(vs)==0:
+            continue
+        store.prepare(table, vs)
+        names = ', '.join([f'[{idcol}]', 'Date']+[f'[{v}]' for v in vs])
+        sets  = ', '.join([f'[{v}]=excluded.[{v}]' for v in vs])
+        store.conn.execute('ATTACH DATABASE ? AS part', (fpart,))
+        with store.conn:
+            store.conn.execute(f'INSERT INTO main.[{table}] ({names}) SELECT {names} FROM part.[{table}] WHERE true '
+                               f'ON CONFLICT([{idcol}], Date) DO UPDATE SET {sets}')
+        store.conn.execute('DETACH DATABASE part')
+    store.close()
+    os.replace(ftmp, fdb)
+    print(f'{len(fparts)} part stores merged into {fdb}:{table} in {time.time()-t0:.1f}s')
+
+    return 0
+
+## write the CSV files of a table from a store into dout, one per basin ({id}_{table}.csv.gz indexed by Date)
+## or, with plen, one per id prefix of plen characters with the id column ({prefix}_{table}.csv.gz, e.g. HUC4),
+## in the layouts the NRT scripts used to rewrite; skipped when the store has not changed since the last export
+def export_csv(fdb, table, idcol, dout, plen=None, float_format='%.4f'):
+
+    stamp = f'{dout}/.{os.path.basename(fdb)}.{table}.exported'
+    if not os.path.isfile(fdb):
+        print(f'{fdb} not found')
+        return 1
+    if os.path.isfile(stamp) and os.path.getmtime(stamp)>=os.path.getmtime(fdb):
+        print(f'{dout}: {table} CSVs up to date with {fdb}')
+        return 0
+
+    t0 = time.time()
+    os.makedirs(dout, exist_ok=True)
+    store = BasinStore(fdb, idcol)
+    ids = [r[0] for r in store.conn.execute(f'SELECT DISTINCT [{idcol}] FROM [{table}] ORDER BY [{idcol}]')]
+    groups = {}
+    for bid in ids:
+        groups.setdefault(bid[:plen] if plen else bid, []).append(bid)
+    dfmt = None if table=='hourly' else '%Y-%m-%d'
+    for key, bids in groups.items():
+        fcsv = f'{dout}/{key}_{table}.csv.gz'
+        if plen:
+            df = pd.read_sql_query(f'SELECT * FROM [{table}] WHERE [{idcol}] IN ({", ".join(["?"]*len(bids))}) ORDER BY [{idcol}], Date',
+                                   store.conn, params=bids, parse_dates=['Date'])
+            df = df[['Date', idcol]+[c for c in df.columns if c not in ['Date', idcol]]]
+            df.to_csv(fcsv+'.tmp', compression='gzip', index=False, float_format=float_format, date_format=dfmt)
+        else:
+            store.read(table, key).to_csv(fcsv+'.tmp', compression='gzip', float_format=float_format, date_format=dfmt)
+        os.replace(fcsv+'.tmp', fcsv)
+    store.close()
+    open(stamp, 'w').close()
+    print(f'{fdb}:{table} to {len(groups)} CSV files in {dout} in {time.time()-t0:.1f}s')
+
+    return 0
+
+## synthetic timing of a daily NRT update and a single-basin read, store vs. per-basin CSV rewrite
+def bench(nb, nd):
+
+    rng   = np.random.default_rng(0)
+    vs    = ['SWE', 'SMTOT', 'T2D', 'PREC', 'RUNOFF']
+    ids   = [f'B{j:05d}' for j in range(nb)]
+    dates = pd.date_range('2020-01-01', periods=nd+1, freq='D').strftime('%Y-%m-%d').tolist()
+    hist  = {v: rng.random((nd, nb)) for v in vs}
+    new   = {v: rng.random((1, nb)) for v in vs}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for j, bid in enumerate(ids):
+            df = pd.DataFrame({v: hist[v][:, j] for v in vs}, index=pd.Index(dates[:-1], name='Date'))
+            df.to_csv(f'{tmp}/{bid}_daily.csv.gz', compression='gzip', float_format='%.4f')
+        store = BasinStore(f'{tmp}/basins.db')
+        store.append_block('daily', ids, dates[:-1], hist)
+
+        # daily update, the old way: read back, concat, dedupe and re-gzip every basin
+        t0 = time.time()
+        for j, bid in enumerate(ids):
+            fcsv = f'{tmp}/{bid}_daily.csv.gz'
+            df0 = pd.read_csv(fcsv, index_col='Date')
+            df  = pd.concat([df0, pd.DataFrame({v: new[v][:, j] for v in vs}, index=pd.Index(dates[-1:], name='Date'))])
+            df  = df.loc[~df.index.duplicated(keep='last')]
+            df.to_csv(fcsv, compression='gzip', float_format='%.4f')
+        t1 = time.time()
+        store.append_block('daily', ids, dates[-1:], new)
+        t2 = time.time()
+
+        # single-basin read
+        bid = ids[nb//2]
+        t3 = time.time()
+        a = pd.read_csv(f'{tmp}/{bid}_daily.csv.gz', parse_dates=True, index_col='Date')
+        t4 = time.time()
+        b = store.read('daily', bid)
+        t5 = time.time()
+        store.close()
+
+        print(f'{nb} basins x {nd} days: update CSV {t1-t0:.2f}s, store {t2-t1:.3f}s; '
+              f'single-basin read CSV {(t4-t3)*1000:.1f}ms, store {(t5-t4)*1000:.1f}ms, '
+              f'max diff {np.abs(a[vs].values-b[vs].values).max():.1e}')
+
+## cold (new connection) and warm (repeated) latency of a single-basin read
+def read_latency(fdb, table, idcol, bid, nrep=10):
+
+    t0 = time.time()
+    store = BasinStore(fdb, idcol)
+    df = store.read(table, bid)
+    t1 = time.time()
+    for _ in range(nrep):
+        df = store.read(table, bid)
+    t2 = time.time()
+    store.close()
+    print(f'{fdb}:{table} {idcol}={bid}, {df.shape[0]} rows x {df.shape[1]} series: '
+          f'cold {(t1-t0)*1000:.1f}ms, warm {(t2-t1)/nrep*1000:.1f}ms')
+
+if __name__ == '__main__':
+    if len(sys.argv)>1 and sys.argv[1]=='bench':
+        args = [int(a) for a in sys.argv[2:4]]
+        bench(*(args+[1000, 3650][len(args):]))
+    elif len(sys.argv)>5 and sys.argv[1]=='read':
+        read_latency(*sys.argv[2:6])
+    elif len(sys.argv)>5 and sys.argv[1]=='merge':
+        merge_stores(sys.argv[2], sys.argv[5:], sys.argv[3], sys.argv[4])
+    elif len(sys.argv)>5 and sys.argv[1]=='export':
+        export_csv(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5], int(sys.argv[6]) if len(sys.argv)>6 else None)
+    elif len(sys.argv)>5 and sys.argv[1]=='convert':
+        convert(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5:])
+    else:
+        print(__doc__)
@@ -0,0 +1,131 @@
+''' Sparse basin aggregation operators cached per domain
+
+Basins x reaches (fraction weighted sums) and basins x grid cells (means) are built once into scipy.sparse
+matrices and saved next to the domain files, so that all basins and all variables of a [time, feature]
+block are aggregated with a single sparse matrix multiplication.
+
+Usage:
+    imported by other scripts most of the time
+    python basin_weights.py bench [# of basins] [# of reaches] [# of times]   # synthetic timing vs. per-basin loop
+'''
+
+__author__ = 'Ming Pan'
+__email__  = 'm3pan@ucsd.edu'
+__status__ = 'Development'
+
+import sys, os, time
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+## save/load a sparse matrix together with the keys it was built for
+def save_weights(fname, w, **keys):
+
+    w = w.tocsr()
+    np.savez(fname, data=w.data, indices=w.indices, indptr=w.indptr, shape=w.shape, **keys)
+
+def load_weights(fname, **keys):
+
+    '''return the cached matrix, or None if missing or built for different keys'''
+
+    if not os.path.isfile(fname):
+        return None
+    f = np.load(fname, allow_pickle=False)
+    for k, v in keys.items():
+        if k not in f or not np.array_equal(f[k], np.asarray(v)):
+            return None
+    return sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+
+## basins x reaches matrix of reach fractions from basin_reach_list_fraction/{basin}.csv
+def reach_weights(list_path, basins, feature_ids, fcache=None):
+
+    basins = np.asarray(basins).astype(str)
+    if fcache is not None:
+        w = load_weights(fcache, basins=basins, feature_ids=feature_ids)
+        if w is not None:
+            return w
+
+    order = np.argsort(feature_ids)
+    rows, cols, vals = [], [], []
+    for j, basin in enumerate(basins):
+        df = pd.read_csv(f'{list_path}/{basin}.csv')
+        df = df[['feature_id', 'fraction']].dropna(subset=['feature_id'])
+        df['fraction'] = pd.to_numeric(df['fraction'], errors='coerce').fillna(0.0)
+        df = df.groupby('feature_id', as_index=True)['fraction'].sum().clip(lower=0.0, upper=1.0)
+        ids = df.index.values.astype(feature_ids.dtype, copy=False)
+        pos = np.searchsorted(feature_ids, ids, sorter=order)
+        pos = np.minimum(pos, feature_ids.size-1)
+        ok  = feature_ids[order[pos]]==ids
+        rows.append(np.full(ok.sum(), j))
+        cols.append(order[pos[ok]])
+        vals.append(df.values[ok])
+
+    w = sparse.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                          shape=(basins.size, feature_ids.size))
+    if fcache is not None:
+        save_weights(fcache, w, basins=basins, feature_ids=feature_ids)
+    return w
+
+## basins x grid cells matrix of 1/count weights, so that a product gives the basin means
+def grid_weights(labels, basin_ids, fcache=None):
+
+    labels = np.asarray(labels).ravel()
+    if fcache is not None:
+        w = load_weights(fcache, labels=labels, basin_ids=basin_ids)
+        if w is not None:
+            return w
+
+    order = np.argsort(basin_ids)
+    pos   = np.minimum(np.searchsorted(basin_ids, labels, sorter=order), basin_ids.size-1)
+    ok    = (basin_ids[order[pos]]==labels) & (labels!=0)
+    rows  = order[pos[ok]]
+    cnt   = np.bincount(rows, minlength=basin_ids.size).astype(np.float64)
+    vals  = 1.0/cnt[rows]
+
+    w = sparse.csr_matrix((vals, (rows, np.nonzero(ok)[0])), shape=(basin_ids.size, labels.size))
+    if fcache is not None:
+        save_weights(fcache, w, labels=labels, basin_ids=basin_ids)
+    return w
+
+## apply a weight matrix to several [time, feature...] blocks at once, returns a list of [time, basin]
+def aggregate(w, blocks):
+
+    '''masked/NaN values count as 0 (like xarray's skipna sum); basins without any cell give NaN'''
+
+    nts  = [b.shape[0] for b in blocks]
+    x    = np.concatenate([np.ma.asarray(b).reshape(b.shape[0], -1).astype(np.float64).filled(0.0) for b in blocks])
+    x[np.isnan(x)] = 0.0
+    res  = np.asarray(w @ x.T).T
+    res[:, np.asarray(w.getnnz(axis=1))==0] = np.nan
+
+    return np.split(res, np.cumsum(nts)[:-1])
+
+## synthetic timing of the sparse product against the per-basin intersect/weighted-sum loop
+def bench(nb, nf, nt):
+
+    rng = np.random.default_rng(0)
+    feature_ids = rng.permutation(nf*3)[:nf]
+    x = rng.random((nt, nf))
+    lists = [(rng.choice(feature_ids, rng.integers(10, 2000), replace=False), rng.random()) for _ in range(nb)]
+
+    t0 = time.time()
+    old = np.zeros((nt, nb))
+    for j, (ids, frac) in enumerate(lists):
+        common, idx_csv, idx_ds = np.intersect1d(ids, feature_ids, return_indices=True)
+        old[:, j] = (x[:, idx_ds]*frac).sum(axis=1)
+    t1 = time.time()
+    order = np.argsort(feature_ids)
+    rows  = np.concatenate([np.full(ids.size, j) for j, (ids, frac) in enumerate(lists)])
+    cols  = np.concatenate([order[np.searchsorted(feature_ids, ids, sorter=order)] for ids, frac in lists])
+    vals  = np.concatenate([np.full(ids.size, frac) for ids, frac in lists])
+    w = sparse.csr_matrix((vals, (rows, cols)), shape=(nb, nf))
+    t2 = time.time()
+    new = aggregate(w, [x])[0]
+    t3 = time.time()
+
+    print(f'{nb} basins x {nf} reaches x {nt} times: loop {t1-t0:.2f}s, build {t2-t1:.2f}s, sparse {t3-t2:.2f}s, max diff {np.abs(old-new).max():.2e}')
+
+if __name__ == '__main__':
+    if len(sys.argv)>1 and sys.argv[1]=='bench':
+        args = [int(a) for a in sys.argv[2:5]]
+        bench(*(args+[200, 100000, 744][len(args):]))
@@ -0,0 +1,186 @@
+''' Calculate day-of-year running-window (31-day) percentiles 0.5, 1.5, ..., 99.5 of a retro daily record,
+    replacing the split_calc.py (cdo ydrunmin/ydrunmax/ydrunpctl per split per percentile) + stitch.py chain
+
+Each rank reads its spatial blocks of the record once and computes all 100 percentiles of all days-of-year
+in one pass, writing straight into its feature range of a compact percentile store (see pctl_store.py).
+
+Usage:
+    mpirun -np [# of procs] python calc_ydrunpctl.py [STREAMFLOW|SMTOT_SWE] [# of blocks] [retro period]
+    python calc_ydrunpctl.py compare [store file] [cdo ydrunpctl.00-99 file] [variable] [cdo ydrunmin file] [cdo ydrunmax file]
+Default values:
+    [# of blocks]: 100
+    [retro period]: "1979-2023"
+    [cdo ydrunmin/ydrunmax file]: the window min/max cdo binned between, the store's outer percentiles if not given
+'''
+
+__author__ = 'Ming Pan'
+__email__  = 'm3pan@ucsd.edu'
+__status__ = 'Development'
+
+import sys, os, math, time, resource, calendar
+import numpy as np
+import netCDF4 as nc
+from datetime import datetime
+from mpi4py import MPI
+from pctl_store import PctlStore, create_store, store_name
+
+# MPI setup
+comm = MPI.COMM_WORLD
+rank = comm.Get_rank()
+size = comm.Get_size()
+
+nwin  = 31
+npctl = 100
+ndoy  = 366
+nbins = int(os.environ.get('CDO_PCTL_NBINS', 101))   # histogram bins of cdo ydrunpctl, for the comparison tolerance
+
+## record time steps grouped by the day-of-year of the running window center
+def window_index(dtimes):
+
+    '''for each day-of-year, the time indices of all 31-day windows centered on that day-of-year;
+       a day-of-year without any center (Feb 29 slot of a record without leap years) takes the windows of its neighbors'''
+
+    half  = nwin//2
+    ydays = np.array([(d - d.replace(month=1, day=1)).days for d in dtimes])
+    cidx  = [[] for _ in range(ndoy)]
+    for t in range(half, len(dtimes)-half):
+        cidx[ydays[t]].append(t)
+    for yday in range(ndoy):
+        if len(cidx[yday])==0:
+            cidx[yday] = cidx[yday-1] + cidx[(yday+1)%ndoy]
+
+    return [(np.array(c)[:, None]+np.arange(-half, half+1)[None, :]).ravel() if c else np.array([], dtype=int) for c in cidx]
+
+## all 100 percentiles for one [time, feature] block, yields (doy, [pctl, feature]) one day-of-year at a time
+def block_pctl(blk, widx):
+
+    '''NaN (missing) values are skipped as cdo does, features without any valid value are missing (+inf)'''
+
+    q = (np.arange(npctl)+0.5)/100
+    for yday, idx in enumerate(widx):
+        out = np.full((npctl, blk.shape[1]), np.inf, dtype=np.float32)
+        if idx.size>0:
+            vals = np.sort(blk[idx], axis=0)   # NaN sorts last
+            nval = np.sum(~np.isnan(vals), axis=0)
+            pos  = q[:, None]*np.maximum(nval-1, 0)[None, :]
+            i0   = np.floor(pos).astype(int)
+            i1   = np.minimum(i0+1, np.maximum(nval-1, 0)[None, :])
+            w    = pos-i0
+            res  = np.take_along_axis(vals, i0, axis=0)*(1-w)+np.take_along_axis(vals, i1, axis=0)*w
+            ok   = nval>0
+            out[:, ok] = res[:, ok]
+        yield yday, out
+
+## main function
+def main(argv):
+
+    '''main loop'''
+
+    v       = argv[0]
+    nblocks = int(argv[1]) if len(argv)>1 else 100
+    retro   = argv[2] if len(argv)>2 else '1979-2023'
+
+    if v == 'STREAMFLOW':
+        dim = 'feature_id'
+        vs  = ['streamflow']
+    elif v == 'SMTOT_SWE':
+        dim = 'y'
+        vs  = ['SOIL_M', 'SNEQV']
+    else:
+        print('We process either STREAMFLOW or SMTOT_SWE.')
+        return 1
+
+    t0  = time.time()
+    fin = nc.Dataset(f'{retro}.{v}', 'r')
+    tunits = fin['time'].units
+    dtimes = nc.num2date(fin['time'][:], tunits, only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+    widx   = window_index(dtimes)
+    leapyrs = [d.year for d in dtimes if d.month==2 and d.day==29]
+    # the store is laid out on a leap year, a synthetic one if the record has none
+    leapyr = leapyrs[-1] if len(leapyrs)>0 else [y for y in range(dtimes[0].year, dtimes[0].year+4) if calendar.isleap(y)][0]
+    time0  = nc.date2num(datetime(leapyr, 1, 1), tunits)
+
+    nf   = len(fin.dimensions[dim])
+    step = math.ceil(nf/nblocks)
+    fpctl = f'{retro}.{v}.ydrunpctl.00-99'
+
+    if rank==0:
+        for name in vs:
+            create_store(store_name(fpctl, name), name, ndoy, npctl, fin[name].shape[1:], 'u2', time0, tunits, f'{retro}.{v}')
+    comm.Barrier()
+    stores = {name: PctlStore(store_name(fpctl, name)) for name in vs}
+
+    for s,i1 in enumerate(range(0, nf, step)):
+        if s%size!=rank:
+            continue
+        i2 = min(i1+step, nf)
+        print(rank, s, i1, i2-1)
+        for name in vs:
+            # a block of rows (or reaches) maps onto a contiguous flat feature range in the store
+            blk = fin[name][:, i1:i2]
+            ncol = int(np.prod(blk.shape[2:]))
+            blk = np.ma.asarray(blk).astype(np.float32).filled(np.nan).reshape(blk.shape[0], -1)
+            for yday, res in block_pctl(blk, widx):
+                stores[name].write_block(yday, i1*ncol, res)
+
+    for store in stores.values():
+        store.close()
+    fin.close()
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+    peak = comm.reduce(peak, op=MPI.MAX, root=0)
+    comm.Barrier()
+    if rank==0:
+        print(f'{v}: {nf} x {nblocks} blocks on {size} ranks, wall time {time.time()-t0:.1f}s, peak memory per rank {peak:.0f} MB')
+
+    return 0
+
+## compare a store against the cdo ydrunpctl output, 1 if any threshold is off by more than the tolerance
+def compare(fstore, fcdo, vname, fmin=None, fmax=None):
+
+    '''cdo ydrunpctl bins the window values into nbins bins between ydrunmin and ydrunmax, so its thresholds are
+       exact to one bin width (max-min)/nbins; the tolerance is that plus the quantization error of a u2 store,
+       (1+|x|)*(exp(qscale/2)-1); the same features must be missing in both'''
+
+    store = PctlStore(fstore)
+    fin   = nc.Dataset(fcdo, 'r')
+    fmn   = nc.Dataset(fmin, 'r') if fmin else None
+    fmx   = nc.Dataset(fmax, 'r') if fmax else None
+    qerr  = np.expm1(store.header['qscale']/2) if store.header.get('enc')=='log1p' else 0.0
+    maxabs = 0.0
+    maxrel = 0.0
+    nbad  = 0
+    nmiss = 0
+    for yday in range(min(store.ndoy, fin[vname].shape[0])):
+        a = np.asarray(store[yday], dtype=np.float64)
+        b = np.sort(np.ma.asarray(fin[vname][yday]).filled(np.inf).astype(np.float64), axis=0)
+        if fmn is not None and fmx is not None:
+            width = (np.ma.asarray(fmx[vname][yday]).filled(np.nan)-np.ma.asarray(fmn[vname][yday]).filled(np.nan))/nbins
+        else:
+            width = (np.nan_to_num(a[-1], posinf=0)-np.nan_to_num(a[0], posinf=0))/nbins
+        width = np.broadcast_to(np.nan_to_num(width, nan=0), a.shape)
+        nmiss += np.sum(np.isfinite(a)!=np.isfinite(b))
+        ok = np.isfinite(a) & np.isfinite(b)
+        if ok.any():
+            d = np.abs(a[ok]-b[ok])
+            maxabs = max(maxabs, d.max())
+            maxrel = max(maxrel, (d/np.maximum(np.abs(b[ok]), 1e-6)).max())
+            nbad  += np.sum(d>width[ok]+(1+np.abs(b[ok]))*qerr+1e-6)
+    for f in [fin, fmn, fmx]:
+        if f is not None:
+            f.close()
+    store.close()
+    print(f'{vname}: max abs diff {maxabs:.4g}, max rel diff {maxrel:.4g}, {nbad} thresholds beyond one cdo bin width (nbins={nbins}), '
+          f'{nmiss} differ in missing')
+    assert nbad==0 and nmiss==0, f'{fstore} does not match {fcdo} within tolerance'
+    return 0
+
+if __name__ == '__main__':
+    if len(sys.argv)>1 and sys.argv[1]=='compare':
+        try:
+            compare(*sys.argv[2:7])
+        except AssertionError as e:
+            print(e)
+            sys.exit(1)
+    else:
+        main(sys.argv[1:])
@@ -0,0 +1,244 @@
+''' Vectorized sparse CDF matching of simulated/post-processed flows against FNF with cached historical tables
+
+Each site's historical monthly record is read once per process, and the sorted (Q, FNF log-ratio) pairs
+are built once per (site, month or month range, excluded year). Whole arrays (e.g. all ensemble members
+of a month) are then matched in one call with the same piecewise-linear log-ratio interpolation as the
+original per-value loop in cdf_match.py / cdf_match_lstm.py / cdf_match_range.py.
+
+Usage:
+    python cdf_matching.py check [site monthly csv] [FNF monthly csv] [clim year1] [clim year2]
+        regression check of the cdf_match*.py functions against the original ones, on a canned site record
+        (1990-2021, climatology 1990-2019) if no files are given, exits with 1 on any difference
+    otherwise imported by other scripts
+'''
+
+__author__ = 'Ming Pan'
+__email__  = 'm3pan@ucsd.edu'
+__status__ = 'Development'
+
+import sys, os, time, functools
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+## historical monthly record of one site up to the end of the climatology, read once
+@functools.lru_cache(maxsize=None)
+def load_hist(hist_file, yclim2):
+
+    hist_data = pd.read_csv(hist_file, index_col='Date', parse_dates=True)
+    return hist_data[hist_data.index<=datetime(yclim2, 12, 31)]
+
+## monthly observed FNF of one site, read once
+@functools.lru_cache(maxsize=None)
+def load_fnf(fnf_file):
+
+    return pd.read_csv(fnf_file, index_col='Date', parse_dates=True)
+
+## sorted Q, log-ratios and FNF average of one site for a month (or annual sums over a month range),
+## leaving out the year being corrected
+@functools.lru_cache(maxsize=None)
+def hist_table(hist_file, yclim2, qcol, month1, month2, year, annual=False):
+
+    hist_data = load_hist(hist_file, yclim2)
+    # remove dates within the year being corrected
+    hist_data = hist_data[(hist_data.index<datetime(year, 1, 1))|(hist_data.index>datetime(year, 12, 31))]
+    months = pd.to_datetime(hist_data.index).month
+    if annual:
+        hist_month = hist_data[(months>=month1)&(months<=month2)].resample('1Y').sum()
+    else:
+        hist_month = hist_data[months==month1]
+
+    # sort and pair them, log ratios
+    fnf = np.sort(hist_month['FNF'].to_numpy().astype(np.float64))
+    q   = np.sort(hist_month[qcol].to_numpy().astype(np.float64))
+    fnf[fnf<=0] = 0.0001
+    q[q<=0]     = 0.0001
+    lr  = np.log(fnf/q)
+    q.flags.writeable  = False
+    lr.flags.writeable = False
+
+    return q, lr, hist_month['FNF'].mean()
+
+## match an array of values with a (Q, log-ratio) table, same result as the per-value loop
+def match(data, q, lr):
+
+    v = np.asarray(data, dtype=np.float64)
+    x = v.reshape(-1, 1)
+    # interval index as in the loop: number of table values below v, minus 1
+    j  = np.clip((q[None, :]<x).sum(axis=1)-1, 0, max(q.size-2, 0))
+    j2 = np.minimum(j+1, q.size-1)
+    x  = x[:, 0]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mid = lr[j] + (lr[j2]-lr[j]) * (x-q[j])/(q[j2]-q[j])
+    r = np.where(x<=q[0], lr[0], np.where(x>=q[-1], lr[-1], mid))
+    matched = (x*np.exp(r)).reshape(v.shape)
+
+    return matched if matched.ndim>0 else float(matched)
+
+## the original functions of cdf_match.py / cdf_match_lstm.py / cdf_match_range.py (per value, re-reading
+## the CSV files on every call), with the file paths passed in instead of taken from config, for checking only
+def sparse_cdf_match_old(hist_file, yclim2, qcol, data, month, year):
+
+    hist_data = pd.read_csv(hist_file, index_col='Date', parse_dates=True)
+    # remove dates beyond last year
+    hist_data.drop(hist_data[hist_data.index>datetime(yclim2, 12, 31)].index, inplace=True)
+    # remove dates within the year being corrected
+    hist_data.drop(hist_data[(hist_data.index>=datetime(year, 1, 1))&(hist_data.index<=datetime(year, 12, 31))].index, inplace=True)
+
+    # extract the target month
+    if month!=0:
+        hist_month = hist_data[pd.to_datetime(hist_data.index).month == month]
+    else: # month 0 is reserved for A-J total
+        hist_amjj  = hist_data[(pd.to_datetime(hist_data.index).month>=4)&(pd.to_datetime(hist_data.index).month<=7)]
+        hist_month = hist_amjj.resample('1Y').sum()
+
+    return match_old(hist_month, qcol, data)
+
+def sparse_cdf_match_range_old(hist_file, fnf_file, yclim2, data, month1, month2, year):
+
+    hist_data = pd.read_csv(hist_file, index_col='Date', parse_dates=True)
+    # remove dates beyond last year
+    hist_data.drop(hist_data[hist_data.index>datetime(yclim2, 12, 31)].index, inplace=True)
+    # remove dates within the year being corrected
+    hist_data.drop(hist_data[(hist_data.index>=datetime(year, 1, 1))&(hist_data.index<=datetime(year, 12, 31))].index, inplace=True)
+
+    # extract the target month range
+    hist_range  = hist_data[(pd.to_datetime(hist_data.index).month>=month1)&(pd.to_datetime(hist_data.index).month<=month2)]
+    hist_month = hist_range.resample('1Y').sum()
+
+    [matched, avg] = match_old(hist_month, 'Qlstm', data)
+
+    # check FNF data
+    if month1==month2:
+        fnf_data = pd.read_csv(fnf_file, index_col='Date', parse_dates=True)
+        if fnf_data.index.isin([datetime(year, month1, 1)]).any():
+            fnf = fnf_data.loc[datetime(year, month1, 1)]['Flow']
+            if not np.isnan(fnf):
+                matched = np.full(len(data), fnf)
+
+    return [matched, avg]
+
+## the original sorting, pairing and per-value loop
+def match_old(hist_month, qcol, data):
+
+    # sort and pair them
+    hist_pairs = pd.DataFrame({'FNF': hist_month['FNF'].sort_values().to_numpy(), qcol: hist_month[qcol].sort_values().to_numpy()})
+
+    # log ratios
+    hist_pairs.loc[hist_pairs['FNF']<=0, ['FNF']] = 0.0001
+    hist_pairs.loc[hist_pairs[qcol]<=0, [qcol]] = 0.0001
+    hist_pairs['logratio'] = np.log(hist_pairs['FNF']/hist_pairs[qcol])
+
+    matched = np.zeros(len(data))
+    for i,v in enumerate(data):
+        # less than min or greater than max
+        if v<=hist_pairs[qcol][0]:
+            lr = hist_pairs['logratio'][0]
+        elif v>=hist_pairs[qcol].iloc[-1]:
+            lr = hist_pairs['logratio'].iloc[-1]
+        else: # in the middle
+            j = (hist_pairs[qcol]<v).sum()-1
+            lr1 = hist_pairs['logratio'][j]
+            lr2 = hist_pairs['logratio'][j+1]
+            qs1 = hist_pairs[qcol][j]
+            qs2 = hist_pairs[qcol][j+1]
+            lr  = lr1 + (lr2-lr1) * (v-qs1)/(qs2-qs1)
+        matched[i] = v*np.exp(lr)
+
+    avg = hist_month['FNF'].mean()
+    return [matched, avg]
+
+## canned monthly record of a site (FNF, Qsim, Qlstm) with zero flows, ties and months beyond the climatology,
+## and a monthly FNF record with a missing value, used when no real files are given
+def canned_site(dout, site, y1, y2):
+
+    rng = np.random.default_rng(0)
+    dates = pd.date_range(datetime(y1, 1, 1), datetime(y2+2, 12, 1), freq='MS')
+    seas  = 1+np.sin((dates.month.to_numpy()-1)/12*2*np.pi)
+    df = pd.DataFrame({'FNF':   np.round(rng.gamma(1.2, 80.0, dates.size)*seas, 0),
+                       'Qsim':  np.round(rng.gamma(1.0, 90.0, dates.size)*seas, 0),
+                       'Qlstm': np.round(rng.gamma(1.5, 70.0, dates.size)*seas, 1)}, index=pd.DatetimeIndex(dates, name='Date'))
+    df.iloc[::17, 0] = 0
+    df.iloc[::23, 1] = 0
+    df.iloc[::29, 2] = 0
+    df.to_csv(f'{dout}/{site}_monthly.csv', date_format='%Y-%m-%d')
+
+    dfo = df[['FNF']].rename(columns={'FNF': 'Flow'}).iloc[-30:]
+    dfo.iloc[::7, 0] = np.nan
+    dfo.to_csv(f'{dout}/FNF_monthly_{site}.csv', date_format='%Y-%m-%d')
+
+    return f'{dout}/{site}_monthly.csv', f'{dout}/FNF_monthly_{site}.csv'
+
+## regression check of sparse_cdf_match / sparse_cdf_match_lstm / sparse_cdf_match_range against the original
+## functions on a {site}_monthly.csv (canned unless given), all months, month 0 (A-J), month ranges, years inside
+## and outside the climatology; raises AssertionError on any difference
+def check(hist_file=None, fnf_file=None, yclim1=1990, yclim2=2019):
+
+    import tempfile
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/wrf_hydro')
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/lstm')
+    import cdf_match, cdf_match_lstm, cdf_match_range
+
+    yclim1 = int(yclim1)
+    yclim2 = int(yclim2)
+    site   = 'CHECK'
+    tmpdir = tempfile.mkdtemp()
+    if hist_file is None:
+        hist_file, fnf_file = canned_site(tmpdir, site, yclim1, yclim2)
+    # the files at the locations the functions take from config
+    dsim  = f'{tmpdir}/wrf_hydro/check/retro/output/basins/{yclim1}-{yclim2}/combined'
+    dlstm = f'{tmpdir}/wrf_hydro/check/lstm/retro/{yclim1}-{yclim2}'
+    dfnf  = f'{tmpdir}/obs/cdec/fnf'
+    for d,f,fsrc in [(dsim, f'{site}_monthly.csv', hist_file), (dlstm, f'{site}_monthly.csv', hist_file), (dfnf, f'FNF_monthly_{site}.csv', fnf_file)]:
+        os.makedirs(d, exist_ok=True)
+        os.symlink(os.path.abspath(fsrc), f'{d}/{f}')
+    cfg = {'base_dir': tmpdir, 'wrf_hydro': {'check': {'climrange': [yclim1, yclim2]}}}
+    for m in [cdf_match, cdf_match_lstm, cdf_match_range]:
+        m.config = cfg
+
+    hist = pd.read_csv(hist_file, index_col='Date', parse_dates=True)
+    fnfs = pd.read_csv(fnf_file, index_col='Date', parse_dates=True)
+    years = sorted(set([yclim1, (yclim1+yclim2)//2, yclim2, yclim2+1, fnfs.index[-1].year]))
+    data  = np.concatenate([[0.0, 0.0001], np.linspace(0, hist[['Qsim', 'Qlstm']].max().max()*1.5, 41),
+                            hist['Qsim'].to_numpy()[:12], hist['Qlstm'].to_numpy()[:12]])
+    data3 = np.concatenate([data, data*3])
+
+    nbad = 0
+    ncase = 0
+    def compare(name, a, b):
+        nonlocal nbad, ncase
+        ncase += 1
+        if not (np.allclose(a[0], b[0], rtol=1e-10, atol=1e-12) and np.allclose(a[1], b[1], rtol=1e-10, atol=1e-12, equal_nan=True)):
+            nbad += 1
+            print(f'{name}: max abs diff {np.nanmax(np.abs(np.asarray(a[0])-np.asarray(b[0]))):.4g}, avg {a[1]} vs {b[1]}')
+
+    t0 = time.time()
+    for year in years:
+        for month in range(13):
+            d = data3 if month==0 else data
+            compare(f'sim {month:02d}/{year}', sparse_cdf_match_old(f'{dsim}/{site}_monthly.csv', yclim2, 'Qsim', d, month, year),
+                    cdf_match.sparse_cdf_match('check', d, site, month, year))
+            compare(f'lstm {month:02d}/{year}', sparse_cdf_match_old(f'{dlstm}/{site}_monthly.csv', yclim2, 'Qlstm', d, month, year),
+                    cdf_match_lstm.sparse_cdf_match_lstm('check', d, site, month, year))
+            # one value at a time as the original callers do
+            compare(f'lstm scalar {month:02d}/{year}', sparse_cdf_match_old(f'{dlstm}/{site}_monthly.csv', yclim2, 'Qlstm', d[-5:], month, year),
+                    [np.array([cdf_match_lstm.sparse_cdf_match_lstm('check', v, site, month, year)[0] for v in d[-5:]]),
+                     cdf_match_lstm.sparse_cdf_match_lstm('check', d[-1], site, month, year)[1]])
+        for month1, month2 in [(4, 7), (1, 3), (10, 12), (2, 9)]+[(m, m) for m in range(1, 13)]:
+            d = data3 if month1!=month2 else data
+            compare(f'range {month1:02d}-{month2:02d}/{year}', sparse_cdf_match_range_old(f'{dlstm}/{site}_monthly.csv', f'{dfnf}/FNF_monthly_{site}.csv', yclim2, d, month1, month2, year),
+                    cdf_match_range.sparse_cdf_match_range('check', d, site, month1, month2, year))
+    print(f'{ncase} cases over years {years} checked in {time.time()-t0:.1f}s, {nbad} differ')
+
+    assert nbad==0, f'vectorized CDF matching differs from the original functions in {nbad} of {ncase} cases'
+    return 0
+
+if __name__ == '__main__':
+    if len(sys.argv)>1 and sys.argv[1]=='check':
+        try:
+            check(*sys.argv[2:6])
+        except AssertionError as e:
+            print(e)
+            sys.exit(1)
+    else:
+        print(__doc__)
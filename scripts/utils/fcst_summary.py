@@ -0,0 +1,60 @@
+''' Consolidated forecast summary of all B-120/FNF stations of one forecast update
+
+Collects the exceedance levels, % of average, averages and April-July totals of the per-station
+forecast CSVs in a directory into one long table (with station coordinates), so that the dashboard
+forecast table and map are built from a single file instead of one request per station.
+
+Usage:
+    python fcst_summary.py [forecast csv dir] [fcst_start] [fcst_end] [domain]
+    otherwise imported by other scripts
+'''
+
+__author__ = 'Ming Pan'
+__email__  = 'm3pan@ucsd.edu'
+__status__ = 'Development'
+
+import sys, os, json
+from glob import glob
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from utilities import config
+
+cols = ['Exc50', 'Pav50', 'Exc90', 'Pav90', 'Exc10', 'Pav10', 'Avg']
+
+## station ID -> [lon, lat] from the points geojson used by the dashboard
+def station_coords(domain):
+
+    fgeo = f'{config["base_dir"]}/web/dash/{domain}/assets/fnf_points_proj_tooltip_24.geojson'
+    if not os.path.isfile(fgeo):
+        return {}
+    with open(fgeo, 'r') as f:
+        points = json.load(f)
+    return {p['properties']['Station_ID']: p['geometry']['coordinates'] for p in points['features']}
+
+## write summary_[fcst_start]-[fcst_end].csv next to the per-station [id]_[fcst_start]-[fcst_end].csv files
+def write_summary(dout, t1, t2, coords={}):
+
+    period = f'{t1:%Y%m%d}-{t2:%Y%m%d}'
+    fnout  = f'{dout}/summary_{period}.csv'
+    dfs = []
+    for fcsv in sorted(glob(f'{dout}/*_{period}.csv')):
+        staid = os.path.basename(fcsv).split('_')[0]
+        if staid=='summary':
+            continue
+        df = pd.read_csv(fcsv, usecols=['Date']+cols, dtype={'Date': str})
+        df.insert(0, 'StationID', staid)
+        df['lon'], df['lat'] = coords.get(staid, [np.nan, np.nan])
+        dfs.append(df)
+    if len(dfs)==0:
+        print(f'No station forecasts in {dout}.')
+        return 1
+
+    pd.concat(dfs, ignore_index=True).to_csv(fnout, float_format='%.3f', index=False)
+    print(f'{len(dfs)} stations summarized in {fnout}')
+
+    return 0
+
+if __name__ == '__main__':
+    write_summary(sys.argv[1], datetime.strptime(sys.argv[2], '%Y%m%d'), datetime.strptime(sys.argv[3], '%Y%m%d'),
+                  station_coords(sys.argv[4]) if len(sys.argv)>4 else {})
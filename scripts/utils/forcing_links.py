@@ -0,0 +1,108 @@
+''' Forcing links of ESP ensemble members and their manifest
+
+Each member's daily forcing [member]/[yyyy]/[yyyymmdd].LDASIN_DOMAIN1 is a symlink to a retro (climatology
+year), West-WRF forecast or NRT monitor file. The links are created in-process with os.symlink, and
+every link is recorded in [forcing dir]/manifest.csv (member, date, kind, link target, source date), so
+that later steps read the year shift from the manifest instead of tracing the links.
+
+Usage:
+    imported by other scripts only
+'''
+
+__author__ = 'Ming Pan'
+__email__  = 'm3pan@ucsd.edu'
+__status__ = 'Development'
+
+import os, csv
+import netCDF4 as nc
+from datetime import datetime, timedelta
+from dateutil.relativedelta import relativedelta
+
+fields = ['member', 'date', 'kind', 'source', 'srcdate']
+
+## link of a member's daily forcing, relative to the forcing directory
+def link_name(ens, t):
+
+    return f'{ens:02d}/{t:%Y/%Y%m%d}.LDASIN_DOMAIN1'
+
+## links of all members to the retro forcing of the climatology years, skipping the year of t1
+def clim_links(t1, t2, yclim1, yclim2):
+
+    rows = []
+    ens = 1
+    for yclim in range(yclim1, yclim2+1):
+        if yclim==t1.year:
+            continue
+        if t1.year==t2.year:
+            tclim1 = datetime(yclim, 1, 1)
+            tclim2 = datetime(yclim, 12, 31)
+        else:
+            tclim1 = datetime(yclim, 8, 1)
+            tclim2 = datetime(yclim+1, 6, 1)
+
+        tclim = tclim1
+        while tclim<=tclim2:
+            tforc = tclim + relativedelta(years=t1.year-yclim)
+            fclim = f'../../../retro/{tclim:%Y/%Y%m%d}.LDASIN_DOMAIN1'
+            # handle extra 2/29 - skip it
+            if not (tclim.year%4==0 and tforc.year%4!=0 and tclim.month==2 and tclim.day==29):
+                rows.append((ens, tforc, 'retro', fclim, tclim))
+            # handle missing 2/29 - set it to 2/28
+            if tclim.year%4!=0 and tforc.year%4==0 and tclim.month==2 and tclim.day==28:
+                rows.append((ens, datetime(tforc.year, 2, 29), 'retro', fclim, tclim))
+            tclim += timedelta(days=1)
+        ens += 1
+
+    return rows
+
+## whether a forecast file has all 24 hourly steps, each file opened once
+def complete_day(fname, checked):
+
+    if fname not in checked:
+        with nc.Dataset(fname, 'r') as f:
+            checked[fname] = f['time'].size==24
+    return checked[fname]
+
+## manifest as {(member, yyyymmdd): (kind, source, source date)}
+def read_manifest(forcedir):
+
+    man = {}
+    fman = f'{forcedir}/manifest.csv'
+    if os.path.isfile(fman):
+        with open(fman, newline='') as f:
+            for r in csv.DictReader(f):
+                man[(int(r['member']), r['date'])] = (r['kind'], r['source'], datetime.strptime(r['srcdate'], '%Y%m%d'))
+    return man
+
+## create (or replace) the links of rows [(member, date, kind, link target, source date)] and record them
+def apply(forcedir, rows):
+
+    dirs = set([os.path.dirname(f'{forcedir}/{link_name(r[0], r[1])}') for r in rows])
+    for d in dirs:
+        os.makedirs(d, exist_ok=True)
+    for ens, t, kind, source, tsrc in rows:
+        flink = f'{forcedir}/{link_name(ens, t)}'
+        if os.path.lexists(flink):
+            os.remove(flink)
+        os.symlink(source, flink)
+
+    man = read_manifest(forcedir)
+    for ens, t, kind, source, tsrc in rows:
+        man[(ens, f'{t:%Y%m%d}')] = (kind, source, tsrc)
+    fman = f'{forcedir}/manifest.csv'
+    with open(fman+'.tmp', 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(fields)
+        for (ens, date), (kind, source, tsrc) in sorted(man.items()):
+            w.writerow([ens, date, kind, source, f'{tsrc:%Y%m%d}'])
+    os.replace(fman+'.tmp', fman)
+    print(f'{len(rows)} forcing links created in {forcedir}')
+
+## kind ('retro' or not) and source date of a member's forcing day, traced from the link if not in the manifest
+def source(man, forcedir, ens, t):
+
+    if (ens, f'{t:%Y%m%d}') in man:
+        kind, _, tsrc = man[(ens, f'{t:%Y%m%d}')]
+        return kind, tsrc
+    target = os.readlink(f'{forcedir}/{link_name(ens, t)}')
+    return ('retro' if 'retro' in target else 'link'), datetime.strptime(os.path.basename(target).split('.')[0], '%Y%m%d')
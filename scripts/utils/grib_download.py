@@ -0,0 +1,267 @@
+''' Parallel and resumable download of GRIB files and GRIB record subsets
+
+Selected records of a remote GRIB file are located from its .idx inventory (the get_inv.pl/get_grib.pl
+approach), adjacent byte ranges are merged so each file takes a few HTTP range requests, and files are
+downloaded concurrently by a bounded pool of workers. Completed files are recorded in a JSON manifest,
+so that an interrupted cycle resumes from where it stopped; callers drop the entries (forget) once the
+files are converted and deleted, so a manifest only lists the downloads still pending processing.
+
+Usage:
+    imported by other scripts, or to check the downloader against a local HTTP server:
+    python grib_download.py check [# of workers]
+'''
+
+__author__ = 'Ming Pan'
+__email__  = 'm3pan@ucsd.edu'
+__status__ = 'Development'
+
+import sys, os, re, json, time, threading
+import requests
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+nworkers_default = 8
+chunk_size = 1<<20
+auth_host  = 'urs.earthdata.nasa.gov'   # login host the NASA GES DISC data redirect to
+
+## records of a .idx inventory: [(line, start byte, end byte or None for the last record)]
+def parse_idx(text):
+
+    lines = [l for l in text.splitlines() if l.strip()!='']
+    starts = [int(l.split(':')[1]) for l in lines]
+    return [(l, s, starts[k+1]-1 if k+1<len(lines) else None) for k,(l,s) in enumerate(zip(lines, starts))]
+
+## records matching any of the patterns (regular expressions, as with grep -e)
+def select(records, patterns):
+
+    regs = [re.compile(p) for p in patterns]
+    return [r for r in records if any([reg.search(r[0]) for reg in regs])]
+
+## merge adjacent/overlapping byte ranges [(start, end or None)]
+def merge_ranges(ranges):
+
+    merged = []
+    for s, e in sorted(ranges):
+        if len(merged)>0 and merged[-1][1] is not None and s<=merged[-1][1]+1:
+            e0 = merged[-1][1]
+            merged[-1] = (merged[-1][0], None if e is None else max(e, e0))
+        elif len(merged)>0 and merged[-1][1] is None:
+            continue
+        else:
+            merged.append((s, e))
+    return merged
+
+## completed downloads, {file: {'url': url, 'bytes': size}}, shared by the workers
+class Manifest:
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.lock  = threading.Lock()
+        self.files = {}
+        if fname is not None and os.path.isfile(fname):
+            with open(fname, 'r') as f:
+                self.files = json.load(f)
+
+    def done(self, fout):
+        return fout in self.files and os.path.isfile(fout) and os.path.getsize(fout)==self.files[fout]['bytes']
+
+    def add(self, fout, url, nbytes):
+        with self.lock:
+            self.files[fout] = {'url': url, 'bytes': nbytes}
+            self.write()
+
+    def drop(self, fouts):
+        with self.lock:
+            for fout in fouts:
+                self.files.pop(fout, None)
+            self.write()
+
+    def write(self):
+        if self.fname is not None:
+            with open(self.fname+'.tmp', 'w') as f:
+                json.dump(self.files, f, indent=1)
+            os.replace(self.fname+'.tmp', self.fname)
+
+## session that keeps the credentials through the Earthdata login redirects, as wget --user does
+class AuthSession(requests.Session):
+
+    def rebuild_auth(self, prepared_request, response):
+        if 'Authorization' in prepared_request.headers:
+            host1 = urlparse(response.request.url).hostname
+            host2 = urlparse(prepared_request.url).hostname
+            if host1!=host2 and auth_host not in [host1, host2]:
+                del prepared_request.headers['Authorization']
+
+# one requests session per worker thread
+_local = threading.local()
+
+def _session(auth):
+    if getattr(_local, 'session', None) is None:
+        _local.session = AuthSession()
+    _local.session.auth = auth
+    return _local.session
+
+## fetch one file (all records, or the records matching patterns) to fout via fout.part
+def fetch(url, fout, patterns=None, nrec=None, auth=None, timeout=120):
+
+    sess = _session(auth)
+    os.makedirs(os.path.dirname(os.path.abspath(fout)), exist_ok=True)
+    nbytes = 0
+    with open(fout+'.part', 'wb') as f:
+        if patterns is None:
+            with sess.get(url, stream=True, timeout=timeout) as r:
+                r.raise_for_status()
+                for chunk in r.iter_content(chunk_size):
+                    f.write(chunk)
+                    nbytes += len(chunk)
+        else:
+            r = sess.get(url+'.idx', timeout=timeout)
+            r.raise_for_status()
+            recs = select(parse_idx(r.text), patterns)
+            if len(recs)==0 or (nrec is not None and len(recs)!=nrec):
+                raise ValueError(f'{len(recs)} records of {url} match, {nrec} expected')
+            for s, e in merge_ranges([(rec[1], rec[2]) for rec in recs]):
+                r = sess.get(url, headers={'Range': f'bytes={s}-{"" if e is None else e}'}, timeout=timeout)
+                r.raise_for_status()
+                data = r.content if r.status_code==206 else r.content[s:None if e is None else e+1]
+                if e is not None and len(data)!=e-s+1:
+                    raise ValueError(f'{url} bytes {s}-{e}: {len(data)} bytes received')
+                f.write(data)
+                nbytes += len(data)
+    os.replace(fout+'.part', fout)
+    return nbytes
+
+## download tasks [(url, fout, patterns or None)] concurrently, returns {fout: True/False}
+def download(tasks, manifest=None, nworkers=nworkers_default, nrec=None, auth=None, retries=3, wait=10):
+
+    man = Manifest(manifest)
+
+    def work(task):
+        url, fout, patterns = task
+        if man.done(fout):
+            print(f'{fout} is already retrieved.')
+            return True
+        for k in range(retries):
+            try:
+                nbytes = fetch(url, fout, patterns, nrec, auth)
+                man.add(fout, url, nbytes)
+                print(f'{fout} is retrieved ({nbytes} bytes).')
+                return True
+            except (requests.RequestException, ValueError) as e:
+                print(f'{fout} try {k+1}/{retries} failed: {e}')
+                if os.path.isfile(fout+'.part'):
+                    os.remove(fout+'.part')
+                if k+1<retries:
+                    time.sleep(wait)
+        return False
+
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, min(nworkers, len(tasks)))) as pool:
+        ok = list(pool.map(work, tasks))
+    print(f'{sum(ok)}/{len(tasks)} files retrieved by {nworkers} workers in {time.time()-t0:.1f} seconds')
+
+    return {task[1]: res for task, res in zip(tasks, ok)}
+
+## drop processed files from a manifest
+def forget(manifest, fouts):
+
+    if manifest is not None and os.path.isfile(manifest):
+        Manifest(manifest).drop(fouts)
+
+## check the downloader against a local HTTP server with canned GRIB/idx files
+def check(nworkers=4):
+
+    import tempfile, shutil
+    from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+    class RangeHandler(SimpleHTTPRequestHandler):
+        nget = 0
+        def log_message(self, *args):
+            pass
+        def do_GET(self):
+            type(self).nget += 1
+            fname = self.translate_path(self.path)
+            rng = self.headers.get('Range')
+            if rng is None or not os.path.isfile(fname):
+                return SimpleHTTPRequestHandler.do_GET(self)
+            with open(fname, 'rb') as f:
+                data = f.read()
+            s, e = rng.split('=')[1].split('-')
+            s = int(s); e = len(data)-1 if e=='' else min(int(e), len(data)-1)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {s}-{e}/{len(data)}')
+            self.send_header('Content-Length', str(e-s+1))
+            self.end_headers()
+            self.wfile.write(data[s:e+1])
+
+    # canned files: 'GRIB' records of different sizes and their inventories
+    srvdir = tempfile.mkdtemp(); outdir = tempfile.mkdtemp()
+    fields = ['PRMSL:mean sea level', 'PRES:surface', 'TMP:surface', 'TMP:2 m above ground', 'SPFH:2 m above ground',
+              'UGRD:10 m above ground', 'VGRD:10 m above ground', 'PRATE:surface:0-1 hour ave fcst', 'DSWRF:surface', 'DLWRF:surface']
+    patterns = ['DLWRF', 'DSWRF', 'PRES:surface', ':TMP:2 m above ground', 'UGRD:10 m above ground',
+                'VGRD:10 m above ground', 'SPFH:2 m above ground', 'PRATE:surface:.-']
+    nfiles = 12
+    expected = {}
+    for i in range(nfiles):
+        recs = [b'GRIB' + bytes([(i+k)%251])*(1000*(k+1)+i) + b'7777' for k in range(len(fields))]
+        idx = []; off = 0
+        for k, fld in enumerate(fields):
+            idx.append(f'{k+1}:{off}:d=2025010100:{fld}:{i} hour fcst:')
+            off += len(recs[k])
+        with open(f'{srvdir}/f{i:03d}.grb2', 'wb') as f:
+            f.write(b''.join(recs))
+        with open(f'{srvdir}/f{i:03d}.grb2.idx', 'w') as f:
+            f.write('\n'.join(idx)+'\n')
+        expected[i] = b''.join([rec for rec, fld in zip(recs, fields) if fld.split(':')[0] not in ['PRMSL', 'TMP'] or fld.startswith('TMP:2')])
+
+    handler = lambda *args, **kwargs: RangeHandler(*args, directory=srvdir, **kwargs)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    try:
+        recs = parse_idx(open(f'{srvdir}/f000.grb2.idx').read())
+        rngs = merge_ranges([(r[1], r[2]) for r in select(recs, patterns)])
+        print(f'{len(select(recs, patterns))} records selected in {len(rngs)} ranges: {rngs}')
+        assert len(rngs)==2 and rngs[-1][1] is None
+
+        # record subsets, all files at once
+        tasks = [(f'{url}/f{i:03d}.grb2', f'{outdir}/sub/f{i:03d}.grb2', patterns) for i in range(nfiles)]
+        res = download(tasks, f'{outdir}/sub.json', nworkers=nworkers, nrec=8)
+        assert all(res.values())
+        for i in range(nfiles):
+            assert open(f'{outdir}/sub/f{i:03d}.grb2', 'rb').read()==expected[i], f'f{i:03d} subset differs'
+        print(f'{nfiles} subsets match the selected records, {RangeHandler.nget} requests.')
+
+        # resume: only the file missing from the manifest is fetched again
+        man = json.load(open(f'{outdir}/sub.json'))
+        man.pop(f'{outdir}/sub/f003.grb2')
+        json.dump(man, open(f'{outdir}/sub.json', 'w'))
+        RangeHandler.nget = 0
+        res = download(tasks, f'{outdir}/sub.json', nworkers=nworkers, nrec=8)
+        assert all(res.values()) and RangeHandler.nget==3, f'{RangeHandler.nget} requests on resume'
+        print('Resume fetches only the incomplete file.')
+
+        # whole files, and a file not (yet) on the server
+        tasks = [(f'{url}/f{i:03d}.grb2', f'{outdir}/all/f{i:03d}.grb2', None) for i in range(nfiles+1)]
+        res = download(tasks, f'{outdir}/all.json', nworkers=nworkers, retries=1)
+        assert all([res[f'{outdir}/all/f{i:03d}.grb2'] for i in range(nfiles)]) and not res[f'{outdir}/all/f{nfiles:03d}.grb2']
+        for i in range(nfiles):
+            assert open(f'{outdir}/all/f{i:03d}.grb2', 'rb').read()==open(f'{srvdir}/f{i:03d}.grb2', 'rb').read()
+        assert not os.path.exists(f'{outdir}/all/f{nfiles:03d}.grb2.part')
+
+        # incomplete inventory (fewer records than expected) is a failure to be retried later
+        res = download([(f'{url}/f000.grb2', f'{outdir}/bad.grb2', patterns[:3])], nrec=8, retries=1)
+        assert not res[f'{outdir}/bad.grb2']
+        print('All checks passed.')
+    finally:
+        server.shutdown()
+        shutil.rmtree(srvdir); shutil.rmtree(outdir)
+
+    return 0
+
+if __name__ == '__main__':
+    if len(sys.argv)>1 and sys.argv[1]=='check':
+        check(*[int(a) for a in sys.argv[2:3]])
+    else:
+        print(__doc__)
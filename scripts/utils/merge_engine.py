@@ -0,0 +1,290 @@
+''' In-process merge/aggregate engine for per-day WRF-Hydro/NWM output files
+
+Streams the per-day files of a month once and writes the merged, daily-mean and monthly-mean outputs
+in the same pass with the final compression settings, replacing cdo mergetime/daymean/monmean + ncks chains.
+Percentile ranks are computed on the in-memory arrays before writing. A manifest next to the merged file
+records which input files went in (mtime, size, position) so that NRT cycles can update only the changed days.
+
+Usage:
+    imported by other scripts only
+'''
+
+__author__ = 'Ming Pan'
+__email__  = 'm3pan@ucsd.edu'
+__status__ = 'Development'
+
+import os, json
+import numpy as np
+import netCDF4 as nc
+from pctl_rank import Ranker, smtot, yday_of
+
+complevel = 5
+
+## create an output file with the layout of a source file, copying everything without a time dimension
+def create_like(src, fname):
+
+    dst = nc.Dataset(fname, 'w', format='NETCDF4')
+    dst.setncatts(src.__dict__)
+    for name, dimension in src.dimensions.items():
+        dst.createDimension(name, (len(dimension) if not (dimension.isunlimited() or name=='time') else None))
+    for name, variable in src.variables.items():
+        fill = variable.__dict__.get('_FillValue', None)
+        x = dst.createVariable(name, variable.datatype, variable.dimensions, zlib=True, complevel=complevel,
+                               shuffle=True, fill_value=fill)
+        dst[name].setncatts({k: v for k, v in variable.__dict__.items() if k!='_FillValue'})
+        if 'time' not in variable.dimensions:
+            dst[name][:] = src[name][:]
+
+    return dst
+
+## create the percentile rank variables, same layout as the add_pctl_rank_* scripts
+def add_rank_vars(dst, vs):
+
+    for name in vs:
+        dims = ('time', 'y', 'x') if name=='SOIL_M' else dst[name].dimensions
+        x = dst.createVariable(name+'_r', 'f4', dims, zlib=True, complevel=complevel, shuffle=True)
+        dst[name+'_r'].long_name = f'Percentile rank of {dst[name].long_name}'
+        dst[name+'_r'].units = 'percentile'
+
+## rank one time step of the rank variables and write them
+def write_ranks(dst, t, fields, rankers, idx):
+
+    for v, ranker in rankers.items():
+        data = smtot(fields[v]) if v=='SOIL_M' else fields[v]
+        dst[v+'_r'][t] = ranker(data, idx)
+
+## mean of a sum, rounded for plain integer variables; packed variables (scale_factor) get the float mean
+## and are packed by netCDF4 on writing
+def to_mean(acc, n, rnd):
+
+    m = acc/n
+    return np.ma.round(m) if rnd else m
+
+## whether the means of a variable have to be rounded before writing
+def is_plain_int(var):
+
+    return np.issubdtype(var.dtype, np.integer) and 'scale_factor' not in var.ncattrs()
+
+## signature of an input file to detect changes between cycles
+def file_sig(fn):
+
+    st = os.stat(fn)
+    return [st.st_mtime, st.st_size]
+
+## manifest of the input files merged into a month file
+def read_manifest(fmerge):
+
+    fman = f'{fmerge}.manifest'
+    if not os.path.isfile(fman):
+        return None
+    with open(fman, 'r') as f:
+        return json.load(f)
+
+def write_manifest(fmerge, manifest):
+
+    with open(f'{fmerge}.manifest', 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+## read the time stamps (in the given units) and the time-varying variables of one input file
+def read_day(fn, units, tvars):
+
+    src = nc.Dataset(fn, 'r')
+    times = nc.date2num(nc.num2date(src['time'][:], src['time'].units), units)
+    xs = {v: src[v][:] for v in tvars}
+    src.close()
+
+    return times, xs
+
+## numeric variables with a leading time dimension
+def time_vars(src):
+
+    return [name for name, var in src.variables.items()
+            if var.dimensions[:1]==('time',) and name!='time' and np.issubdtype(var.dtype, np.number)]
+
+## merge and aggregate one month
+def merge_month(fins, fmerge, fday=None, fmon=None, rank_day=None, rank_mon=None):
+
+    '''fins: per-day input files in time order; fmerge: merged output at the input time step;
+       fday: daily means, None when the inputs are daily already (the merged file is then the daily file);
+       fmon: monthly mean of the daily values, None to skip;
+       rank_day/rank_mon: (fpctl, variables) of the daily/monthly climatology to add ranks, or None,
+       the climatology files are closed when done'''
+
+    if len(fins)==0:
+        print(f'No input files for {fmerge}.')
+        for r in [rank_day, rank_mon]:
+            if r is not None:
+                r[0].close()
+        return 1
+
+    src0  = nc.Dataset(fins[0], 'r')
+    units = src0['time'].units
+    tvars = time_vars(src0)
+    rounds = {name: is_plain_int(src0[name]) for name in tvars}
+
+    dmerge = create_like(src0, fmerge)
+    dday   = create_like(src0, fday) if fday else dmerge
+    dmon   = create_like(src0, fmon) if fmon else None
+    src0.close()
+
+    rday = {}
+    if rank_day is not None:
+        add_rank_vars(dday, rank_day[1])
+        rday = {v: Ranker(rank_day[0], v) for v in rank_day[1]}
+    rmon = {}
+    if dmon is not None and rank_mon is not None:
+        add_rank_vars(dmon, rank_mon[1])
+        rmon = {v: Ranker(rank_mon[0], v) for v in rank_mon[1]}
+
+    it   = 0   # position in the merged file
+    iday = 0   # position in the daily file
+    msum = {}
+    mtimes = []
+    manifest = {'files': {}, 'ndays': 0}
+    for fn in fins:
+        times, xs = read_day(fn, units, tvars)
+        n = times.size
+        manifest['files'][fn] = {'sig': file_sig(fn), 'pos': it, 'n': n}
+        dmerge['time'][it:it+n] = times
+        for v in tvars:
+            dmerge[v][it:it+n] = xs[v]
+
+        if fday:
+            fields = {v: xs[v].astype(np.float64).mean(axis=0) for v in tvars}
+            dday['time'][iday] = times[n//2]
+            for v in tvars:
+                dday[v][iday] = to_mean(fields[v], 1, rounds[v])
+                msum[v] = msum[v]+fields[v] if v in msum else fields[v]
+            write_ranks(dday, iday, fields, rday, yday_of(nc.num2date(times[n//2], units)))
+            mtimes.append(times[n//2])
+            iday += 1
+        else:
+            for v in tvars:
+                xsum = xs[v].astype(np.float64).sum(axis=0)
+                msum[v] = msum[v]+xsum if v in msum else xsum
+            for k in range(n):
+                write_ranks(dday, it+k, {v: xs[v][k] for v in rday}, rday, yday_of(nc.num2date(times[k], units)))
+            mtimes.extend(times)
+            iday += n
+        it += n
+
+    if dmon is not None:
+        # monthly mean of the daily values, same as cdo monmean on the daily file
+        tmid = mtimes[len(mtimes)//2]
+        dmon['time'][0] = tmid
+        fields = {v: msum[v]/iday for v in tvars}
+        for v in tvars:
+            dmon[v][0] = to_mean(msum[v], iday, rounds[v])
+        write_ranks(dmon, 0, fields, rmon, nc.num2date(tmid, units).month-1)
+        dmon.close()
+
+    if fday:
+        dday.close()
+    dmerge.close()
+    for r in [rank_day, rank_mon]:
+        if r is not None:
+            r[0].close()
+
+    manifest['ndays'] = iday
+    write_manifest(fmerge, manifest)
+
+    return 0
+
+## incremental update of a month already merged by merge_month, only rewriting the time slices of
+## input files that are new or changed since the last call; falls back to merge_month otherwise
+def update_month(fins, fmerge, fday=None, fmon=None, rank_day=None, rank_mon=None):
+
+    '''same arguments as merge_month; the monthly mean is recomputed from the updated daily values'''
+
+    manifest = read_manifest(fmerge)
+    old = list(manifest['files'].keys()) if manifest is not None else []
+    outs = [f for f in [fmerge, fday, fmon] if f]
+    if manifest is None or not all(os.path.isfile(f) for f in outs) or fins[:len(old)]!=old:
+        print(f'No usable manifest for {fmerge}, merging the whole month.')
+        return merge_month(fins, fmerge, fday, fmon, rank_day, rank_mon)
+
+    todo = [i for i, fn in enumerate(fins) if fn not in manifest['files'] or manifest['files'][fn]['sig']!=file_sig(fn)]
+    if len(todo)==0:
+        print(f'{fmerge} is up to date.')
+        for r in [rank_day, rank_mon]:
+            if r is not None:
+                r[0].close()
+        return 0
+    print(f'Updating {len(todo)} of {len(fins)} days in {fmerge}.')
+
+    dmerge = nc.Dataset(fmerge, 'a')
+    dday   = nc.Dataset(fday, 'a') if fday else dmerge
+    dmon   = nc.Dataset(fmon, 'a') if fmon else None
+    units  = dmerge['time'].units
+    # variables of the inputs, the merged/daily files also hold the _r rank variables
+    with nc.Dataset(fins[todo[0]], 'r') as src:
+        tvars = time_vars(src)
+    rounds = {name: is_plain_int(dmerge[name]) for name in tvars}
+
+    rday = {v: Ranker(rank_day[0], v) for v in rank_day[1]} if rank_day is not None else {}
+    rmon = {v: Ranker(rank_mon[0], v) for v in rank_mon[1]} if rank_mon is not None and dmon is not None else {}
+
+    ndays = manifest['ndays']
+
+    it = dmerge['time'].size
+    for i in todo:
+        fn = fins[i]
+        times, xs = read_day(fn, units, tvars)
+        n = times.size
+        if fn in manifest['files']:
+            pos = manifest['files'][fn]['pos']
+            if manifest['files'][fn]['n']!=n:
+                print(f'{fn} changed length, merging the whole month.')
+                for d in set([dmerge, dday, dmon])-set([None]):
+                    d.close()
+                return merge_month(fins, fmerge, fday, fmon, rank_day, rank_mon)
+        else:
+            pos = it
+            it += n
+        manifest['files'][fn] = {'sig': file_sig(fn), 'pos': pos, 'n': n}
+
+        if fday:
+            fields = {v: xs[v].astype(np.float64).mean(axis=0) for v in tvars}
+            dday['time'][i] = times[n//2]
+            for v in tvars:
+                dday[v][i] = to_mean(fields[v], 1, rounds[v])
+            write_ranks(dday, i, fields, rday, yday_of(nc.num2date(times[n//2], units)))
+            if fn not in old:
+                ndays += 1
+        else:
+            if fn not in old:
+                ndays += n
+        dmerge['time'][pos:pos+n] = times
+        for v in tvars:
+            dmerge[v][pos:pos+n] = xs[v]
+        if not fday:
+            for k in range(n):
+                write_ranks(dday, pos+k, {v: xs[v][k] for v in rday}, rday, yday_of(nc.num2date(times[k], units)))
+
+    if dmon is not None:
+        # monthly mean recomputed from the daily values in the file, so no error accumulates over updates
+        msum = {}
+        for k in range(ndays):
+            for v in tvars:
+                x = dday[v][k].astype(np.float64)
+                msum[v] = msum[v]+x if v in msum else x
+        dtimes = dday['time'][:]
+        tmid = dtimes[len(dtimes)//2]
+        dmon['time'][0] = tmid
+        fields = {v: msum[v]/ndays for v in tvars}
+        for v in tvars:
+            dmon[v][0] = to_mean(msum[v], ndays, rounds[v])
+        write_ranks(dmon, 0, fields, rmon, nc.num2date(tmid, units).month-1)
+        dmon.close()
+
+    if fday:
+        dday.close()
+    dmerge.close()
+    for r in [rank_day, rank_mon]:
+        if r is not None:
+            r[0].close()
+
+    manifest['ndays'] = ndays
+    write_manifest(fmerge, manifest)
+
+    return 0
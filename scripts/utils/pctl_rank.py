@@ -0,0 +1,118 @@
+''' Vectorized percentile rank engine shared by the add_pctl_rank_* scripts
+
+Usage:
+    imported by other scripts most of the time
+    python pctl_rank.py bench [# of features] [# of days]   # synthetic timing vs. the old broadcast method
+'''
+
+__author__ = 'Ming Pan'
+__email__  = 'm3pan@ucsd.edu'
+__status__ = 'Development'
+
+import sys, time
+import numpy as np
+
+npctl = 100
+
+## sort the 100 percentile planes of one day-of-year, masked thresholds go to the end as +inf
+def prep_thresholds(pctl, presorted=False):
+
+    '''return sorted [npctl, ...] thresholds and the mask of cells without any valid threshold'''
+
+    if presorted:
+        thr = np.asarray(pctl, dtype=np.float32)
+    else:
+        thr = np.sort(np.ma.asarray(pctl).filled(np.inf).astype(np.float32), axis=0)
+    return thr, np.isinf(thr[0])
+
+## rank = number of thresholds strictly below the value, found by a batched binary search
+def calc_rank(data, thr, nomask=None):
+
+    '''equivalent to (data>thr).sum(axis=0) for sorted thr, in log2(npctl) gather/compare passes'''
+
+    data = np.ma.asarray(data)
+    x    = data.filled(np.nan).astype(np.float32).ravel()
+    tf   = thr.reshape(thr.shape[0], -1)
+    cols = np.arange(x.size)
+
+    lo = np.zeros(x.size, dtype=np.int32)
+    hi = np.full(x.size, tf.shape[0], dtype=np.int32)
+    while True:
+        act = lo<hi
+        if not act.any():
+            break
+        mid = (lo+hi)//2
+        go  = tf[np.minimum(mid, tf.shape[0]-1), cols] < x
+        lo  = np.where(act & go, mid+1, lo)
+        hi  = np.where(act & ~go, mid, hi)
+
+    rank = lo.astype(np.float32).reshape(data.shape)
+    mask = np.ma.getmaskarray(data) | np.isnan(x).reshape(data.shape)
+    if nomask is not None:
+        mask = mask | nomask
+    return np.ma.masked_array(rank, mask=mask)
+
+## day-of-year index used by the ydrunpctl files
+def yday_of(dtime):
+
+    return (dtime - dtime.replace(month=1, day=1)).days
+
+## rank against one variable of a climatology, thresholds indexed by day-of-year or month and kept for reuse
+class Ranker:
+
+    def __init__(self, fpctl, vname):
+
+        self.src   = fpctl[vname]
+        self.cache = {}
+
+    def __call__(self, data, idx):
+
+        if idx not in self.cache:
+            self.cache.clear()
+            self.cache[idx] = prep_thresholds(self.src[idx], getattr(self.src, 'sorted', False))
+        thr, nomask = self.cache[idx]
+        return calc_rank(data, thr, nomask)
+
+## rank a whole [time, ...] block, thresholds for each day-of-year are read and sorted only once
+def rank_block(var, ydays, fpctl, vname, transform=None, out=None):
+
+    '''var: [time, ...] array or netCDF variable read one step at a time; ydays: day-of-year index per step;
+       fpctl: ydrunpctl netCDF dataset or PctlStores (thresholds already sorted there);
+       out: [time, ...] netCDF variable each step is written to as it is ranked, so memory stays at one step,
+       otherwise the ranks of all steps are returned'''
+
+    ranks  = []
+    ranker = Ranker(fpctl, vname)
+    for t, yday in enumerate(ydays):
+        data = var[t] if transform is None else transform(var[t])
+        if out is None:
+            ranks.append(ranker(data, yday))
+        else:
+            out[t] = ranker(data, yday)
+
+    return None if out is not None else np.ma.stack(ranks)
+
+## weighted total soil moisture as used for SOIL_M ranks, soil layers on the second last axis
+def smtot(soilm):
+
+    return soilm[..., 0, :]*0.05+soilm[..., 1, :]*0.15+soilm[..., 2, :]*0.3+soilm[..., 3, :]*0.5
+
+## synthetic timing of the engine against the old 100-plane broadcast
+def bench(nf, nt):
+
+    rng  = np.random.default_rng(0)
+    pctl = np.sort(rng.gamma(0.5, 10, (npctl, nf)).astype(np.float32), axis=0)
+    data = rng.gamma(0.5, 10, (nt, nf)).astype(np.float32)
+
+    t0 = time.time()
+    old = np.stack([(data[t]>pctl).sum(axis=0).astype(float) for t in range(nt)])
+    t1 = time.time()
+    thr, nomask = prep_thresholds(pctl)
+    new = np.stack([calc_rank(data[t], thr, nomask) for t in range(nt)])
+    t2 = time.time()
+
+    print(f'{nf} features x {nt} days: broadcast {t1-t0:.2f}s, searchsorted {t2-t1:.2f}s, identical: {np.array_equal(old, new)}')
+
+if __name__ == '__main__':
+    if len(sys.argv)>1 and sys.argv[1]=='bench':
+        bench(int(sys.argv[2]) if len(sys.argv)>2 else 2776738, int(sys.argv[3]) if len(sys.argv)>3 else 31)
@@ -0,0 +1,176 @@
+''' Compact day-of-year percentile climatology store with memory-mapped access
+
+The 100 ydrunpctl thresholds are kept sorted in one flat binary file laid out as [doy][pctl][feature],
+behind a small JSON index header, so consumers only page in the day-of-year and feature range they touch.
+Thresholds are quantized to uint16 (u2) by default: q = round(log1p(x-qoffset)/qscale), with the per-variable
+qoffset and qscale (from the variable's value range, see vranges) in the header, 65535 for missing (+inf),
+decoded back to float32 on access. Values are clipped to the range, and the decoding error is at most
+(1+x-qoffset)*(exp(qscale/2)-1), e.g. 1.1e-4*(1+x) for streamflow (0-1e6 m3/s), 1.1e-5 for SOIL_M (0-1).
+Quantization keeps the order of the sorted thresholds, so a rank can only change for values within that
+error of a threshold. float32 (f4, exact, twice the size) and float16 (f2) stores are explicit opt-ins.
+
+Usage:
+    python pctl_store.py [ydrunpctl.00-99 file] [variable] [u2|f4|f2]   # writes [ydrunpctl.00-99 file].[variable].pcs
+    otherwise imported by other scripts
+'''
+
+__author__ = 'Ming Pan'
+__email__  = 'm3pan@ucsd.edu'
+__status__ = 'Development'
+
+import sys, os, json, struct
+import numpy as np
+
+magic = b'PCTLSTOR'
+align = 4096
+qmiss = 65535
+
+# value range (offset, max) of the quantized stores per variable, others get the default
+vranges = {'streamflow': (0.0, 1e6), 'SOIL_M': (0.0, 1.0), 'SNEQV': (0.0, 1e5)}
+vrange0 = (0.0, 1e7)
+
+## percentile climatology store
+class PctlStore:
+
+    '''accessor (read-only unless opened with mode='r+'), slices of float stores are views into the memory map,
+       those of quantized stores are decoded copies'''
+
+    def __init__(self, fname, mode='r'):
+
+        with open(fname, 'rb') as f:
+            if f.read(len(magic)) != magic:
+                raise ValueError(f'{fname} is not a percentile store')
+            nhead = struct.unpack('<I', f.read(4))[0]
+            self.header = json.loads(f.read(nhead).decode())
+
+        self.fname  = fname
+        self.var    = self.header['var']
+        self.shape  = tuple(self.header['shape'])   # spatial shape, e.g. [feature] or [y, x]
+        self.ndoy   = self.header['ndoy']
+        self.npctl  = self.header['npctl']
+        self.sorted = True
+        nfeat = int(np.prod(self.shape))
+        self.data = np.memmap(fname, dtype=self.header['dtype'], mode=mode, offset=self.header['offset'],
+                              shape=(self.ndoy, self.npctl, nfeat))
+
+    ## thresholds of one day-of-year, optionally for a flat feature range only
+    def thresholds(self, yday, i1=None, i2=None):
+
+        if i1 is None and i2 is None:
+            return self.decode(self.data[yday]).reshape((self.npctl,)+self.shape)
+        return self.decode(self.data[yday, :, i1:i2])
+
+    ## one percentile level for all days, [doy, feature]
+    def pctl(self, p, i1=None, i2=None):
+
+        return self.decode(self.data[:, p, i1:i2])
+
+    ## float32 thresholds (+inf for missing) to the store type
+    def encode(self, thr):
+
+        if self.header.get('enc')!='log1p':
+            thr = np.asarray(thr, dtype=np.float32)
+            return np.where(np.isinf(thr), thr, np.minimum(thr, np.finfo(self.data.dtype).max)).astype(self.data.dtype)
+        thr = np.asarray(thr, dtype=np.float64)
+        q = np.rint(np.log1p(np.clip(thr-self.header['qoffset'], 0, self.header['qmax']-self.header['qoffset']))/self.header['qscale'])
+        return np.where(np.isinf(thr), qmiss, np.minimum(q, qmiss-1)).astype(np.uint16)
+
+    ## stored values to float32 thresholds
+    def decode(self, raw):
+
+        if self.header.get('enc')!='log1p':
+            return raw
+        x = (np.expm1(raw*self.header['qscale'])+self.header['qoffset']).astype(np.float32)
+        x[raw==qmiss] = np.inf
+        return x
+
+    ## write sorted [npctl, n] thresholds of one day-of-year at flat feature offset i1, with pwrite so
+    ## that ranks on different nodes can fill disjoint feature ranges of the same file
+    def write_block(self, yday, i1, thr):
+
+        thr   = np.ascontiguousarray(self.encode(thr))
+        nfeat = self.data.shape[2]
+        isize = self.data.dtype.itemsize
+        fd = os.open(self.fname, os.O_WRONLY)
+        for p in range(self.npctl):
+            os.pwrite(fd, thr[p].tobytes(), self.header['offset']+((yday*self.npctl+p)*nfeat+i1)*isize)
+        os.close(fd)
+
+    def __getitem__(self, yday):
+
+        return self.thresholds(yday)
+
+    def close(self):
+
+        if self.data is not None and self.data.mode=='r+':
+            self.data.flush()
+        self.data = None
+
+## dict of stores keyed by variable name, so it can stand in for the ydrunpctl netCDF dataset
+class PctlStores(dict):
+
+    def close(self):
+        for s in self.values():
+            s.close()
+
+## store file name next to the netCDF climatology
+def store_name(fnin, vname):
+
+    return f'{fnin}.{vname}.pcs'
+
+## open the compact stores if all exist, otherwise the original netCDF climatology
+def open_pctl(fnin, vs):
+
+    if all(os.path.isfile(store_name(fnin, v)) for v in vs):
+        return PctlStores({v: PctlStore(store_name(fnin, v)) for v in vs})
+
+    import netCDF4 as nc
+    return nc.Dataset(fnin, 'r')
+
+## write the header and allocate an empty store, to be filled through PctlStore(fnout, 'r+')
+def create_store(fnout, vname, ndoy, npctl, shape, dtype='u2', time0=0.0, time_units='', source='', vrange=None):
+
+    header = {'var': vname, 'dtype': np.dtype(dtype).str, 'ndoy': ndoy, 'npctl': npctl, 'shape': list(shape),
+              'time0': float(time0), 'time_units': time_units, 'source': source}
+    if np.dtype(dtype)==np.uint16:
+        offset, vmax = vrange if vrange is not None else vranges.get(vname, vrange0)
+        header.update({'enc': 'log1p', 'qoffset': float(offset), 'qmax': float(vmax), 'qscale': float(np.log1p(vmax-offset)/(qmiss-1))})
+    header['offset'] = 0
+    nhead = len(json.dumps(header).encode())+32
+    header['offset'] = (len(magic)+4+nhead+align-1)//align*align
+    head = json.dumps(header).encode().ljust(nhead)
+
+    with open(fnout, 'wb') as f:
+        f.write(magic+struct.pack('<I', len(head))+head)
+        f.truncate(header['offset']+ndoy*npctl*int(np.prod(shape))*np.dtype(dtype).itemsize)
+
+## sort thresholds along the percentile axis as float32, masked/NaN become +inf; the store encodes them on writing
+def sort_thresholds(pctl):
+
+    thr = np.ma.asarray(pctl).filled(np.inf).astype(np.float32)
+    thr[np.isnan(thr)] = np.inf
+    return np.sort(thr, axis=0)
+
+## convert a ydrunpctl.00-99 netCDF file into a store, one day-of-year at a time
+def build_store(fnin, vname, fnout, dtype='u2'):
+
+    import netCDF4 as nc
+
+    fin = nc.Dataset(fnin, 'r')
+    var = fin[vname]
+    ndoy, npctl = var.shape[:2]
+    shape = var.shape[2:]
+    create_store(fnout, vname, ndoy, npctl, shape, dtype, fin['time'][0], fin['time'].units, os.path.basename(fnin))
+
+    store = PctlStore(fnout, 'r+')
+    for yday in range(ndoy):
+        store.data[yday] = store.encode(sort_thresholds(var[yday]).reshape(npctl, -1))
+    store.close()
+
+    fin.close()
+    print(f'{fnout}: {ndoy} days x {npctl} percentiles x {shape}, {os.path.getsize(fnout)/1e6:.1f} MB')
+
+if __name__ == '__main__':
+    fnin  = sys.argv[1]
+    vname = sys.argv[2]
+    build_store(fnin, vname, store_name(fnin, vname), sys.argv[3] if len(sys.argv)>3 else 'u2')
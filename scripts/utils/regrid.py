@@ -0,0 +1,363 @@
+''' Regridding with cdo (SCRIP) weight files applied as sparse matrices
+
+A cdo weight file (from cdo genbil/gencon/..., as used by cdo remap,[grid],[weights]) is loaded once into
+a scipy.sparse [dst cells, src cells] matrix (float32) and applied one field (time step and variable) at a time,
+each regridded field written to all outputs (e.g. CONUS and the domain subsets) before the next one is read,
+so memory stays at a few fields however long or large the input is. Missing values follow cdo: a bilinear
+target cell is missing if any of its source cells is missing, a conservative one is renormalized by the valid weights.
+Which engine (cdo/python) the forcing scripts use is set by forcing: regrid: in config.yaml, cdo by default until
+compare has passed on a real day of each product.
+
+Usage:
+    imported by other scripts, or
+    [mpirun -np [# of procs]] python regrid.py daily [weights] [mask|none] [yyyymmdd1] [yyyymmdd2] [input pattern] [output pattern]
+    python regrid.py compare [weights] [input file] [cdo remap output file] [relative tolerance]   # agreement with cdo
+        and timings, exits with 1 if a variable differs by more than the tolerance (1e-5 of its max) or in missing cells
+    python regrid.py bench [weights] [input file] [# of repeats] [target grid for a cdo timing]   # per-day throughput
+Default values:
+    input/output patterns are strftime patterns, inputs may have wildcards and are merged in time
+'''
+
+__author__ = 'Ming Pan'
+__email__  = 'm3pan@ucsd.edu'
+__status__ = 'Development'
+
+import sys, os, time
+import numpy as np
+import netCDF4 as nc
+from glob import glob
+from datetime import datetime, timedelta
+from functools import lru_cache
+from scipy import sparse
+
+fill_value = np.float32(-9.e33)   # cdo default missing value
+
+## cdo weight file as a sparse matrix, y[dst] = W[dst, src] x[src]
+class Regridder:
+
+    def __init__(self, fweights):
+        with nc.Dataset(fweights, 'r') as f:
+            src = np.asarray(f['src_address'][:], dtype=np.int64) - 1
+            dst = np.asarray(f['dst_address'][:], dtype=np.int64) - 1
+            wts = np.asarray(f['remap_matrix'][:, 0], dtype=np.float32)
+            self.nsrc = len(f.dimensions['src_grid_size'])
+            self.ndst = len(f.dimensions['dst_grid_size'])
+            nx, ny = [int(n) for n in f['dst_grid_dims'][:]]
+            self.shape = (ny, nx)
+            self.lat = np.asarray(f['dst_grid_center_lat'][:], dtype=np.float64).reshape(self.shape)
+            self.lon = np.asarray(f['dst_grid_center_lon'][:], dtype=np.float64).reshape(self.shape)
+            if f['dst_grid_center_lat'].units.startswith('rad'):
+                self.lat = np.degrees(self.lat)
+                self.lon = np.degrees(self.lon)
+            imask = np.asarray(f['dst_grid_imask'][:])
+            self.method = f.map_method.lower() if 'map_method' in f.ncattrs() else 'bilinear'
+        self.W = sparse.csr_matrix((wts, (dst, src)), shape=(self.ndst, self.nsrc))
+        self.B = sparse.csr_matrix((np.ones(wts.size, dtype=np.float32), (dst, src)), shape=(self.ndst, self.nsrc))
+        self.wsum  = np.asarray(self.W.sum(axis=1)).ravel().astype(np.float32)
+        self.valid = (imask!=0) & (np.diff(self.W.indptr)>0)
+        # regular lon/lat target (1-D lat/lon, as cdo writes it) or curvilinear (y, x with 2-D lat/lon)
+        self.regular = bool(np.all(self.lat==self.lat[:, :1]) and np.all(self.lon==self.lon[:1, :]))
+
+    def __call__(self, x):
+
+        '''x: [..., src cells] or [..., src y, src x] (masked) array -> [..., dst y, dst x] float32 masked array,
+           call it on one field at a time for large grids'''
+
+        x = np.ma.asarray(x)
+        if x.shape[-1]==self.nsrc:
+            lead = x.shape[:-1]
+        else:
+            lead = x.shape[:-2]
+        xs = x.reshape(-1, self.nsrc).T
+        miss = np.ma.getmaskarray(xs)
+        y = self.W @ np.where(miss, 0, np.ma.getdata(xs)).astype(np.float32)
+        bad = np.zeros(y.shape, dtype=bool)
+        if miss.any():
+            if 'conserv' in self.method:
+                wv = self.W @ (~miss).astype(np.float32)
+                bad = wv<=0
+                y = np.where(bad, 0, y*(self.wsum[:, None]/np.where(bad, 1, wv)))
+            else:
+                bad = (self.B @ miss.astype(np.float32))>0
+        bad |= ~self.valid[:, None]
+        return np.ma.masked_array(y, bad).T.reshape(lead+self.shape)
+
+## regridder of a weight file, loaded once per process
+@lru_cache(maxsize=8)
+def load_regridder(fweights):
+
+    return Regridder(fweights)
+
+## generate the weight file with cdo once if it does not exist yet
+def gen_weights(grid, fsrc, fweights, method='bil'):
+
+    if not os.path.isfile(fweights):
+        cmd = f'cdo -f nc4 gen{method},{grid} {fsrc} {fweights}'
+        print(cmd); os.system(cmd)
+    return load_regridder(fweights)
+
+## the 2-D mask to add (cdo add [file] xmask0_[domain].nc): 0 inside the domain, missing outside
+@lru_cache(maxsize=8)
+def load_mask(fmask):
+
+    with nc.Dataset(fmask, 'r') as f:
+        for name, variable in f.variables.items():
+            if variable.ndim>=2 and name not in ['lat', 'lon', 'x', 'y']:
+                return np.ma.asarray(variable[:]).reshape(variable.shape[-2:])
+
+## gridded [time, (1, ...,) y, x] variables of an open file (optionally only the given names and source grid size), {name: attributes}
+def grid_vars(f, names=None, ncells=None):
+
+    attrs = {}
+    for name, variable in f.variables.items():
+        if names is not None and name not in names:
+            continue
+        if 'time' not in variable.dimensions or variable.ndim<3 or np.prod(variable.shape[1:-2])!=1:
+            continue
+        if ncells is not None and np.prod(variable.shape[-2:])!=ncells:
+            continue
+        # outputs are unpacked float32, so the packing/valid range attributes of the input are not carried over
+        attrs[name] = {a: variable.getncattr(a) for a in variable.ncattrs()
+                       if a not in ['_FillValue', 'missing_value', 'coordinates', 'scale_factor', 'add_offset', 'valid_range', 'valid_min', 'valid_max']}
+    return attrs
+
+## time steps of files merged in time, in time order: time attributes, [(file, index in the file, time in units of the first file)]
+def time_steps(fins):
+
+    steps = []; tatts = None
+    for fin in fins:
+        with nc.Dataset(fin, 'r') as f:
+            if tatts is None:
+                tatts = {a: f['time'].getncattr(a) for a in f['time'].ncattrs() if a!='_FillValue'}
+            tt = np.atleast_1d(f['time'][:])
+            if f['time'].units!=tatts['units']:
+                cal = tatts.get('calendar', 'standard')
+                tt = nc.date2num(nc.num2date(tt, f['time'].units, cal), tatts['units'], cal)
+            steps.extend([(fin, i, t) for i, t in enumerate(np.atleast_1d(tt))])
+    steps.sort(key=lambda s: s[2])   # stable, as mergetime
+
+    return tatts, steps
+
+## one 2-D field [y, x] of a variable at a time step of an open file
+def read_field(f, name, i):
+
+    variable = f[name]
+    return np.ma.asarray(variable[i]).reshape(variable.shape[-2:])
+
+## read the gridded variables of files merged in time: times (in units of the first file), time attributes, {name: [time, ...]}, {name: attributes},
+## all in memory, for small grids only
+def read(fins, names=None, ncells=None):
+
+    tatts, steps = time_steps(fins)
+    with nc.Dataset(fins[0], 'r') as f:
+        attrs = grid_vars(f, names, ncells)
+    data = {name: [] for name in attrs}
+    files = {fin: nc.Dataset(fin, 'r') for fin in fins}
+    for fin, i, t in steps:
+        for name in attrs:
+            data[name].append(read_field(files[fin], name, i))
+    for f in files.values():
+        f.close()
+    data = {name: np.ma.stack(x) for name, x in data.items()}
+
+    return np.array([t for fin, i, t in steps]), tatts, data, attrs
+
+## regrid the variables [time, ...] of small grids in memory, one field at a time
+def regrid_data(rg, data):
+
+    return {name: np.ma.stack([rg(x[k]) for k in range(x.shape[0])]) for name, x in data.items()}
+
+## create an output (as fout.tmp, renamed by close()) in the layout of cdo remap output, time steps are written later
+def create(fout, rg, tatts, attrs, history='', complevel=1):
+
+    f = nc.Dataset(fout+'.tmp', 'w', format='NETCDF4')
+    f.setncatts({'history': f'{datetime.now():%Y-%m-%d %H:%M}: regridded {history}'.rstrip()})
+    f.createDimension('time', None)
+    if rg.regular:
+        dims = ('lat', 'lon')
+        f.createDimension('lon', rg.shape[1]); f.createDimension('lat', rg.shape[0])
+        f.createVariable('lon', 'f8', ('lon',))[:] = rg.lon[0, :]
+        f.createVariable('lat', 'f8', ('lat',))[:] = rg.lat[:, 0]
+    else:
+        dims = ('y', 'x')
+        f.createDimension('x', rg.shape[1]); f.createDimension('y', rg.shape[0])
+        f.createVariable('lon', 'f8', dims, zlib=complevel>0, complevel=complevel)[:] = rg.lon
+        f.createVariable('lat', 'f8', dims, zlib=complevel>0, complevel=complevel)[:] = rg.lat
+    f['lon'].setncatts({'standard_name': 'longitude', 'long_name': 'longitude', 'units': 'degrees_east'})
+    f['lat'].setncatts({'standard_name': 'latitude', 'long_name': 'latitude', 'units': 'degrees_north'})
+    tv = f.createVariable('time', 'f8', ('time',))
+    tv.setncatts(tatts)
+    for name, att in attrs.items():
+        v = f.createVariable(name, 'f4', ('time',)+dims, zlib=complevel>0, complevel=complevel, fill_value=fill_value)
+        v.setncatts(att)
+        if not rg.regular:
+            v.coordinates = 'lat lon'
+    return f
+
+## close an output made by create() and move it in place
+def close(f, fout):
+
+    f.close()
+    os.replace(fout+'.tmp', fout)
+
+## write regridded variables [time, dst y, dst x] (plus the domain mask, if any) in the layout of cdo remap output
+def write(fout, rg, times, tatts, data, attrs, mask=None, history='', complevel=1):
+
+    f = create(fout, rg, tatts, {name: attrs.get(name, {}) for name in data}, history, complevel)
+    f['time'][:] = times
+    for name, y in data.items():
+        f[name][:] = (y if mask is None else y+mask).astype(np.float32)
+    close(f, fout)
+
+## destination sub-grid of an index box [x1, x2, y1, y2] (1-based and inclusive, as cdo selindexbox), for write()
+class SubGrid:
+
+    def __init__(self, rg, box):
+        x1, x2, y1, y2 = box
+        self.box = (slice(y1-1, y2), slice(x1-1, x2))
+        self.lat = rg.lat[self.box]
+        self.lon = rg.lon[self.box]
+        self.shape = self.lat.shape
+        self.regular = rg.regular
+
+    ## subset of regridded fields [..., dst y, dst x]
+    def __call__(self, x):
+        return x[(Ellipsis,)+self.box]
+
+## regrid files merged in time one field (time step, variable) at a time, each regridded field written to all outputs
+## before the next one is read, i.e. cdo -f nc4 -z zip [add -selindexbox] -remap,[grid],[weights] -mergetime [fins] [mask] [fout] for all outputs
+def remap_stream(rg, fins, outs, names=None, history=''):
+
+    '''outs: [(output file, rg or a SubGrid of it, 2-D mask to add or None, compression level)]'''
+
+    tatts, steps = time_steps(fins)
+    with nc.Dataset(fins[0], 'r') as f:
+        attrs = grid_vars(f, names, rg.nsrc)
+    dsts = []
+    for fout, grid, mask, clev in outs:
+        os.makedirs(os.path.dirname(os.path.abspath(fout)), exist_ok=True)
+        dsts.append(create(fout, grid, tatts, attrs, history, clev))
+    files = {fin: nc.Dataset(fin, 'r') for fin in fins}
+    for k, (fin, i, t) in enumerate(steps):
+        for dst in dsts:
+            dst['time'][k] = t
+        for name in attrs:
+            y = rg(read_field(files[fin], name, i))
+            for dst, (fout, grid, mask, clev) in zip(dsts, outs):
+                z = grid(y) if isinstance(grid, SubGrid) else y
+                dst[name][k] = (z if mask is None else z+mask).astype(np.float32)
+    for f in files.values():
+        f.close()
+    for dst, out in zip(dsts, outs):
+        close(dst, out[0])
+
+## regrid files (merged in time) into one file, i.e. cdo -f nc4 -z zip [add] -remap,[grid],[weights] -mergetime [fins] [mask] [fout]
+def remap_files(fweights, fins, fout, fmask=None, names=None):
+
+    rg = load_regridder(fweights)
+    mask = load_mask(fmask) if fmask is not None else None
+    remap_stream(rg, fins, [(fout, rg, mask, 1)], names, os.path.basename(fweights))
+
+## regrid days [t1, t2] over MPI ranks, with the weights loaded once per rank
+def remap_daily(fweights, fmask, t1, t2, inpat, outpat):
+
+    from mpi4py import MPI
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+
+    alldays = [t1+timedelta(days=d) for d in range((t2-t1).days+1)]
+    for t in alldays[rank::size]:
+        fins = sorted(glob(t.strftime(inpat)))
+        if len(fins)==0:
+            print(f'No input for {t:%Y-%m-%d}: {t.strftime(inpat)}')
+            continue
+        t0 = time.time()
+        remap_files(fweights, fins, t.strftime(outpat), fmask)
+        print(f'{t.strftime(outpat)}: {len(fins)} files regridded in {time.time()-t0:.1f} seconds')
+    comm.Barrier()
+
+## agreement with the output of cdo remap of the same input, one field at a time, and the regridding wall time;
+## asserts that no variable differs by more than rtol of its max value or in missing cells
+def compare(fweights, fin, fcdo, rtol=1e-5):
+
+    t0 = time.time()
+    rg = load_regridder(fweights)
+    t1 = time.time()
+    tatts, steps = time_steps([fin])
+    tatts2, steps2 = time_steps([fcdo])
+    assert len(steps2)==len(steps), f'{len(steps)} time steps in {fin} but {len(steps2)} in {fcdo}'
+    f  = nc.Dataset(fin, 'r')
+    f2 = nc.Dataset(fcdo, 'r')
+    attrs = grid_vars(f, None, rg.nsrc)
+    treg = 0.0
+    bad = []
+    for name in attrs:
+        if name not in f2.variables:
+            print(f'{name}: not in {fcdo}')
+            bad.append(name)
+            continue
+        dmax = 0.0; dsum = 0.0; n = 0; nmiss = 0; scale = 1e-30
+        for (_, i, _), (_, i2, _) in zip(steps, steps2):
+            t2 = time.time()
+            x = rg(read_field(f, name, i))
+            treg += time.time()-t2
+            y = read_field(f2, name, i2).reshape(x.shape)
+            both = ~np.ma.getmaskarray(x) & ~np.ma.getmaskarray(y)
+            nmiss += np.sum(np.ma.getmaskarray(x)!=np.ma.getmaskarray(y))
+            if both.any():
+                diff = np.abs(np.ma.getdata(x)[both].astype(np.float64)-np.ma.getdata(y)[both])
+                dmax = max(dmax, diff.max()); dsum += diff.sum(); n += diff.size
+                scale = max(scale, np.abs(np.ma.getdata(y)[both]).max())
+        print(f'{name}: max abs diff {dmax:.3e}, mean abs diff {dsum/max(n, 1):.3e}, max diff/max value {dmax/scale:.3e}, '
+              f'{nmiss} cells differ in missing')
+        if dmax>float(rtol)*scale or nmiss>0:
+            bad.append(name)
+    f.close(); f2.close()
+    print(f'{len(steps)} time steps x {len(attrs)} variables: weights loaded in {t1-t0:.2f}s, regridded in {treg:.2f}s, '
+          f'wall time {time.time()-t0:.1f}s')
+    assert len(bad)==0, f'{", ".join(bad)} of {fin} do not match {fcdo} within {float(rtol):.0e}'
+
+## per-day throughput: weights loading and regridding of one (daily) file, optionally against cdo remap
+def bench(fweights, fin, nrep=5, grid=None):
+
+    t0 = time.time()
+    rg = Regridder(fweights)
+    t1 = time.time()
+    tatts, steps = time_steps([fin])
+    f = nc.Dataset(fin, 'r')
+    attrs = grid_vars(f, None, rg.nsrc)
+    tread = 0.0; treg = 0.0
+    for name in attrs:
+        for _, i, _ in steps:
+            t2 = time.time()
+            x = read_field(f, name, i)
+            t3 = time.time()
+            for _ in range(nrep):
+                y = rg(x)
+            tread += t3-t2; treg += (time.time()-t3)/nrep
+    f.close()
+    nt = len(steps)
+    print(f'{rg.nsrc} -> {rg.ndst} cells, {rg.W.nnz} weights ({rg.method}): loaded in {t1-t0:.2f}s')
+    print(f'{len(attrs)} variables x {nt} time steps: read {tread:.2f}s, regrid {treg:.3f}s '
+          f'({treg/nt*24:.3f}s per 24 hourly steps)')
+    if grid is not None:
+        t4 = time.time()
+        os.system(f'cdo -s -f nc4 -z zip remap,{grid},{fweights} {fin} bench_regrid_cdo.nc')
+        print(f'cdo remap of the same file: {time.time()-t4:.2f}s')
+        os.system('/bin/rm -f bench_regrid_cdo.nc')
+
+if __name__ == '__main__':
+    if len(sys.argv)>1 and sys.argv[1]=='daily':
+        fmask = None if sys.argv[3]=='none' else sys.argv[3]
+        remap_daily(sys.argv[2], fmask, datetime.strptime(sys.argv[4], '%Y%m%d'), datetime.strptime(sys.argv[5], '%Y%m%d'), sys.argv[6], sys.argv[7])
+    elif len(sys.argv)>1 and sys.argv[1]=='compare':
+        try:
+            compare(*sys.argv[2:6])
+        except AssertionError as e:
+            print(e)
+            sys.exit(1)
+    elif len(sys.argv)>1 and sys.argv[1]=='bench':
+        bench(sys.argv[2], sys.argv[3], *([int(a) for a in sys.argv[4:5]]+sys.argv[5:6]))
+    else:
+        print(__doc__)
@@ -0,0 +1,111 @@
+''' Single-pass, multi-variable zonal statistics over several label sets
+
+The flat cell -> zone indices of all label sets (e.g. HUC8 and HUC10) are precomputed once, so that each
+time step of each variable takes one np.bincount for the sums/counts of all zones of all label sets.
+Min/max use the cells presorted by zone with np.fmin/np.fmax.reduceat. Outputs are preallocated.
+
+Usage:
+    imported by other scripts only
+'''
+
+__author__ = 'Ming Pan'
+__email__  = 'm3pan@ucsd.edu'
+__status__ = 'Development'
+
+import numpy as np
+
+## zonal statistics engine
+class ZonalStats:
+
+    '''labels: {name: 2D label grid}, 0 (or masked) meaning no zone; mask: optional 2D array, True to exclude a cell'''
+
+    def __init__(self, labels, mask=None):
+
+        self.names  = list(labels.keys())
+        self.ids    = {}
+        self.offset = {}
+        cells, zones = [], []
+        nz = 0
+        for name in self.names:
+            lab = np.ma.asarray(labels[name])
+            excl = np.ma.getmaskarray(lab).ravel() | (lab.filled(0).ravel()==0)
+            if mask is not None:
+                excl |= np.asarray(mask).ravel()
+            flat = lab.filled(0).ravel()
+            ids, inv = np.unique(flat[~excl], return_inverse=True)
+            self.ids[name]    = ids
+            self.offset[name] = nz
+            cells.append(np.nonzero(~excl)[0])
+            zones.append(inv+nz)
+            nz += ids.size
+        self.nzones = nz
+        self.ncells = int(np.prod(np.shape(labels[self.names[0]])))
+
+        # concatenated over label sets, a cell appears once per label set
+        self.cells = np.concatenate(cells)
+        self.zones = np.concatenate(zones)
+
+        # cells sorted by zone for min/max
+        order = np.argsort(self.zones, kind='stable')
+        self.sorted_cells = self.cells[order]
+        self.starts = np.searchsorted(self.zones[order], np.arange(nz))
+
+    ## statistics of one 2D field for all zones of all label sets
+    def step(self, field, stats):
+
+        x = np.ma.asarray(field).astype(np.float64).filled(np.nan).ravel()
+        v = x[self.cells]
+        ok = ~np.isnan(v)
+        res = {}
+        cnt = np.bincount(self.zones, weights=ok, minlength=self.nzones)
+        if 'mean' in stats or 'sum' in stats:
+            tot = np.bincount(self.zones, weights=np.where(ok, v, 0.0), minlength=self.nzones)
+            if 'sum' in stats:
+                res['sum'] = tot
+            if 'mean' in stats:
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    res['mean'] = tot/cnt
+        if 'count' in stats:
+            res['count'] = cnt
+        if 'min' in stats or 'max' in stats:
+            vs = x[self.sorted_cells]
+            with np.errstate(invalid='ignore'):
+                if 'min' in stats:
+                    res['min'] = np.fmin.reduceat(vs, self.starts)
+                if 'max' in stats:
+                    res['max'] = np.fmax.reduceat(vs, self.starts)
+
+        return res
+
+    ## statistics of [time, y, x] blocks of several variables
+    def compute(self, blocks, stats=('mean',)):
+
+        '''blocks: {variable: [time, y, x] array}; returns {label set: {variable: {stat: [time, nzone]}}}'''
+
+        out = {name: {} for name in self.names}
+        for var, blk in blocks.items():
+            nt  = blk.shape[0]
+            res = {s: np.empty((nt, self.nzones)) for s in stats}
+            for t in range(nt):
+                r = self.step(blk[t], stats)
+                for s in stats:
+                    res[s][t] = r[s]
+            for name in self.names:
+                i1 = self.offset[name]
+                i2 = i1+self.ids[name].size
+                out[name][var] = {s: res[s][:, i1:i2] for s in stats}
+
+        return out
+
+## per-step transform of a [time, ...] variable (e.g. an open netCDF variable), read one step at a time
+class Lazy:
+
+    def __init__(self, var, func):
+
+        self.var   = var
+        self.func  = func
+        self.shape = var.shape[:1]
+
+    def __getitem__(self, t):
+
+        return self.func(self.var[t])
@@ -14,6 +14,8 @@ import netCDF4 as nc
 from datetime import datetime, timedelta
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time
+from pctl_rank import rank_block, smtot, yday_of
+from pctl_store import open_pctl
 
 ## main function
 def main(argv):
@@ -25,12 +27,12 @@ def main(argv):
     print(fname)
 
     if 'LDASOUT' in os.path.basename(fname):
-        fpctl = nc.Dataset(f'{config["base_dir"]}/wrf_hydro/{domain}/retro/output/1km_daily/stat/1979-2023.SMTOT_SWE.ydrunpctl.00-99', 'r')
         vs = ['SOIL_M', 'SNEQV']
+        fpctl = open_pctl(f'{config["base_dir"]}/wrf_hydro/{domain}/retro/output/1km_daily/stat/1979-2023.SMTOT_SWE.ydrunpctl.00-99', vs)
     else:
         if 'CHRTOUT' in os.path.basename(fname):
-            fpctl = nc.Dataset(f'{config["base_dir"]}/wrf_hydro/{domain}/retro/output/1km_daily/stat/1979-2023.STREAMFLOW.ydrunpctl.00-99', 'r')
             vs = ['streamflow']
+            fpctl = open_pctl(f'{config["base_dir"]}/wrf_hydro/{domain}/retro/output/1km_daily/stat/1979-2023.STREAMFLOW.ydrunpctl.00-99', vs)
         else:
             print('We process either LDASOUT or CHRTOUT files.')
             return 1
@@ -49,18 +51,16 @@ def main(argv):
         fdata[name+'_r'].long_name = f'Percentile rank of {fdata[name].long_name}'
         fdata[name+'_r'].units = 'percentile'
 
-    #print(fdata['time'][:])
-    for t in range(fdata['time'].size):
-        dtime = nc.num2date(fdata['time'][:].data[t], fdata['time'].units)
-        yday = (dtime - dtime.replace(month=1, day=1)).days
-        for v in vs:
-            if v == 'SOIL_M':
-                fdata[v+'_r'][t] = ((fdata[v][t, :, 0, :]*0.05+fdata[v][t, :, 1, :]*0.15+fdata[v][t, :, 2, :]*0.3+fdata[v][t, :, 3, :]*0.5)>fpctl[v][yday]).sum(axis=0).astype(float)
-            elif v == 'streamflow' and len(fdata[v].shape) == 1:
-                fdata[v+'_r'][:] = (fdata[v][:]>fpctl[v][yday]).sum(axis=0).astype(float)
-            else:
-                fdata[v+'_r'][t] = (fdata[v][t]>fpctl[v][yday]).sum(axis=0).astype(float)
-            fdata.sync()
+    # rank per variable with the thresholds of each day read once, each step written as it is ranked
+    ydays = [yday_of(nc.num2date(t, fdata['time'].units)) for t in fdata['time'][:].data]
+    for v in vs:
+        if v == 'SOIL_M':
+            rank_block(fdata[v], ydays, fpctl, v, transform=smtot, out=fdata[v+'_r'])
+        elif v == 'streamflow' and len(fdata[v].shape) == 1:
+            fdata[v+'_r'][:] = rank_block(fdata[v][:][None, :], ydays[-1:], fpctl, v)[0]
+        else:
+            rank_block(fdata[v], ydays, fpctl, v, out=fdata[v+'_r'])
+    fdata.sync()
 
     fpctl.close()
     fdata.close()
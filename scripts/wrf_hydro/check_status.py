@@ -16,6 +16,7 @@ from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time, find_last_time2
+from basin_store import export_csv, merge_stores
 
 ## some setups
 domain = 'cnrfc'
@@ -132,15 +133,37 @@ def main(argv):
     last_riv_fcst = f'{config["base_dir"]}/wrf_hydro/cnrfc/fcst/wwrf/output/41/CHRTOUT_{last_whwwrf1:%Y%m%d}-{last_whwwrf2:%Y%m%d}.daily.t.csv.gz'
     cmd = f'rsync -a {last_riv_moni} {last_riv_fcst} {config["base_dir"]}/web/data/cnrfc/nrt/rivers/'
     print(cmd); os.system(cmd)
+    # basin store, at data/nrt/basins/ where the web app reads it
+    cmd = f'rsync -a {config["base_dir"]}/wrf_hydro/basins24/nrt/output/basins/averaged.db {config["base_dir"]}/web/data/cnrfc/nrt/basins/'
+    print(cmd); os.system(cmd)
     
-    # conus
-    cmd = f'rsync -a {config["base_dir"]}/wrf_hydro/conus/nrt/output/basins/* {config["base_dir"]}/web/data/conus/nrt/'
+    # conus, the per-HUC4 CSVs exported from the HUC stores first (only when a store changed)
+    for h in ['huc8', 'huc10']:
+        for freq in ['daily', 'monthly']:
+            export_csv(f'{config["base_dir"]}/wrf_hydro/conus/nrt/output/basins/{h}.db', freq, h.upper(),
+                       f'{config["base_dir"]}/wrf_hydro/conus/nrt/output/basins/{h}', 4)
+    cmd = f'rsync -a --exclude="*.db" --exclude=".*" {config["base_dir"]}/wrf_hydro/conus/nrt/output/basins/* {config["base_dir"]}/web/data/conus/nrt/'
+    print(cmd); os.system(cmd)
+    cmd = f'rsync -a {config["base_dir"]}/wrf_hydro/conus/nrt/output/basins/huc*.db {config["base_dir"]}/web/data/conus/nrt/basins/'
     print(cmd); os.system(cmd)
     
     # cbrfc
     for h in ['huc8', 'huc10']:
         cmd = f'rsync -a {config["base_dir"]}/wrf_hydro/conus/nrt/output/basins/{h}/1[45]*  {config["base_dir"]}/wrf_hydro/conus/nrt/output/basins/{h}/160[123]* {config["base_dir"]}/web/data/cbrfc/nrt/{h}/'
         print(cmd); os.system(cmd)
+    cmd = f'rsync -a {config["base_dir"]}/wrf_hydro/conus/nrt/output/basins/huc*.db {config["base_dir"]}/web/data/cbrfc/nrt/basins/'
+    print(cmd); os.system(cmd)
+    
+    # river stores, merged here from the part stores of the producer jobs (monitor, percentiles, forecast /
+    # one per ensemble member) as their single writer, at data/nrt/rivers/ and data/fcst/rev_esp/ where the web apps read them
+    for rdomain, apps in [('cnrfc', ['cnrfc']), ('conus', ['conus', 'cbrfc'])]:
+        for ptype, dout, parts in [('nrt/output/rivers', 'nrt/rivers', 'parts/*.db'), ('fcst/rev_esp/output', 'fcst/rev_esp', '??/rivers.db')]:
+            fdb = f'{config["base_dir"]}/wrf_hydro/{rdomain}/{ptype}/rivers.db'
+            merge_stores(fdb, sorted(glob(f'{config["base_dir"]}/wrf_hydro/{rdomain}/{ptype}/{parts}')), 'daily', 'feature_id')
+            if os.path.isfile(fdb):
+                for app in apps:
+                    cmd = f'mkdir -p {config["base_dir"]}/web/data/{app}/{dout}; rsync -a {fdb} {config["base_dir"]}/web/data/{app}/{dout}/'
+                    print(cmd); os.system(cmd)
     
     if len(argv)>0:
         if argv[0]=='update_gcloud':
@@ -0,0 +1,161 @@
+''' Ensemble statistics of WRF-Hydro ensemble forecast monthly outputs, streamed over members chunk by chunk
+
+Reads the monthly LDASOUT (SWE, total soil moisture) and CHRTOUT (streamflow) files of all members one
+block of rows/reaches at a time, so memory is bounded by [# of members] x [block], and writes the
+ensemble P10/P50/P90, mean and the percent of members exceeding climatology percentiles (per month) to
+[fcst_start]-[fcst_end].[LDASOUT|CHRTOUT]_DOMAIN1.monthly.ensstat next to the member directories.
+Run as one job after the post-processing jobs of all members (run_esp_wwrf.py), the output is written
+to a temporary file and renamed when complete.
+
+Usage:
+    python ens_stats.py [domain] [fcst_start] [fcst_end] [fcst_update] [fcst_type] [ens1] [ens2]
+Default values:
+    ens1, ens2: all members found
+'''
+
+__author__ = 'Ming Pan'
+__email__  = 'm3pan@ucsd.edu'
+__status__ = 'Development'
+
+import sys, os, time
+import numpy as np
+import netCDF4 as nc
+from glob import glob
+from datetime import datetime
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
+from utilities import config
+
+quantiles = {'p10': 0.1, 'p50': 0.5, 'p90': 0.9}
+pexc      = [10, 50, 90]   # climatology percentiles for the probability of exceedance
+block     = {'LDASOUT_DOMAIN1': 128, 'CHRTOUT_DOMAIN1': 200000}   # rows of the grid / reaches per block
+
+soil_wts  = [0.05, 0.15, 0.3, 0.5]
+
+## variables of each output type: name -> (source variable, climatology file, climatology variable)
+def out_vars(domain, rout):
+
+    statdir = f'{config["base_dir"]}/wrf_hydro/{domain}/retro/output/1km_monthly/stat'
+    if rout=='LDASOUT_DOMAIN1':
+        fclim = f'{statdir}/1979-2023.SMTOT_SWE.monthly.ymonpctl.00-99'
+        return {'SWE': ('SNEQV', fclim, 'SNEQV'), 'SMTOT': ('SOIL_M', fclim, 'SOIL_M')}
+    else:
+        fclim = f'{statdir}/1979-2023.STREAMFLOW.monthly.ymonpctl.00-99'
+        return {'STREAMFLOW': ('streamflow', fclim, 'streamflow')}
+
+## one block of a member, [rows, x] or [reaches], NaN where missing
+def read_block(f, v, t, i1, i2):
+
+    if v=='SOIL_M':   # weighted total of the 4 layers, as in add_pctl_rank_monthly
+        x = f[v][t, i1:i2, :, :]
+        x = sum([x[:, k, :]*soil_wts[k] for k in range(4)])
+    else:
+        x = f[v][t, i1:i2]
+    return np.ma.filled(np.ma.asarray(x).astype(np.float64), np.nan)
+
+## statistics of a [member, ...] block, clim: [percentile, ...] climatology of the month
+def block_stats(x, clim=None):
+
+    res = {}
+    q = np.quantile(x, list(quantiles.values()), axis=0)
+    for k, s in enumerate(quantiles.keys()):
+        res[s] = q[k]
+    res['mean'] = x.mean(axis=0)
+    if clim is not None:
+        miss = np.isnan(res['mean'])
+        for pp in pexc:
+            pe = (x>clim[pp]).mean(axis=0)*100
+            pe[miss] = np.nan
+            res[f'pexc{pp:02d}'] = pe
+    return res
+
+## create the output file with the coordinates of the first member
+def create_output(fnout, src, names, rout):
+
+    dst = nc.Dataset(fnout, 'w')
+    dst.setncatts({'title': f'Ensemble statistics of {rout} monthly', 'history': f'Created {datetime.now():%Y-%m-%d %H:%M}'})
+    dims = ['time', 'y', 'x'] if rout=='LDASOUT_DOMAIN1' else ['time', 'feature_id']
+    for d in dims:
+        dst.createDimension(d, None if d=='time' else len(src.dimensions[d]))
+    # time and the coordinate variables (x, y, feature_id, lat/lon, ...)
+    for name, variable in src.variables.items():
+        if name=='time' or (len(variable.dimensions)>0 and set(variable.dimensions)<=set(dims[1:])):
+            dst.createVariable(name, variable.datatype, variable.dimensions, zlib=True)
+            dst[name].setncatts(src[name].__dict__)
+            dst[name][:] = src[name][:]
+    stats = list(quantiles.keys())+['mean']+[f'pexc{pp:02d}' for pp in pexc]
+    for name in names:
+        for s in stats:
+            x = dst.createVariable(f'{name}_{s}', 'f4', tuple(dims), zlib=True, fill_value=np.float32(np.nan))
+            x.long_name = f'Ensemble {s} of {name}' if not s.startswith('pexc') else \
+                          f'Percent of members exceeding the climatological {s[4:]}th percentile of {name}'
+            if s.startswith('pexc'):
+                x.units = 'percent'
+            elif 'units' in src[names[name][0]].ncattrs():
+                x.units = src[names[name][0]].units
+    return dst
+
+## stream all members of one output type
+def ens_stats(domain, ensdir, fname, rout, members):
+
+    t0 = time.time()
+    srcs  = [nc.Dataset(f'{ensdir}/{ens:02d}/{fname}', 'r') for ens in members]
+    names = out_vars(domain, rout)
+    fclim = nc.Dataset(list(names.values())[0][1], 'r') if os.path.isfile(list(names.values())[0][1]) else None
+    fnout = f'{ensdir}/{fname}.ensstat'
+    dst   = create_output(f'{fnout}.tmp', srcs[0], names, rout)
+
+    ntime = srcs[0]['time'].size
+    nrows = len(srcs[0].dimensions['y' if rout=='LDASOUT_DOMAIN1' else 'feature_id'])
+    nb    = block[rout]
+    for t in range(ntime):
+        month = nc.num2date(srcs[0]['time'][t], srcs[0]['time'].units).month
+        for name, (v, _, vclim) in names.items():
+            for i1 in range(0, nrows, nb):
+                i2 = min(i1+nb, nrows)
+                x = read_block(srcs[0], v, t, i1, i2)
+                blk = np.empty((len(srcs),)+x.shape)
+                blk[0] = x
+                for k in range(1, len(srcs)):
+                    blk[k] = read_block(srcs[k], v, t, i1, i2)
+                clim = None
+                if fclim is not None and vclim in fclim.variables:
+                    clim = np.ma.filled(np.ma.asarray(fclim[vclim][month-1, :, i1:i2]).astype(np.float64), np.nan)
+                for s, y in block_stats(blk, clim).items():
+                    dst[f'{name}_{s}'][t, i1:i2] = y.astype(np.float32)
+        print(f'{fname} month {t+1}/{ntime} done.')
+
+    for src in srcs:
+        src.close()
+    if fclim is not None:
+        fclim.close()
+    dst.close()
+    os.replace(f'{fnout}.tmp', fnout)
+    print(f'{len(members)} members of {fname}: {time.time()-t0:.1f}s')
+
+## main function
+def main(argv):
+
+    '''main loop'''
+
+    domain = argv[0]
+    t1 = datetime.strptime(argv[1], '%Y%m%d')
+    t2 = datetime.strptime(argv[2], '%Y%m%d')
+    tupdate = datetime.strptime(argv[3], '%Y%m%d')
+    ensdir  = f'{config["base_dir"]}/wrf_hydro/{domain}/fcst/{argv[4]}/output/init{t1:%Y%m%d}_update{tupdate:%Y%m%d}'
+    if len(argv)>6:
+        members = list(range(int(argv[5]), int(argv[6])+1))
+    else:
+        members = sorted([int(os.path.basename(d)) for d in glob(f'{ensdir}/[0-9][0-9]')])
+
+    for rout in ['LDASOUT_DOMAIN1', 'CHRTOUT_DOMAIN1']:
+        fname = f'{t1:%Y%m%d}-{t2:%Y%m%d}.{rout}.monthly'
+        missing = [ens for ens in members if not os.path.isfile(f'{ensdir}/{ens:02d}/{fname}')]
+        if len(missing)>0:
+            print(f'{fname} missing for members {missing}, skipped.')
+            continue
+        ens_stats(domain, ensdir, fname, rout, members)
+
+    return 0
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
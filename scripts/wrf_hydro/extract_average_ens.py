@@ -20,6 +20,7 @@ from dateutil.relativedelta import relativedelta
 from calendar import monthrange
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time
+import forcing_links
 
 from mpi4py import MPI
 
@@ -46,6 +47,7 @@ def main(argv):
     os.chdir(workdir)
     nens = len(glob('??'))
     forcdir = f'{config["base_dir"]}/wrf_hydro/{domain}/fcst/{argv[6]}/forcing/{t1:%Y}-{t2:%Y}'
+    links   = forcing_links.read_manifest(forcdir)
     
     os.chdir(workdir)
 
@@ -84,7 +86,7 @@ def main(argv):
         t2m = tupdate_month + relativedelta(months=1)
         while t<t2m:
             flink = f'{forcdir}/{ens:02d}/{t:%Y/%Y%m%d}.LDASIN_DOMAIN1'
-            tlink = datetime.strptime(os.path.basename(os.readlink(flink)).split('.')[0], '%Y%m%d')
+            tlink = forcing_links.source(links, forcdir, ens, t)[1]
             ydiff = t.year - tlink.year
             if ydiff!=0:
                 fnins += f' -shifttime,{ydiff:d}year {flink}'
@@ -94,18 +96,15 @@ def main(argv):
         cmd = f'cdo -O --sortname -f nc4 -z zip monmean -setrtomiss,1e10,1e30 -mergetime [ {fnins} ] {ens_for_mon1}'
         print(cmd); os.system(cmd)
         
-        # assemble the rest of months from retro data by tracing the links
+        # assemble the rest of months from retro data by looking up the link manifest
         fnins = ''
         #t = t1 + relativedelta(months=1)
         t = t2m
         while t<=t2:
-            flink = f'{forcdir}/{ens:02d}/{t:%Y/%Y%m%d}.LDASIN_DOMAIN1'
-            if 'retro' in os.readlink(flink):
-                tlink = datetime.strptime(os.path.basename(os.readlink(flink)).split('.')[0], '%Y%m%d')
-            else:
+            kind, tlink = forcing_links.source(links, forcdir, ens, t)
+            if kind!='retro':
                 t10 = t + timedelta(days=10)
-                flink10 = f'{forcdir}/{ens:02d}/{t10:%Y/%Y%m%d}.LDASIN_DOMAIN1'
-                tlink = datetime.strptime(os.path.basename(os.readlink(flink10)).split('.')[0], '%Y%m%d') - timedelta(days=10)
+                tlink = forcing_links.source(links, forcdir, ens, t10)[1] - timedelta(days=10)
             ydiff = t.year - tlink.year
             fnins += f' {config["base_dir"]}/wrf_hydro/{domain}/retro/forcing/1km_monthly/{tlink:%Y%m}.LDASIN_DOMAIN1.monthly'
             t += relativedelta(months=1)
@@ -20,6 +20,7 @@ from dateutil.relativedelta import relativedelta
 from calendar import monthrange
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time
+from basin_store import BasinStore
 
 from mpi4py import MPI
 
@@ -95,6 +96,7 @@ def main(argv):
         print(cmd); os.system(cmd)
 
     comm.Barrier()    
+    frames = {'daily': [], 'monthly': []}
     for name in site_names[rank::size]:
         
         # daily output
@@ -113,6 +115,7 @@ def main(argv):
         df_out['T2D']  = df_for['T2D']
         df_out['PREC'] = df_for['PREC']
         df_out.to_csv(fnout, index=True, float_format='%.3f', date_format='%Y-%m-%d')
+        frames['daily'].append(df_out.assign(Basin=name))
     
         # monthly output
         fnout = f'{dout}/{name}_out.txt'
@@ -135,10 +138,20 @@ def main(argv):
             df_out_mon[v] = df_out[v]
         df_out_mon['Qsim'] = df_q['Qsim']
         df_out_mon.to_csv(fnout, index=True, float_format='%.3f', date_format='%Y-%m-%d')
+        frames['monthly'].append(df_out_mon.assign(Basin=name))
 
+    # basin store read by the web app, written by rank 0 only with the dates from the last stored one on
+    frames = comm.gather(frames, root=0)
     comm.Barrier()
     if rank==0:
         os.system(f'rm -f {tmp_out} {tmp_for} {tmp_out_mon} {tmp_for_mon} {tmp_for_mon}.nc {dout}/*.txt')
+        store = BasinStore(f'{dout}.db', 'Basin')
+        for freq in ['daily', 'monthly']:
+            df = pd.concat([df for f in frames for df in f[freq]])
+            df.index.name = 'Date'
+            n = store.append_new_frame(freq, df)
+            print(f'{freq}: {n} of {len(df)} rows written to {dout}.db')
+        store.close()
     
     return 0
 
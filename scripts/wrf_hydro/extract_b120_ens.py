@@ -22,6 +22,7 @@ from calendar import monthrange
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time
 from cdf_match import sparse_cdf_match
+from fcst_summary import write_summary, station_coords
 
 
 ## main function
@@ -160,7 +161,10 @@ def main(argv):
         
         fnout = f'basins/cdfm/{name}_{t1:%Y%m%d}-{t2:%Y%m%d}.csv'
         df.to_csv(fnout, index=True, float_format='%.3f', date_format='%Y-%m-%d')
-        
+
+    # all stations in one file for the dashboard
+    write_summary('basins/cdfm', t1, t2, station_coords(domain))
+
     return 0
 
 if __name__ == '__main__':
@@ -19,6 +19,7 @@ from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time
+from pctl_store import PctlStore, store_name
 
 from mpi4py import MPI
 import sqlite3
@@ -60,20 +61,35 @@ def main(argv):
         
         print('Extracting percentile %d' % s)
         
-        fin  = nc.Dataset(fnin, 'r')
-        nt = fin['time'].size
+        fin = None
+        if freq=='daily' and os.path.isfile(store_name(fnin, 'streamflow')):
+            fin = PctlStore(store_name(fnin, 'streamflow'))
+            if fin.data.dtype==np.float16:   # float16 stores are for rank lookups only, too coarse for flows
+                fin.close(); fin = None
+        if fin is not None:
+            # compact store: page in only this percentile level for the rows needed
+            nt = fin.ndoy
+            data_all = fin.pctl(s, 0, round(site_list['row'].max())+1)
+            data = np.asarray(data_all[:, site_list['row'].to_numpy().astype(np.int32)], dtype=np.float32).transpose()
+            data[np.isinf(data)] = np.nan   # missing thresholds are +inf in the store, empty in the csv as before
+            tstamps = [nc.num2date(fin.header['time0']+1440*i, fin.header['time_units']).strftime('%Y-%m-%d') for i in range(nt)]
+            data_all = None
+            fin.close()
+        else:
+            fin  = nc.Dataset(fnin, 'r')
+            nt = fin['time'].size
 
-        data_all = np.squeeze(fin['streamflow'][:, s, :round(site_list['row'].max())+1])
-        data = data_all[:, site_list['row'].to_numpy().astype(np.int32)].transpose()
+            data_all = np.squeeze(fin['streamflow'][:, s, :round(site_list['row'].max())+1])
+            data = data_all[:, site_list['row'].to_numpy().astype(np.int32)].transpose()
             
-        data_all = None
+            data_all = None
             
-        if freq=='daily':
-            tstamps = [nc.num2date(fin['time'][0]+1440*i, fin['time'].units).strftime('%Y-%m-%d') for i in range(nt)]
-        else:
-            tstamps = [nc.num2date(fin['time'][i], fin['time'].units).strftime('%Y-%m-%d') for i in range(nt)]
+            if freq=='daily':
+                tstamps = [nc.num2date(fin['time'][0]+1440*i, fin['time'].units).strftime('%Y-%m-%d') for i in range(nt)]
+            else:
+                tstamps = [nc.num2date(fin['time'][i], fin['time'].units).strftime('%Y-%m-%d') for i in range(nt)]
             
-        fin.close()
+            fin.close()
                 
         #data *= kafperday
 
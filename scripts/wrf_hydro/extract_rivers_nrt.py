@@ -21,6 +21,7 @@ from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time
+from basin_store import BasinStore
 
 from mpi4py import MPI
 import sqlite3
@@ -124,6 +125,14 @@ def main(argv):
 
         #df.reset_index(inplace=True, drop=False)
         df.T.to_csv(fnout.replace('db', 't.csv.gz'), header=True, index=True, float_format='%.3f', date_format='%Y-%m-%d', compression='gzip')
+
+        # monitor part of the reach store for the dashboards, merged into rivers.db with the percentile and
+        # forecast parts by check_status.py, so that this job is the only writer of its file
+        if rank==0:
+            os.makedirs(f'{dout}/parts', exist_ok=True)
+            store = BasinStore(f'{dout}/parts/monitor.db', 'feature_id')
+            store.append_block(freq, site_list['feature_id'].astype(np.int64).astype(str).tolist(), tstamps, {'Monitor': data.T})
+            store.close()
         
     return 0
 
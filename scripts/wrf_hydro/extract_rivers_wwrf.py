@@ -23,6 +23,7 @@ from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time
+from basin_store import BasinStore
 
 from mpi4py import MPI
 import sqlite3
@@ -109,6 +110,20 @@ def main(argv):
         
         #df.reset_index(inplace=True, drop=False)
         df.T.to_csv(fnout.replace('db', 't.csv.gz'), header=True, index=True, float_format='%.3f', date_format='%Y-%m-%d', compression='gzip')
+
+        # reach store parts for the dashboards, one file per member (members run as separate jobs) merged into
+        # {dout}/rivers.db, the deterministic West-WRF forecast also as the forecast part of the NRT rivers.db,
+        # both merged by check_status.py so that each file has a single writer
+        ids = site_list['feature_id'].astype(np.int64).astype(str).tolist()
+        store = BasinStore(f'{dout}/{ens:02d}/rivers.db', 'feature_id')
+        store.append_block(freq, ids, tstamps, {f'Ens{ens:02d}': data.T})
+        store.close()
+        if fcst_type=='wwrf' and ens==41:
+            dnrt = f'{config["base_dir"]}/wrf_hydro/{domain}/nrt/output/rivers/parts'
+            os.makedirs(dnrt, exist_ok=True)
+            store = BasinStore(f'{dnrt}/forecast.db', 'feature_id')
+            store.append_block(freq, ids, tstamps, {'Forecast': data.T})
+            store.close()
         
     return 0
 
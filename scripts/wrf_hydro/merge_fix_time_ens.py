@@ -119,6 +119,7 @@ def main(argv):
                 add_pctl_rank_monthly.main([domain, fndstm])
 
     comm.Barrier()
+
     return 0
 
 if __name__ == '__main__':
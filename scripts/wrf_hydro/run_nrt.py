@@ -232,14 +232,14 @@ def main(argv):
 
     elif domain in ['conus']:
 
-        for huclev in [8, 10]:
-            cmd1 = f'unset SLURM_MEM_PER_NODE; python {config["base_dir"]}/scripts/wrf_hydro/extract_huc_nrt.py'
-            flog = f'{workdir}/log/extract_huc{huclev}_{t1:%Y%m}_{t2:%Y%m}.txt'
-            cmd = f'sbatch -d afterok:{jid3} --nodes=1 --ntasks-per-node=1 -t 01:20:00 -p cw3e-shared -A cwp101 --mem=5G -J "exhucnrt" --wrap="{cmd1} {domain} 202410 {t2:%Y%m} {huclev}" -o {flog}'
-            #print(cmd)
-            ret = subprocess.check_output([cmd], shell=True)
-            jid4 = ret.decode().split(' ')[-1].rstrip()
-            print(f'HUC{huclev} basin averages extraction will run with job ID: {jid4}')
+        # HUC8 and HUC10 in one pass
+        cmd1 = f'unset SLURM_MEM_PER_NODE; python {config["base_dir"]}/scripts/wrf_hydro/extract_huc_nrt.py'
+        flog = f'{workdir}/log/extract_huc_{t1:%Y%m}_{t2:%Y%m}.txt'
+        cmd = f'sbatch -d afterok:{jid3} --nodes=1 --ntasks-per-node=1 -t 01:20:00 -p cw3e-shared -A cwp101 --mem=8G -J "exhucnrt" --wrap="{cmd1} {domain} 202410 {t2:%Y%m} 8,10" -o {flog}'
+        #print(cmd)
+        ret = subprocess.check_output([cmd], shell=True)
+        jid4 = ret.decode().split(' ')[-1].rstrip()
+        print(f'HUC8/HUC10 basin averages extraction will run with job ID: {jid4}')
             
         cmd1 = f'unset SLURM_MEM_PER_NODE; python {config["base_dir"]}/scripts/wrf_hydro/extract_gauges_nrt_conus.py'
         flog = f'{workdir}/log/extract_gauges_{t1:%Y%m}_{t2:%Y%m}.txt'
@@ -21,6 +21,7 @@ from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time, replace_brackets
+import forcing_links
 
 ## setup links
 def setup_links(domain, t1, t2, tupdate):
@@ -31,53 +32,13 @@ def setup_links(domain, t1, t2, tupdate):
     yclim2 = config['wrf_hydro'][domain]['climrange'][1]
     nens = yclim2 - yclim1 + 1
     
-    # create forcing links
+    # create forcing links to the retro forcing of the climatology years
     forcedir = f'{config["base_dir"]}/wrf_hydro/{domain}/fcst/rev_esp/forcing'
     if not os.path.isdir(forcedir):
 
         print('Creating forcing links ...')
-        os.system(f'mkdir {forcedir}')
-        os.chdir(forcedir)
-
-        ens = 1
-        for yclim in range(yclim1, yclim2+1):
-            if yclim!=t1.year:
-
-                os.system(f'mkdir -p {ens:02d}/{t1.year:d}')
-
-                if t1.year==t2.year:
-                    tclim1 = datetime(yclim, 1, 1)
-                    tclim2 = datetime(yclim, 12, 31)
-                else:
-                    tclim1 = datetime(yclim, 8, 1)
-                    tclim2 = datetime(yclim+1, 6, 1)
-                    os.system(f'mkdir -p {ens:02d}/{t2.year:d}')
-
-                tclim = tclim1
-                while tclim<=tclim2:
-
-                    tforc = tclim + relativedelta(years=t1.year-yclim)
-                    fforc = f'{ens:02d}/{tforc:%Y/%Y%m%d}.LDASIN_DOMAIN1'
-
-                    fclim = f'../../../retro/{tclim:%Y/%Y%m%d}.LDASIN_DOMAIN1'
-
-                    # handle extra 2/29 - skip it
-                    if tclim.year%4==0 and tforc.year%4!=0 and tclim.month==2 and tclim.day==29:
-                        pass
-                    else:
-                        cmd = f'ln -s {fclim} {fforc}'
-                        #print(cmd)
-                        os.system(cmd)
-
-                    # handle missing 2/29 - set it to 2/28
-                    if tclim.year%4!=0 and tforc.year%4==0 and tclim.month==2 and tclim.day==28:
-                        fforc = f'{ens:02d}/{tforc:%Y/%Y%m29}.LDASIN_DOMAIN1'
-                        cmd = f'ln -s {fclim} {fforc}'
-                        os.system(cmd)
-
-                    tclim += timedelta(days=1)
-
-                ens += 1
+        os.makedirs(forcedir)
+        forcing_links.apply(forcedir, forcing_links.clim_links(t1, t2, yclim1, yclim2))
                 
     # link WestWRF ensemble forecasts
     print('Creating links to West-WRF ensemble forecasts.')
@@ -95,6 +56,7 @@ def setup_links(domain, t1, t2, tupdate):
     if tlast > tupdate+timedelta(days=max_lead-1):
         tlast = tupdate+timedelta(days=max_lead-1)
     print(f'Last ensemble forecast date is: {tlast:%Y-%m-%d}; forecast update date is {tupdate:%Y-%m-%d}')
+    links = []; checked = {}
     for ens in range(1, nens+1):
         tforc = tupdate
         #while tforc<t1+timedelta(days=7):
@@ -103,22 +65,18 @@ def setup_links(domain, t1, t2, tupdate):
                 fww   = f'../NRT_ens/{ens:02d}/{tforc:%Y%m%d}.LDASIN_DOMAIN1'
             else:
                 fww   = f'../NRT_ens/{nens}/{tforc:%Y%m%d}.LDASIN_DOMAIN1'
-            fforc = f'{ens:02d}/{tforc:%Y/%Y%m%d}.LDASIN_DOMAIN1'
-            #print(f'{forcedir}/{fww}')
             if os.path.isfile(fww):
-                ftemp = nc.Dataset(fww, 'r')
-                if ftemp['time'].size==24:
-                    os.system(f'rm -f {fforc}')
-                    os.system(f'ln -s ../../{fww} {fforc}')
+                if forcing_links.complete_day(fww, checked):
+                    links.append((ens, tforc, 'wwrf', f'../../{fww}', tforc))
                     if ens==1:
                         print(f'{tforc:%Y-%m-%d} is found in West-WRF ensemble #1.')
                 else:
                     print(f'{tforc:%Y-%m-%d} is found in West-WRF ensemble #{ens:02d} but has fewer than 24 time steps.')
-                ftemp.close()
             else:
                 if ens==1:
                     print(f'{tforc:%Y-%m-%d} is not found in West-WRF ensemble #1.')
             tforc += timedelta(days=1)
+    forcing_links.apply(forcedir, links)
                 
     # link NRT monitor forcing
     print('Creating links to NRT forcing.')
@@ -126,16 +84,15 @@ def setup_links(domain, t1, t2, tupdate):
     if tlast > tupdate:
         tlast = tupdate
     print(f'Use NRT monitor forcing date until: {tlast:%Y-%m-%d}')
+    links = []
     for ens in range(1, nens+1):
         tforc = t1
         while tforc<=tlast:
             fww   = f'../nrt/{tforc:%Y/%Y%m%d}.LDASIN_DOMAIN1'
-            fforc = f'{ens:02d}/{tforc:%Y/%Y%m%d}.LDASIN_DOMAIN1'
-            #print(forcedir+'/'+fww)
             if os.path.isfile(fww):
-                os.system(f'rm -f {fforc}')
-                os.system(f'ln -s ../../{fww} {fforc}')
+                links.append((ens, tforc, 'nrt', f'../../{fww}', tforc))
             tforc += timedelta(days=1)
+    forcing_links.apply(forcedir, links)
         
     return 0
  
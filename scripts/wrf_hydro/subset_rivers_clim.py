@@ -19,6 +19,7 @@ from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/utils')
 from utilities import config, find_last_time
+from basin_store import BasinStore
 
 from mpi4py import MPI
 import sqlite3
@@ -61,6 +62,7 @@ def main(argv):
     site_list = pd.read_csv(f'{config["base_dir"]}/wrf_hydro/{domain}/domain/rivers/line_numbers_{domain}_order4plus.csv')
     nsites = site_list.shape[0]
     
+    blocks = []
     for pctl in pctls[rank::size]:
         
         print(f'Subsetting/matching {pctl} percentile.')
@@ -95,6 +97,18 @@ def main(argv):
         conn = sqlite3.connect(fnout.replace('csv.gz', 'db'))
         df.T.to_sql('streamflow', conn, if_exists='replace')
         conn.close()
+
+        blocks.append((pctl, df.columns.tolist(), df.index.tolist(), df.to_numpy()))
+
+    # percentile part of the reach store for the dashboards, gathered and written by rank 0 only,
+    # merged into rivers.db with the monitor and forecast parts by check_status.py
+    blocks = comm.gather(blocks, root=0)
+    if rank==0:
+        os.makedirs(f'{dout}/parts', exist_ok=True)
+        store = BasinStore(f'{dout}/parts/pctl.db', 'feature_id')
+        for pctl, ids, dates, data in [b for bs in blocks for b in bs]:
+            store.append_block(freq, ids, dates, {f'Pctl{pctl:02d}': data})
+        store.close()
         
     return 0
 
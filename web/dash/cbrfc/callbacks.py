@@ -10,6 +10,7 @@ from basin_tools import draw_basin_ts
 from snow_tools import draw_course, draw_pillow
 from river_tools import draw_mofor_river_db, draw_rev_esp
 from config import cloud_url, all_stations
+from data_cache import system_status
 ## Callbacks from here on
 
 # callback to update data var in the title section
@@ -88,7 +89,7 @@ app.clientside_callback(
 @app.callback(Output(component_id='datepicker', component_property='max_date_allowed'),
               Input('interval-check_system', 'n_intervals'))
 def update_system_status(basin):
-    df_status = pd.read_csv(f'{cloud_url}/data/system_status.csv', parse_dates=True)
+    df_status = system_status()
     return datetime.fromisoformat(df_status['WRF-Hydro NRT'][1]).date()
 
 # callback to switch HUC sources according to zoom level
@@ -181,7 +182,7 @@ def update_basin(basin):
               Input('radio_pp', 'value'))
 def update_flows(fcst_point, yday_update, pp):
     
-    df_system_status = pd.read_csv(f'{cloud_url}/data/system_status.csv', parse_dates=True)
+    df_system_status = system_status()
     fcst_t1 = datetime.fromisoformat(df_system_status['ESP-WWRF Fcst'][0]).replace(month=3, day=1).date()
     fcst_t2 = datetime.fromisoformat(df_system_status['ESP-WWRF Fcst'][1]).replace(month=9, day=30).date()
     if fcst_t1.month>=10:
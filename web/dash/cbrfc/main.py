@@ -3,6 +3,7 @@ import dash
 import dash_bootstrap_components as dbc
 
 from layout import get_layout
+from data_cache import cache_info
 
 
 # some external things
@@ -13,6 +14,12 @@ app = dash.Dash(__name__, external_stylesheets=external_stylesheets, external_sc
 
 server = app.server
 
+# data cache hit/miss counters, only with DATA_CACHE_DEBUG set
+if os.environ.get('DATA_CACHE_DEBUG'):
+    @server.route('/debug/cache')
+    def debug_cache():
+        return cache_info(), 200, {'Content-Type': 'application/json'}
+
 app.index_string = '''
 <!DOCTYPE html>
 <html>
@@ -7,12 +7,13 @@ from datetime import date, datetime, timedelta
 import pandas as pd
 
 from config import cloud_url, map_tiles, domain_config, data_vars, tool_style, tabtitle_style, tabtitle_selected_style
+from data_cache import system_status
 
 from basin_tools  import get_basin_tools
 
 def get_region_tools():
     
-    df_system_status = pd.read_csv(f'{cloud_url}/data/system_status.csv', parse_dates=True)
+    df_system_status = system_status()
  
     last_whnrt = datetime.fromisoformat(df_system_status['WRF-Hydro NRT'][1]).date()
     #last_whnrt = datetime.fromisoformat(df_system_status['WRF-Hydro Monitor'][1]).date()
@@ -7,18 +7,37 @@ from dash import dash_table
 import plotly.express as px
 import plotly.graph_objs as go
 import pandas as pd
-import sqlite3
+import os, sqlite3
 import numpy as np
 from datetime import date, datetime, timedelta
 from dateutil.relativedelta import relativedelta
 
 from config import base_url, cloud_url, graph_config, tabtitle_style, tabtitle_selected_style, popup_ts_style
+from data_cache import system_status
 
     
+# all series of one reach from the river store in a single indexed lookup, None without a store
+def read_river(fdb, rivid):
+    if not os.path.isfile(fdb):
+        return None
+    conn = sqlite3.connect(fdb)
+    dfr = pd.read_sql_query('SELECT * FROM daily WHERE feature_id=? ORDER BY Date', conn, params=(str(rivid),), parse_dates=['Date'], index_col='Date')
+    conn.close()
+    return dfr
+
+# one series of a reach between two dates, laid out like the series read from the wide tables,
+# empty if the store has no such series (yet)
+def river_series(dfr, name, t1, t2):
+    if name not in dfr.columns:
+        return pd.DataFrame({'Flow': []}, index=pd.DatetimeIndex([], name='Date'))
+    df = dfr.loc[(dfr.index>=pd.Timestamp(t1)) & (dfr.index<=pd.Timestamp(t2)), [name]].dropna()
+    num = df._get_numeric_data(); num[num<0] = 0
+    return df.rename(columns={name: 'Flow'})
+
 # flow monitor/forecast figure
 def draw_mofor_river_db(rivid):
     
-    df_system_status = pd.read_csv(f'{cloud_url}/data/system_status.csv', parse_dates=True)
+    df_system_status = system_status()
     
     moni_t2 = datetime.fromisoformat(df_system_status['WRF-Hydro NRT'][1]).date()
     if moni_t2.month>=10:
@@ -30,6 +49,7 @@ def draw_mofor_river_db(rivid):
     
     if rivid != '':
         fig_mofor = go.Figure()
+        dfr = read_river(f'{base_url}/data/nrt/rivers/rivers.db', rivid)
         
         fillcolors = ['sienna', 'orange', 'yellow', 'lightgreen', 'lightcyan', 'lightblue', 'mediumpurple']
         fillcolors.reverse()
@@ -40,38 +60,47 @@ def draw_mofor_river_db(rivid):
         else:
             clim_t1 = date(clim_t2.year-1, 10, 1)
         for i,pctl in enumerate([95, 90, 80, 50, 20, 10, 5]):
-            fdb = f'{base_url}/data/nrt/rivers/CHRTOUT_{clim_t1:%Y%m}-{clim_t2:%Y%m}.daily.pctl{pctl:02d}.db'
-            #print(fdb)
+            if dfr is not None:
+                df = river_series(dfr, f'Pctl{pctl:02d}', clim_t1, clim_t2)
+            else:
+                fdb = f'{base_url}/data/nrt/rivers/CHRTOUT_{clim_t1:%Y%m}-{clim_t2:%Y%m}.daily.pctl{pctl:02d}.db'
+                #print(fdb)
+                conn = sqlite3.connect(fdb)
+                df = pd.read_sql_query(f'SELECT * FROM streamflow WHERE [index]={rivid}', conn).T
+                conn.close()
+                df.drop(index=df.index[0], axis=0, inplace=True)
+                num = df._get_numeric_data(); num[num<0] = 0
+                df.rename(columns={0: 'Flow'}, inplace=True)
+            tsname = f'  {pctl:d}<sup>th</sup>' if pctl<10 else f'{pctl:d}<sup>th</sup>'
+            fig_mofor.add_trace(go.Scatter(x=df.index, y=df['Flow'], name=tsname, line=dict(color=fillcolors[i]), fill='tozeroy', mode='lines'))
+        
+        if dfr is not None:
+            df = river_series(dfr, 'Monitor', moni_t1, moni_t2)
+        else:
+            fdb = f'{base_url}/data/nrt/rivers/CHRTOUT_{moni_t1:%Y%m}-{moni_t2:%Y%m}.daily.db'#; print(fdb)
             conn = sqlite3.connect(fdb)
             df = pd.read_sql_query(f'SELECT * FROM streamflow WHERE [index]={rivid}', conn).T
             conn.close()
             df.drop(index=df.index[0], axis=0, inplace=True)
             num = df._get_numeric_data(); num[num<0] = 0
             df.rename(columns={0: 'Flow'}, inplace=True)
-            tsname = f'  {pctl:d}<sup>th</sup>' if pctl<10 else f'{pctl:d}<sup>th</sup>'
-            fig_mofor.add_trace(go.Scatter(x=df.index, y=df['Flow'], name=tsname, line=dict(color=fillcolors[i]), fill='tozeroy', mode='lines'))
-        
-        fdb = f'{base_url}/data/nrt/rivers/CHRTOUT_{moni_t1:%Y%m}-{moni_t2:%Y%m}.daily.db'#; print(fdb)
-        conn = sqlite3.connect(fdb)
-        df = pd.read_sql_query(f'SELECT * FROM streamflow WHERE [index]={rivid}', conn).T
-        conn.close()
-        df.drop(index=df.index[0], axis=0, inplace=True)
-        num = df._get_numeric_data(); num[num<0] = 0
-        df.rename(columns={0: 'Flow'}, inplace=True)
         #fig_mofor.add_trace(go.Scatter(x=df['Date'], y=df['Flow'], name='Monitor', line=dict(color='blue'), mode='lines+markers'))
         df2 = df.tail(1)
         
-        fdb = f'{base_url}/data/nrt/rivers/CHRTOUT_{fcst_t1:%Y%m%d}-{fcst_t2:%Y%m%d}.daily.db'#; print(fdb)
-        conn = sqlite3.connect(fdb)
-        dff = pd.read_sql_query(f'SELECT * FROM streamflow WHERE [index]={rivid}', conn).T
-        conn.close()
-        dff.drop(index=dff.index[0], axis=0, inplace=True)
-        num = dff._get_numeric_data(); num[num<0] = 0
-        dff.rename(columns={0: 'Flow'}, inplace=True)
+        if dfr is not None:
+            dff = river_series(dfr, 'Forecast', fcst_t1, fcst_t2)
+        else:
+            fdb = f'{base_url}/data/nrt/rivers/CHRTOUT_{fcst_t1:%Y%m%d}-{fcst_t2:%Y%m%d}.daily.db'#; print(fdb)
+            conn = sqlite3.connect(fdb)
+            dff = pd.read_sql_query(f'SELECT * FROM streamflow WHERE [index]={rivid}', conn).T
+            conn.close()
+            dff.drop(index=dff.index[0], axis=0, inplace=True)
+            num = dff._get_numeric_data(); num[num<0] = 0
+            dff.rename(columns={0: 'Flow'}, inplace=True)
         dff = pd.concat([df2, dff])#.reset_index(drop = True)
         fig_mofor.add_trace(go.Scatter(x=dff.index, y=dff['Flow'], name='Forecast', line=dict(color='magenta'), mode='lines+markers'))
         fig_mofor.add_trace(go.Scatter(x=df.index, y=df['Flow'], name='Monitor', line=dict(color='blue'), mode='lines+markers'))
-        xrange = [datetime.strptime(df.index[0],'%Y-%m-%d')-timedelta(days=5), datetime.strptime(dff.index[-1],'%Y-%m-%d')+timedelta(days=35)]        
+        xrange = [pd.to_datetime(df.index[0] if len(df)>0 else moni_t1)-timedelta(days=5), pd.to_datetime(dff.index[-1] if len(dff)>0 else fcst_t2)+timedelta(days=35)]        
     else:
         fig_mofor = px.line(x=[2018, 2023], y=[0, 0], labels={'x': 'Data not available.', 'y': 'Flow (m^3/s)'})
         xrange = [2018, 2023]
@@ -90,6 +119,8 @@ def draw_rev_esp(rivid):
     
     if rivid != '':
         fig_rev_esp = go.Figure()
+        dfr = read_river(f'{base_url}/data/nrt/rivers/rivers.db', rivid)
+        dfe = read_river(f'{base_url}/data/fcst/rev_esp/rivers.db', rivid)
         
         fillcolors = ['sienna', 'orange', 'yellow', 'lightgreen', 'lightcyan', 'lightblue', 'mediumpurple']
         fillcolors.reverse()
@@ -100,32 +131,38 @@ def draw_rev_esp(rivid):
         else:
             clim_t1 = date(clim_t2.year-1, 10, 1)
         for i,pctl in enumerate([95, 90, 80, 50, 20, 10, 5]):
-            fdb = f'{base_url}/data/nrt/rivers/CHRTOUT_{clim_t1:%Y%m}-{clim_t2:%Y%m}.daily.pctl{pctl:02d}.db'
-            #print(fdb)
-            conn = sqlite3.connect(fdb)
-            df = pd.read_sql_query(f'SELECT * FROM streamflow WHERE [index]={rivid}', conn).T
-            conn.close()
-            df.drop(index=df.index[0], axis=0, inplace=True)
-            num = df._get_numeric_data(); num[num<0] = 0
-            df.rename(columns={0: 'Flow'}, inplace=True)
+            if dfr is not None:
+                df = river_series(dfr, f'Pctl{pctl:02d}', clim_t1, clim_t2)
+            else:
+                fdb = f'{base_url}/data/nrt/rivers/CHRTOUT_{clim_t1:%Y%m}-{clim_t2:%Y%m}.daily.pctl{pctl:02d}.db'
+                #print(fdb)
+                conn = sqlite3.connect(fdb)
+                df = pd.read_sql_query(f'SELECT * FROM streamflow WHERE [index]={rivid}', conn).T
+                conn.close()
+                df.drop(index=df.index[0], axis=0, inplace=True)
+                num = df._get_numeric_data(); num[num<0] = 0
+                df.rename(columns={0: 'Flow'}, inplace=True)
             tsname = f'  {pctl:d}<sup>th</sup>' if pctl<10 else f'{pctl:d}<sup>th</sup>'
             fig_rev_esp.add_trace(go.Scatter(x=df.index, y=df['Flow'], name=tsname, line=dict(color=fillcolors[i]), fill='tozeroy', mode='lines'))
 
         for e in range(1, 47):
-            fdb = f'{base_url}/data/fcst/rev_esp/{e:02d}/CHRTOUT_{fcst_t1:%Y%m%d}-{fcst_t2:%Y%m%d}.daily.db'
-            conn = sqlite3.connect(fdb)
-            dff = pd.read_sql_query(f'SELECT * FROM streamflow WHERE [index]={rivid}', conn).T
-            dff.drop(index=dff.index[0], axis=0, inplace=True)
-            conn.close()
-            num = dff._get_numeric_data(); num[num<0] = 0
-            dff.rename(columns={0: 'Flow'}, inplace=True)
+            if dfe is not None:
+                dff = river_series(dfe, f'Ens{e:02d}', fcst_t1, fcst_t2)
+            else:
+                fdb = f'{base_url}/data/fcst/rev_esp/{e:02d}/CHRTOUT_{fcst_t1:%Y%m%d}-{fcst_t2:%Y%m%d}.daily.db'
+                conn = sqlite3.connect(fdb)
+                dff = pd.read_sql_query(f'SELECT * FROM streamflow WHERE [index]={rivid}', conn).T
+                dff.drop(index=dff.index[0], axis=0, inplace=True)
+                conn.close()
+                num = dff._get_numeric_data(); num[num<0] = 0
+                dff.rename(columns={0: 'Flow'}, inplace=True)
             if e<46:
                 lcolor = 'darkgray'
             else:
                 lcolor = 'blue'
             fig_rev_esp.add_trace(go.Scatter(x=dff.index, y=dff['Flow'], name=f'Ens {e:02d}', line=dict(color=lcolor), mode='lines+markers'))
             
-        xrange = [datetime.strptime(dff.index[0],'%Y-%m-%d')-timedelta(days=35), datetime.strptime(dff.index[-1],'%Y-%m-%d')+timedelta(days=35)]        
+        xrange = [pd.to_datetime(dff.index[0] if len(dff)>0 else fcst_t1)-timedelta(days=35), pd.to_datetime(dff.index[-1] if len(dff)>0 else fcst_t2)+timedelta(days=35)]        
     else:
         fig_rev_esp = px.line(x=[2018, 2023], y=[0, 0], labels={'x': 'Data not available.', 'y': 'Flow (m^3/s)'})
         xrange = [2018, 2023]
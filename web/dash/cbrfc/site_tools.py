@@ -14,12 +14,13 @@ from glob import glob
 import os
 
 from config import cloud_url, fnf_stations, graph_config, tabtitle_style, tabtitle_selected_style, popup_ts_style, fig_ts_style
+from data_cache import read_csv, system_status
 
 # flow retro figure
 def draw_retro(staid):
     if staid in fnf_stations:
         fcsv = f'{cloud_url}/data/cbrfc/retro/combined/{staid}_monthly.csv'
-        df = pd.read_csv(fcsv, parse_dates=True, index_col='Date')
+        df = read_csv(fcsv, parse_dates=True, index_col='Date')
         fig_retro = px.line(df, labels={'Date': '', 'value': 'Flow (kaf/mon)'})
         fig_retro = go.Figure()
         fig_retro.add_trace(go.Scatter(x=df.index, y=df['FNF'],    name='Full Natural Flow', mode='lines+markers', line=go.scatter.Line(color='black', dash='dot')))
@@ -41,9 +42,9 @@ def draw_mofor(staid, fcst_type, fcst_t1, fcst_t2, fcst_update):
     nens = 45
     if staid in fnf_stations:
         fcsv = f'{cloud_url}/data/cbrfc/fcst/init{fcst_t1:%Y%m%d}_update{fcst_update:%Y%m%d}/basins/{fcst_type}/{staid}_{fcst_t1:%Y%m%d}-{fcst_t2:%Y%m%d}.csv' #; print(fcsv)
-        df = pd.read_csv(fcsv, parse_dates=True, index_col='Date', usecols = ['Date']+['Ens%02d' % (i+1) for i in range(nens)]+['Avg', 'Exc50', 'Exc90', 'Exc10'])
+        df = read_csv(fcsv, parse_dates=True, index_col='Date', usecols = ['Date']+['Ens%02d' % (i+1) for i in range(nens)]+['Avg', 'Exc50', 'Exc90', 'Exc10'])
         fcsv2 = f'{cloud_url}/data/cbrfc/nrt/combined/{staid}_monthly.csv'
-        df2 = pd.read_csv(fcsv2, parse_dates=True, index_col='Date', usecols=['Date', 'FNF', 'Qsim', 'Qmatch'])
+        df2 = read_csv(fcsv2, parse_dates=True, index_col='Date', usecols=['Date', 'FNF', 'Qsim', 'Qmatch'])
         fig_mofor = go.Figure()
         for e in range(1, nens+1):
             fig_mofor.add_trace(go.Scatter(x=df.index, y=df[f'Ens{e:02d}'], name=f'Ens{e:02d}', mode='lines+markers', line=go.scatter.Line(color='lightgray'), showlegend=False))
@@ -71,7 +72,7 @@ def draw_table(staid, staname, fcst_type, fcst_t1, fcst_t2, fcst_update):
     pcol = ['Pav50', 'Pav90', 'Pav10']
     if staid in fnf_stations:
         fcsv = f'{cloud_url}/data/cbrfc/fcst/init{fcst_t1:%Y%m%d}_update{fcst_update:%Y%m%d}/basins/{fcst_type}/{staid}_{fcst_t1:%Y%m%d}-{fcst_t2:%Y%m%d}.csv'
-        df = pd.read_csv(fcsv, parse_dates=False, usecols=cols)
+        df = read_csv(fcsv, parse_dates=False, usecols=cols)
         df = df[cols]
         cols.remove('Date')
         df[ecol] = np.round(df[ecol], 2)
@@ -81,7 +82,7 @@ def draw_table(staid, staname, fcst_type, fcst_t1, fcst_t2, fcst_update):
         #    df.iloc[-1, 0] = df.iloc[-1, 0].replace('July', 'April-July total')
     else:
         fcsv = f'{cloud_url}/data/cbrfc/fcst/init{fcst_t1:%Y%m%d}_update{fcst_update:%Y%m%d}/basins/{fcst_type}/{staid}_{fcst_t1:%Y%m%d}-{fcst_t2:%Y%m%d}.csv'
-        df = pd.read_csv(fcsv, parse_dates=False, usecols=cols)
+        df = read_csv(fcsv, parse_dates=False, usecols=cols)
         df = df[cols]
         df.drop(df.index, inplace=True)
 
@@ -108,7 +109,7 @@ def draw_table(staid, staname, fcst_type, fcst_t1, fcst_t2, fcst_update):
 ####
 def get_site_tools():
 
-    df_system_status = pd.read_csv(f'{cloud_url}/data/system_status.csv', parse_dates=True)
+    df_system_status = system_status()
     
     fcst_t1 = datetime.fromisoformat(df_system_status['ESP-WWRF Fcst'][0]).replace(month=3, day=1).date()
     fcst_t2 = datetime.fromisoformat(df_system_status['ESP-WWRF Fcst'][1]).replace(month=9, day=30).date()
@@ -124,7 +125,7 @@ def get_site_tools():
     else:
         tup1 = datetime(fcst_t1.year-1, 12, 1)
         tup2 = datetime(fcst_t1.year, 7, 1)
-    df_esp_wwrf_updates = pd.read_csv(f'{cloud_url}/data/cbrfc/esp_wwrf_updates.csv', parse_dates=True)
+    df_esp_wwrf_updates = read_csv(f'{cloud_url}/data/cbrfc/esp_wwrf_updates.csv', parse_dates=True)
     dt_updates = pd.to_datetime(df_esp_wwrf_updates['Date']).to_list()
     dt_updates.sort()
     tup_latest = dt_updates[-1]
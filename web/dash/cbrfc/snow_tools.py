@@ -9,6 +9,7 @@ import numpy as np
 from datetime import date, datetime, timedelta
 
 from config import base_url, snow_course_stations, snow_pillow_stations, graph_config, tool_style, tabtitle_style, tabtitle_selected_style, popup_ts_style
+from data_cache import read_csv
 
 # start to build maps
 ns = Namespace('dashExtensions', 'default')
@@ -18,9 +19,9 @@ ns = Namespace('dashExtensions', 'default')
 def draw_course(staid, ptype):
     if staid in snow_course_stations:
         fcsv = f'{base_url}/data/cdec/snow_course/SWE_monthly_{staid}.csv'
-        df = pd.read_csv(fcsv, parse_dates=True, index_col='Date')
+        df = read_csv(fcsv, parse_dates=True, index_col='Date')
         fcsv2 = f'{base_url}/data/{ptype}/sites/{staid}.csv'
-        df2 = pd.read_csv(fcsv2, parse_dates=True, index_col='Date')
+        df2 = read_csv(fcsv2, parse_dates=True, index_col='Date')
         fig_course = go.Figure()
         fig_course.add_trace(go.Scatter(x=df.index, y=df['SWE'], name='Snow Course SWE', mode='lines+markers', line=go.scatter.Line(color='black')))
         fig_course.add_trace(go.Scatter(x=df2.index, y=df2['SWE']/25.4, name='WRF-Hydro SWE', mode='lines', line=go.scatter.Line(color='magenta')))
@@ -39,10 +40,10 @@ def draw_course(staid, ptype):
 def draw_pillow(staid, ptype):
     if staid in snow_pillow_stations:
         fcsv = f'{base_url}/data/cdec/snow_pillow/SWE_daily_{staid}.csv'
-        df = pd.read_csv(fcsv, parse_dates=True, index_col='Date')
+        df = read_csv(fcsv, parse_dates=True, index_col='Date')
         df.drop(df[(df['SWE']<-10)|(df['SWE']>200)].index, inplace=True)
         fcsv2 = f'{base_url}/data/{ptype}/sites/{staid}.csv'
-        df2 = pd.read_csv(fcsv2, parse_dates=True, index_col='Date')
+        df2 = read_csv(fcsv2, parse_dates=True, index_col='Date')
         fig_course = go.Figure()
         fig_course.add_trace(go.Scatter(x=df.index, y=df['SWE'], name='Snow Pillow SWE', mode='lines', line=go.scatter.Line(color='black')))
         fig_course.add_trace(go.Scatter(x=df2.index, y=df2['SWE']/25.4, name='WRF-Hydro SWE', mode='lines', line=go.scatter.Line(color='magenta')))
@@ -6,16 +6,18 @@ import plotly.express as px
 import plotly.graph_objs as go
 import pandas as pd
 import numpy as np
+import os, sqlite3
 from datetime import date, datetime, timedelta
 
-from config import cloud_url, fnf_stations, fnf_id_names, graph_config, tool_style, tabtitle_style, tabtitle_selected_style, popup_ts_style, fig_ts_style
+from config import cloud_url, base_url, fnf_stations, fnf_id_names, graph_config, tool_style, tabtitle_style, tabtitle_selected_style, popup_ts_style, fig_ts_style
+from data_cache import read_csv, system_status
 
 # start to build maps
 ns = Namespace('dashExtensions', 'default')
 
 # draw system status chart
 def draw_system_status():
-    df_system_status = pd.read_csv(f'{cloud_url}/data/system_status.csv?update={datetime.now().microsecond}', parse_dates=True)
+    df_system_status = system_status()
     fig_system_status = go.Figure()
     i = 1
     for datastream,datatime in df_system_status.items():
@@ -38,8 +40,16 @@ def draw_system_status():
 # draw basin average time series
 def draw_basin_ts(staid, ptype):
     if staid in fnf_stations:
-        fcsv = f'{cloud_url}/data/cnrfc/{ptype}/averaged/{staid}_daily.csv'
-        df = pd.read_csv(fcsv, parse_dates=True, index_col='Date')
+        fdb = f'{base_url}/data/{ptype}/basins/averaged.db'
+        df = None
+        if os.path.isfile(fdb):
+            # basin store: one indexed range read of this basin's rows
+            conn = sqlite3.connect(fdb)
+            df = pd.read_sql_query('SELECT * FROM [daily] WHERE [Basin]=? ORDER BY Date', conn, params=(staid,), parse_dates=['Date'], index_col='Date')
+            conn.close()
+        if df is None or len(df)==0:
+            fcsv = f'{cloud_url}/data/cnrfc/{ptype}/averaged/{staid}_daily.csv'
+            df = read_csv(fcsv, parse_dates=True, index_col='Date')
         fig_nrt = go.Figure()
         fig_nrt.add_trace(go.Bar(x=df.index, y=df['PREC'], name='Precipitation'))
         fig_nrt.add_trace(go.Scatter(x=df.index, y=df['T2D'], name='Air Temperature', mode='markers', line=go.scatter.Line(color='orange'), yaxis='y2'))
@@ -10,6 +10,7 @@ import json
 
 # system status
 cloud_url = 'https://storage.googleapis.com/cw3e-water-panel.appspot.com'
+base_url  = '.'
 fcsv = f'{cloud_url}/data/system_status.csv?update={datetime.now().microsecond}'
 df_system_status = pd.read_csv(fcsv, parse_dates=True)
 
@@ -79,5 +80,6 @@ with open('assets/fnf_watershed_proj_tooltip_24.geojson', 'r') as f:
     geojson_basins = json.load(f)
 with open('assets/fnf_points_proj_tooltip_24.geojson', 'r') as f:
     geojson_points = json.load(f)
+fnf_coords = {p['properties']['Station_ID']: p['geometry']['coordinates'] for p in geojson_points['features']}
 
 
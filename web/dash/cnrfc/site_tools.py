@@ -12,14 +12,16 @@ from datetime import date, datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from glob import glob
 import os, json
+from urllib.error import HTTPError
 
-from config import cloud_url, domain_config, fnf_stations, fnf_id_names, graph_config, tabtitle_style, tabtitle_selected_style, popup_ts_style, fig_ts_style, geojson_basins, geojson_points
+from config import cloud_url, domain_config, fnf_stations, fnf_id_names, graph_config, tabtitle_style, tabtitle_selected_style, popup_ts_style, fig_ts_style, geojson_basins, fnf_coords
+from data_cache import read_csv, system_status
 
 # flow retro figure
 def draw_retro(staid):
     if staid in fnf_stations:
         fcsv = f'{cloud_url}/data/cnrfc/retro/combined/{staid}_monthly.csv'
-        df = pd.read_csv(fcsv, parse_dates=True, index_col='Date')
+        df = read_csv(fcsv, parse_dates=True, index_col='Date')
         fig_retro = px.line(df, labels={'Date': '', 'value': 'Flow (kaf/mon)'})
         fig_retro = go.Figure()
         fig_retro.add_trace(go.Scatter(x=df.index, y=df['FNF'],    name='Full Natural Flow', mode='lines+markers', line=go.scatter.Line(color='black', dash='dot')))
@@ -41,11 +43,11 @@ def draw_mofor(staid, fcst_type, fcst_t1, fcst_t2, fcst_update):
     nens = 45
     if staid in fnf_stations:
         fcsv = f'{cloud_url}/data/cnrfc/fcst/init{fcst_t1:%Y%m%d}_update{fcst_update:%Y%m%d}/basins/{fcst_type}/{staid}_{fcst_t1:%Y%m%d}-{fcst_t2:%Y%m%d}.csv' ; print(fcsv)
-        df = pd.read_csv(fcsv, parse_dates=True, index_col='Date', usecols = ['Date']+['Ens%02d' % (i+1) for i in range(nens)]+['Avg', 'Exc50', 'Exc90', 'Exc10'])
+        df = read_csv(fcsv, parse_dates=True, index_col='Date', usecols = ['Date']+['Ens%02d' % (i+1) for i in range(nens)]+['Avg', 'Exc50', 'Exc90', 'Exc10'])
         if fcst_t2.month>=7:
             df.drop(index=df.index[-1], axis=0, inplace=True)
-        fcsv2 = f'{cloud_url}/data/cnrfc/nrt/combined/{staid}_monthly.csv?update={datetime.now().microsecond}'
-        df2 = pd.read_csv(fcsv2, parse_dates=True, index_col='Date', usecols=['Date', 'FNF', 'Qsim', 'Qmatch'])
+        fcsv2 = f'{cloud_url}/data/cnrfc/nrt/combined/{staid}_monthly.csv'
+        df2 = read_csv(fcsv2, parse_dates=True, index_col='Date', usecols=['Date', 'FNF', 'Qsim', 'Qmatch'])
         fig_mofor = go.Figure()
         for e in range(1, nens+1):
             fig_mofor.add_trace(go.Scatter(x=df.index, y=df[f'Ens{e:02d}'], name=f'Ens{e:02d}', mode='lines+markers', line=go.scatter.Line(color='lightgray'), showlegend=False))
@@ -72,7 +74,7 @@ def draw_table(staid, staname, fcst_type, fcst_t1, fcst_t2, fcst_update):
     cols = ['Date', 'Exc50', 'Pav50', 'Exc90', 'Pav90', 'Exc10', 'Pav10', 'Avg']
     if staid in fnf_stations:
         fcsv = f'{cloud_url}/data/cnrfc/fcst/init{fcst_t1:%Y%m%d}_update{fcst_update:%Y%m%d}/basins/{fcst_type}/{staid}_{fcst_t1:%Y%m%d}-{fcst_t2:%Y%m%d}.csv'
-        df = pd.read_csv(fcsv, parse_dates=False, usecols=cols)
+        df = read_csv(fcsv, parse_dates=False, usecols=cols)
         df = df[cols]
         cols.remove('Date')
         df[cols] = np.rint(df[cols])
@@ -81,7 +83,7 @@ def draw_table(staid, staname, fcst_type, fcst_t1, fcst_t2, fcst_update):
             df.iloc[-1, 0] = df.iloc[-1, 0].replace('July', 'April-July total')
     else:
         fcsv = f'{cloud_url}/data/cnrfc/fcst/init{fcst_t1:%Y%m%d}_update{fcst_update:%Y%m%d}/basins/{fcst_type}/{staid}_{fcst_t1:%Y%m%d}-{fcst_t2:%Y%m%d}.csv'
-        df = pd.read_csv(fcsv, parse_dates=False, usecols=cols)
+        df = read_csv(fcsv, parse_dates=False, usecols=cols)
         df = df[cols]
         df.drop(df.index, inplace=True)
 
@@ -105,13 +107,29 @@ def draw_table(staid, staname, fcst_type, fcst_t1, fcst_t2, fcst_update):
     table_note = html.Div('  [Note] 50%, 90%, 10%: exceedance levels within the forecast ensemble. AVG: month of year average during 1979-2023. %AVG: percentage of AVG. KAF: kilo-acre-feet.', id='table-note', style={'font-size': 'small'})
     return [table_fcst, table_note]
 
+# forecast summary of all FNF stations in one file, None for updates made before it was produced
+def read_summary(fcst_type, fcst_t1, fcst_t2, fcst_update):
+    fcsv = f'{cloud_url}/data/cnrfc/fcst/init{fcst_t1:%Y%m%d}_update{fcst_update:%Y%m%d}/basins/{fcst_type}/summary_{fcst_t1:%Y%m%d}-{fcst_t2:%Y%m%d}.csv'
+    try:
+        df_sum = read_csv(fcsv, parse_dates=False, dtype={'Date': str, 'StationID': str})
+    except (HTTPError, FileNotFoundError):
+        return None
+    return {staid: df.reset_index(drop=True) for staid,df in df_sum.groupby('StationID')}
+
+# forecast of one FNF station, from the summary if there is one
+def read_station(df_sum, staid, cols, fcst_type, fcst_t1, fcst_t2, fcst_update):
+    if df_sum is not None and staid in df_sum:
+        return df_sum[staid][cols].copy()
+    fcsv = f'{cloud_url}/data/cnrfc/fcst/init{fcst_t1:%Y%m%d}_update{fcst_update:%Y%m%d}/basins/{fcst_type}/{staid}_{fcst_t1:%Y%m%d}-{fcst_t2:%Y%m%d}.csv'
+    return read_csv(fcsv, parse_dates=False, usecols=cols, dtype={'Date': str})
+
 # forecast tables over all FNF stations
 def draw_table_all(fcst_type, fcst_t1, fcst_t2, fcst_update):
-    cnt = 0
+    df_sum = read_summary(fcst_type, fcst_t1, fcst_t2, fcst_update)
+    dfs = []
     for staid,staname in fnf_id_names.items():
         cols = ['Date', 'Exc50', 'Pav50', 'Exc90', 'Pav90', 'Exc10', 'Pav10', 'Avg']
-        fcsv = f'{cloud_url}/data/cnrfc/fcst/init{fcst_t1:%Y%m%d}_update{fcst_update:%Y%m%d}/basins/{fcst_type}/{staid}_{fcst_t1:%Y%m%d}-{fcst_t2:%Y%m%d}.csv'
-        df = pd.read_csv(fcsv, parse_dates=False, usecols=cols)
+        df = read_station(df_sum, staid, cols, fcst_type, fcst_t1, fcst_t2, fcst_update)
         df = df[cols]
         cols.remove('Date')
         df[cols] = np.rint(df[cols])
@@ -121,11 +139,8 @@ def draw_table_all(fcst_type, fcst_t1, fcst_t2, fcst_update):
         df.loc[-1] = ['' if i>0 else staname for i in range(df.shape[1])]
         df.index = df.index + 1  # shifting index
         df.sort_index(inplace=True)
-        if cnt==0:
-            df_all = df
-        else:
-            df_all = pd.concat([df_all, df], ignore_index=True)
-        cnt += 1
+        dfs.append(df)
+    df_all = pd.concat(dfs, ignore_index=True)
     #df_all.drop(df_all.tail(1).index, inplace=True)
     table_fcst = dash_table.DataTable(id='fcst-table',
                      #columns=[{'name': i, 'id': i} for i in df.columns],
@@ -152,22 +167,19 @@ def draw_table_all(fcst_type, fcst_t1, fcst_t2, fcst_update):
     return [table_fcst]
 
 def draw_map(fcst_type, fcst_t1, fcst_t2, fcst_update):
-    cnt = 0
+    df_sum = read_summary(fcst_type, fcst_t1, fcst_t2, fcst_update)
+    dfs = []
     for staid,staname in fnf_id_names.items():
         cols = ['Date', 'Exc50', 'Pav50', 'Exc90', 'Pav90', 'Exc10', 'Pav10', 'Avg']
-        fcsv = f'{cloud_url}/data/cnrfc/fcst/init{fcst_t1:%Y%m%d}_update{fcst_update:%Y%m%d}/basins/{fcst_type}/{staid}_{fcst_t1:%Y%m%d}-{fcst_t2:%Y%m%d}.csv'
-        df = pd.read_csv(fcsv, parse_dates=False, usecols=cols, dtype={'Date': str})
+        df = read_station(df_sum, staid, cols, fcst_type, fcst_t1, fcst_t2, fcst_update)
         df = df.tail(1)
         df = df.rename(columns={'Date': 'StationID'})
         df.iloc[-1, 0] = staid
-        [lon, lat] = [ geojson_points['features'][i]['geometry']['coordinates'] for i in range(len(geojson_points['features'])) if geojson_points['features'][i]['properties']['Station_ID']==staid ][0]
+        [lon, lat] = fnf_coords[staid]
         df['lat'] = [lat]
         df['lon'] = [lon]
-        if cnt==0:
-            df_all = df
-        else:
-            df_all = pd.concat([df_all, df], ignore_index=True)
-        cnt += 1
+        dfs.append(df)
+    df_all = pd.concat(dfs, ignore_index=True)
     fig_b = px.choropleth_map(df_all, featureidkey='properties.Station', geojson=geojson_basins, locations='StationID', color='Pav50',
                            color_continuous_scale='BrBG', range_color=(0, 200),
                            map_style='carto-positron', opacity=0.7,
@@ -183,7 +195,7 @@ def draw_map(fcst_type, fcst_t1, fcst_t2, fcst_update):
 
 def get_site_tools():
 
-    df_system_status = pd.read_csv(f'{cloud_url}/data/system_status.csv?update={datetime.now().microsecond}', parse_dates=True)
+    df_system_status = system_status()
     
     fcst_t1 = datetime.fromisoformat(df_system_status['ESP-WWRF Fcst'][0]).date()
     fcst_t2 = datetime.fromisoformat(df_system_status['ESP-WWRF Fcst'][1]).date()
@@ -199,7 +211,7 @@ def get_site_tools():
     else:
         tup1 = datetime(fcst_t1.year-1, 12, 1)
         tup2 = datetime(fcst_t1.year, 7, 1)
-    df_esp_wwrf_updates = pd.read_csv(f'{cloud_url}/data/cnrfc/esp_wwrf_updates.csv', parse_dates=True)
+    df_esp_wwrf_updates = read_csv(f'{cloud_url}/data/cnrfc/esp_wwrf_updates.csv', parse_dates=True)
     dt_updates = pd.to_datetime(df_esp_wwrf_updates['Date']).to_list()
     dt_updates.sort()
     tup_latest = dt_updates[-1]
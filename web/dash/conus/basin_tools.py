@@ -6,16 +6,18 @@ import plotly.express as px
 import plotly.graph_objs as go
 import pandas as pd
 import numpy as np
+import os, sqlite3
 from datetime import date, datetime, timedelta
 
-from config import cloud_url, huc8_basins, fnf_id_names, graph_config, tool_style, tabtitle_style, tabtitle_selected_style, popup_ts_style, fig_ts_style
+from config import cloud_url, base_url, huc8_basins, fnf_id_names, graph_config, tool_style, tabtitle_style, tabtitle_selected_style, popup_ts_style, fig_ts_style
+from data_cache import read_csv, system_status
 
 # start to build maps
 ns = Namespace('dashExtensions', 'default')
 
 # draw system status chart
 def draw_system_status():
-    df_system_status = pd.read_csv(f'{cloud_url}/data/system_status.csv', parse_dates=True)
+    df_system_status = system_status()
     fig_system_status = go.Figure()
     i = 1
     for datastream,datatime in df_system_status.items():
@@ -39,9 +41,16 @@ def draw_system_status():
 def draw_basin_ts(staid, ptype, btype, freq):
     punits = 'mm/day' if freq=='daily' else 'mm/mon'
     if staid[:8] in huc8_basins:
-        fcsv = f'{cloud_url}/data/conus/{ptype}/{btype}/{staid[:4]}_{freq}.csv.gz' #; print(fcsv)
-        df_all = pd.read_csv(fcsv, compression='gzip', parse_dates=True, index_col='Date', dtype={btype.upper(): str})
-        df = df_all[df_all[btype.upper()]==staid]
+        fdb = f'{base_url}/data/{ptype}/basins/{btype}.db'
+        if os.path.isfile(fdb):
+            # basin store: one indexed range read of this basin's rows
+            conn = sqlite3.connect(fdb)
+            df = pd.read_sql_query(f'SELECT * FROM [{freq}] WHERE [{btype.upper()}]=? ORDER BY Date', conn, params=(staid,), parse_dates=['Date'], index_col='Date')
+            conn.close()
+        else:
+            fcsv = f'{cloud_url}/data/conus/{ptype}/{btype}/{staid[:4]}_{freq}.csv.gz' #; print(fcsv)
+            df_all = read_csv(fcsv, compression='gzip', parse_dates=True, index_col='Date', dtype={btype.upper(): str})
+            df = df_all[df_all[btype.upper()]==staid]
         #print(df_all.head())
         #print(df.head())
         if ptype=='nrt' and freq=='daily' and False:
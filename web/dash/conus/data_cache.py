@@ -0,0 +1,84 @@
+#### Cached data access for the callbacks
+
+import os, time, json, hashlib, threading
+from collections import OrderedDict
+from datetime import datetime
+import pandas as pd
+
+from config import cloud_url
+
+# cache settings, DATA_CACHE_DIR turns on the on-disk copy shared by workers/restarts
+status_url   = f'{cloud_url}/data/system_status.csv'
+status_check = int(os.environ.get('DATA_CACHE_STATUS_CHECK', 60))   # seconds between system status checks
+max_entries  = int(os.environ.get('DATA_CACHE_MAX_ENTRIES', 256))
+cache_dir    = os.environ.get('DATA_CACHE_DIR', '')
+
+lock  = threading.Lock()
+cache = OrderedDict()
+stats = {'hits': 0, 'misses': 0, 'disk_hits': 0, 'invalidations': 0}
+status = {'checked': 0.0, 'version': None, 'df': None}
+
+# short hash of a string
+def digest(s):
+    return hashlib.sha1(s.encode()).hexdigest()[:16]
+
+# drop the memory cache and the disk copies made under other system status versions
+def clear(version):
+    cache.clear()
+    if cache_dir and os.path.isdir(cache_dir):
+        for f in os.listdir(cache_dir):
+            if f.endswith('.pkl') and not f.startswith(version):
+                try:
+                    os.remove(f'{cache_dir}/{f}')
+                except FileNotFoundError:
+                    pass
+
+# system status table, re-fetched at most every status_check seconds; the cache lives until it changes
+def system_status():
+    with lock:
+        if status['df'] is None or time.time()-status['checked']>status_check:
+            df = pd.read_csv(f'{status_url}?update={datetime.now().microsecond}', parse_dates=True)
+            version = digest(df.to_csv())
+            if version!=status['version']:
+                if status['version'] is not None:
+                    stats['invalidations'] += 1
+                clear(version)
+                status['version'] = version
+            status['df'] = df
+            status['checked'] = time.time()
+        return status['df'].copy()
+
+# pd.read_csv with an LRU cache keyed by url and arguments, returns a copy the caller may modify
+def read_csv(url, **kwargs):
+    system_status()
+    key = digest(repr((url, sorted(kwargs.items()))))
+    with lock:
+        if key in cache:
+            cache.move_to_end(key)
+            stats['hits'] += 1
+            return cache[key].copy()
+    fpkl = f'{cache_dir}/{status["version"]}_{key}.pkl' if cache_dir else ''
+    if fpkl and os.path.isfile(fpkl):
+        df = pd.read_pickle(fpkl)
+        with lock:
+            stats['disk_hits'] += 1
+    else:
+        df = pd.read_csv(url, **kwargs)
+        with lock:
+            stats['misses'] += 1
+        if fpkl:
+            # written under a name private to this worker/thread and renamed, other workers never see a partial pickle
+            os.makedirs(cache_dir, exist_ok=True)
+            ftmp = f'{fpkl}.{os.getpid()}.{threading.get_ident()}.tmp'
+            df.to_pickle(ftmp)
+            os.replace(ftmp, fpkl)
+    with lock:
+        cache[key] = df
+        while len(cache)>max_entries:
+            cache.popitem(last=False)
+    return df.copy()
+
+# counters for the /debug/cache endpoint, served only with DATA_CACHE_DEBUG set
+def cache_info():
+    return json.dumps(dict(stats, entries=len(cache), max_entries=max_entries, disk=cache_dir,
+                           status_checked=datetime.fromtimestamp(status['checked']).isoformat() if status['checked'] else None))
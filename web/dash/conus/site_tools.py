@@ -14,6 +14,7 @@ from glob import glob
 import os
 
 from config import base_url, cloud_url, usgs_gages, graph_config, tabtitle_style, tabtitle_selected_style, popup_ts_style
+from data_cache import read_csv, system_status
 
 # flow retro figure
 def draw_gage(staid, ptype):
@@ -22,7 +23,7 @@ def draw_gage(staid, ptype):
         ind = [i for i, value in enumerate(usgs_gages) if value == staid][0]
         fileno = '%03d' % (int(ind/sites_per_file))
         fcsv = f'{cloud_url}/data/conus/{ptype}/combined/{fileno}_daily.csv.gz' #; print(fcsv)
-        df_all = pd.read_csv(fcsv, parse_dates=True, compression='gzip', index_col='Date', dtype={'gage_id': str})
+        df_all = read_csv(fcsv, parse_dates=True, compression='gzip', index_col='Date', dtype={'gage_id': str})
         df = df_all[df_all['gage_id']==staid]
         df.loc[df['Qsim'] < 0, 'Qsim'] = np.nan
         df.loc[df['Qobs'] < 0, 'Qobs'] = np.nan
@@ -50,11 +51,11 @@ def draw_mofor(staid, fcst_type, fcst_t1, fcst_t2, fcst_update):
     nens = 45
     if staid in fnf_stations:
         fcsv = f'{base_url}/data/fcst/init{fcst_t1:%Y%m%d}_update{fcst_update:%Y%m%d}/basins/{fcst_type}/{staid}_{fcst_t1:%Y%m%d}-{fcst_t2:%Y%m%d}.csv'
-        df = pd.read_csv(fcsv, parse_dates=True, index_col='Date', usecols = ['Date']+['Ens%02d' % (i+1) for i in range(nens)]+['Avg', 'Exc50', 'Exc90', 'Exc10'])
+        df = read_csv(fcsv, parse_dates=True, index_col='Date', usecols = ['Date']+['Ens%02d' % (i+1) for i in range(nens)]+['Avg', 'Exc50', 'Exc90', 'Exc10'])
         if fcst_t2.month>=7:
             df.drop(index=df.index[-1], axis=0, inplace=True)
         fcsv2 = f'{base_url}/data/nrt/combined/{staid}_monthly.csv'
-        df2 = pd.read_csv(fcsv2, parse_dates=True, index_col='Date', usecols=['Date', 'FNF', 'Qsim', 'Qmatch'])
+        df2 = read_csv(fcsv2, parse_dates=True, index_col='Date', usecols=['Date', 'FNF', 'Qsim', 'Qmatch'])
         fig_mofor = go.Figure()
         for e in range(1, nens+1):
             fig_mofor.add_trace(go.Scatter(x=df.index, y=df[f'Ens{e:02d}'], name=f'Ens{e:02d}', mode='lines+markers', line=go.scatter.Line(color='lightgray'), showlegend=False))
@@ -78,7 +79,7 @@ def draw_mofor(staid, fcst_type, fcst_t1, fcst_t2, fcst_update):
 
 def get_site_tools():
 
-    df_system_status = pd.read_csv(f'{cloud_url}/data/system_status.csv', parse_dates=True)
+    df_system_status = system_status()
     
     staid0     = '11460000'
 